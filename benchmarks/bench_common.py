@@ -0,0 +1,58 @@
+# Helpers shared by the benchmarks: latency summaries and the machine-readable output. Every result is printed as
+# one JSON object per line, and with '--out' the run is also saved as one JSON document holding the results and
+# what they were measured on, so runs of different releases can be compared
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def percentile(values, share):     # 'share' in [0, 1], nearest rank
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(share * len(ordered)), len(ordered) - 1)]
+
+
+def latency_summary(seconds):   # Latencies in seconds -> ms summary
+    return {
+        "p50_ms": round(percentile(seconds, 0.50) * 1000, 3) if seconds else None,
+        "p99_ms": round(percentile(seconds, 0.99) * 1000, 3) if seconds else None,
+        "max_ms": round(max(seconds) * 1000, 3) if seconds else None
+    }
+
+
+def run_info(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True, text=True,
+                                timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "started": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": vars(args)
+    }
+
+
+class Results:
+    def __init__(self, args):
+        self.run = run_info(args)
+        self.out = getattr(args, "out", None)
+        self.results = []
+
+    def add(self, result):
+        self.results.append(result)
+        print(json.dumps(result), flush=True)
+
+    def save(self):
+        if self.out:
+            with open(self.out, "w") as file:
+                json.dump({"run": self.run, "results": self.results}, file, indent=1)
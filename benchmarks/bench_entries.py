@@ -0,0 +1,82 @@
+# LogEntry benchmark. Compares memory per entry and construction speed of the current LogEntry against the
+# original dict based one (kept below as LegacyLogEntry). Prints one JSON object per result
+# Usage: python benchmarks/bench_entries.py [--entries 200000]
+import argparse
+import datetime
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import log_server                                                          # noqa: E402
+from log_server import LogEntry                                            # noqa: E402
+from bench_registry import legacy_nickname, legacy_severity_flavor_keys, legacy_user_shade_flavor_keys  # noqa: E402
+
+sources = ["https://sd-rdm.herokuapp.com", "https://sd-mgs.herokuapp.com", "https://sd-dmss.herokuapp.com", "Internal"]
+severities = ["Information", "Warning", "Error", "Success"]
+
+
+class LegacyLogEntry:   # LogEntry as it was before the compact representation
+    def __init__(self, s_from="Unknown", severity="Information", comm="Not Specified", body=None):
+        now = datetime.datetime.now()
+        self.msg_id = 0
+        self.log_from = s_from + legacy_nickname(s_from)
+        self.severity = severity
+        self.comment = comm
+        self.timestamp = now.strftime(log_server.timestamp_format)
+        self.ts = now.timestamp()
+        self.body = body
+        self.flavor = {
+            "severity": legacy_severity_flavor_keys(severity),
+            "user_shade": legacy_user_shade_flavor_keys()
+        }
+
+    def json(self):
+        return {"id": self.msg_id, "from": self.log_from, "severity": self.severity, "comment": self.comment,
+                "timestamp": self.timestamp, "ts": self.ts, "body": self.body, "flavor": self.flavor}
+
+
+def arguments(count):   # Fresh strings for every entry, like the ones parsed from requests
+    return [("".join(sources[i % 4]), "".join(severities[i % 4]), f"Comment {i}", None) for i in range(count)]
+
+
+def measure(cls, args):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    entries = [cls(*arg) for arg in args]
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del entries
+    return size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=200000)
+    args = parser.parse_args()
+    for cls in (LegacyLogEntry, LogEntry):
+        size, _ = measure(cls, arguments(args.entries))     # tracemalloc slows things down, so time it apart
+        gc.collect()
+        data = arguments(args.entries)
+        start = time.perf_counter()
+        entries = [cls(*arg) for arg in data]
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        for entry in entries[:10000]:
+            entry.json()
+        render = (time.perf_counter() - start) / min(args.entries, 10000)
+        print(json.dumps({"bench": "entry", "class": cls.__name__, "entries": args.entries,
+                          "bytes_per_entry": round(size / args.entries, 1),
+                          "entries_per_s": round(args.entries / elapsed),
+                          "json_us": round(render * 1e6, 2)}))
+        del entries
+
+
+if __name__ == "__main__":
+    main()
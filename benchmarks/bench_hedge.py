@@ -0,0 +1,73 @@
+# Hedged request benchmark. Times 'ask_resource' and 'simulate_election' against local stub peers of mixed health:
+# hung ones (answer after the read timeout), failing ones (500) and healthy ones of different latency. Asked one
+# after the other, as when the hedge delay is longer than the deadline, a run waits out every hung peer shuffled in
+# before a healthy one; hedged, it takes about as long as the fastest healthy peer. Prints one JSON object per result
+# Usage: python benchmarks/bench_hedge.py [--hung 3] [--failing 2] [--healthy 0.02,0.2] [--runs 30]
+#                                         [--hedge-delay 0.05] [--timeout 1] [--deadline 5] [--out results.json]
+import argparse
+import collections
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_common import Results, latency_summary   # noqa: E402
+from stub_peers import StubPeer                     # noqa: E402
+import server_services                              # noqa: E402
+from peer_client import PeerClient                  # noqa: E402
+
+services = {
+    "ask_resource": lambda urls, deadline: server_services.ask_resource(urls, deadline),
+    "simulate_election": lambda urls, deadline: server_services.simulate_election(urls, "ring", deadline)
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hung", type=int, default=3)          # Peers answering only after the read timeout
+    parser.add_argument("--failing", type=int, default=2)       # Peers answering 500
+    parser.add_argument("--healthy", default="0.02,0.2")        # Seconds each healthy peer takes to answer
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--hedge-delay", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=1.0)   # Read timeout of every call
+    parser.add_argument("--deadline", type=float, default=5.0)  # Seconds a service run may take
+    parser.add_argument("--workers", type=int, default=16)      # Hung stragglers hold a worker until they time out
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    results = Results(args)
+    delays = [float(delay) for delay in args.healthy.split(",")]
+    peers = ([StubPeer(index, fail_rate=1.0, fail_mode="hang", hang=args.timeout * 2, seed=index)
+              for index in range(args.hung)] +
+             [StubPeer(args.hung + index, fail_rate=1.0, fail_mode="error", seed=index) for index in range(args.failing)] +
+             [StubPeer(args.hung + args.failing + index, delay=delay) for index, delay in enumerate(delays)])
+    for peer in peers:
+        peer.start()
+    urls = [peer.url for peer in peers]
+    client = server_services.peer_client = PeerClient(workers=args.workers, read_timeout=args.timeout,
+                                                      deadline=args.deadline)
+    try:
+        for name, service in services.items():
+            for mode, hedge_delay in (("sequential", args.deadline), ("hedged", args.hedge_delay)):
+                client.hedge_delay = hedge_delay
+                times = []
+                outcomes = collections.Counter()
+                for _ in range(args.runs):
+                    start = time.perf_counter()
+                    entries = service(list(urls), client.new_deadline())
+                    times.append(time.perf_counter() - start)
+                    outcomes[entries[-1][0]] += 1
+                result = {"bench": "hedge", "service": name, "mode": mode, "hedge_delay_ms": hedge_delay * 1000,
+                          "hung": args.hung, "failing": args.failing, "fastest_healthy_ms": min(delays) * 1000,
+                          "timeout_ms": args.timeout * 1000, "runs": args.runs, "outcomes": dict(outcomes)}
+                result.update(latency_summary(times))
+                results.add(result)
+    finally:
+        client.close()
+        for peer in peers:
+            peer.close()
+    results.save()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# HTTP benchmark driven through the WSGI app, so it measures the server and not a network. Fills the log with
+# '--entries' entries, then sends '--requests' requests to each route from each '--concurrency' level of client
+# threads, reporting throughput and p50/p99 latency per route
+# Usage: python benchmarks/bench_http.py [--entries 10000] [--requests 2000] [--concurrency 1,4,16] [--html]
+#                                        [--out results.json]
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.pop("LOG_DATA_DIR", None)    # In memory only, so runs don't depend on the disk or on each other
+
+from bench_common import Results, latency_summary   # noqa: E402
+import log_server                                   # noqa: E402
+
+
+def post_entry(client, index, html):
+    entry = {"from": f"https://bench-{index % 8}.local", "severity": ("Information", "Warning", "Error")[index % 3],
+             "comment": f"Benchmark entry {index}", "body": {"n": index, "peer": "x" * 40}}
+    headers = {"Accept": "text/html"} if html else {"X-Log-Ack": "1"}
+    return client.post("/log", json=entry, headers=headers)
+
+
+def routes(html):   # tuple(<name>, <call(client, index)>)
+    def page(path):
+        def call(client, index):    # Random pages, so it is not only the first one and its cached rows
+            pages = max(len(log_server.log_store) + len(log_server.cold_store), 1) // 20
+            return client.get(f"{path}?epp=20&p={random.randint(1, max(pages, 1))}")
+        return call
+    return [
+        ("POST /log", lambda client, index: post_entry(client, index, html)),
+        ("GET /log", lambda client, index: client.get("/log")),
+        ("GET /log random page", page("/log")),
+        ("GET /log/old random page", page("/log/old")),
+        ("GET /server/status", lambda client, index: client.get("/server/status"))
+    ]
+
+
+def drive(call, requests, concurrency):     # tuple(<latencies>, <errors>, <seconds>)
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    share = [requests // concurrency + (1 if index < requests % concurrency else 0) for index in range(concurrency)]
+
+    def worker(count, first):
+        client = log_server.app.test_client()
+        mine = []
+        failed = 0
+        for index in range(first, first + count):
+            start = time.perf_counter()
+            response = call(client, index)
+            mine.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(count, sum(share[:index]))) for index, count in enumerate(share)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=10000)       # Held before measuring
+    parser.add_argument("--requests", type=int, default=2000)       # Per route and concurrency level
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--html", action="store_true")              # POST /log answers with the page, like browsers
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    random.seed(0)
+    results = Results(args)
+    filler = [log_server.LogEntry(f"https://bench-{i % 8}.local", ("Information", "Warning", "Error")[i % 3],
+                                  f"Filler entry {i}", {"n": i}) for i in range(args.entries)]
+    log_server.log_writer.extend(filler)
+    for concurrency in (int(value) for value in args.concurrency.split(",")):
+        for name, call in routes(args.html):
+            latencies, errors, seconds = drive(call, args.requests, concurrency)
+            result = {"bench": "http", "route": name, "entries": args.entries, "concurrency": concurrency,
+                      "requests": len(latencies), "errors": errors,
+                      "requests_per_s": round(len(latencies) / seconds, 1)}
+            result.update(latency_summary(latencies))
+            results.add(result)
+    results.save()
+    log_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# Outbound fan-out benchmark. Starts local stub peers answering '/info' after a set delay, then times 'pull_info'
+# through the pooled client against the old thread per peer with bare 'requests' calls. With every peer healthy
+# both take about as long as the slowest peer; with one hung peer the old way waits for it while the pooled one stops
+# at the deadline. Prints one JSON object per result
+# Usage: python benchmarks/bench_peers.py [--peers 6] [--runs 20] [--hang 5] [--deadline 1]
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import server_services                  # noqa: E402
+from peer_client import PeerClient      # noqa: E402
+from stub_peers import StubPeer         # noqa: E402
+
+
+def legacy_pull_info(urls):     # The old fan-out: one raw thread and one new connection per peer, no timeout
+    data = []
+
+    def request_info(target):
+        try:
+            data.append((0, target, requests.get(target + "/info").json()))
+        except requests.ConnectionError:
+            data.append((1, target, None))
+
+    threads = [threading.Thread(target=request_info, args=(url,)) for url in urls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return data
+
+
+def timed(call, runs):
+    times = []
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = call()
+        times.append(time.perf_counter() - start)
+    return times, result
+
+
+def report(scenario, client, times, delays, online):
+    return {"bench": "pull_info", "scenario": scenario, "client": client, "runs": len(times),
+            "slowest_peer_ms": round(max(delays) * 1000, 1),
+            "p50_ms": round(statistics.median(times) * 1000, 1), "max_ms": round(max(times) * 1000, 1),
+            "online": online}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--peers", type=int, default=6)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--hang", type=float, default=5.0)      # Seconds the hung peer takes to answer
+    parser.add_argument("--deadline", type=float, default=1.0)  # Service deadline of the pooled client
+    args = parser.parse_args()
+    server_services.peer_client = PeerClient(read_timeout=args.deadline, deadline=args.deadline)
+    healthy = [0.01 + 0.04 * index / max(args.peers - 1, 1) for index in range(args.peers)]
+    scenarios = [("healthy", healthy, args.runs), ("one_hung", healthy[:-1] + [args.hang], 2)]
+    for scenario, delays, runs in scenarios:
+        peers = [StubPeer(index, delay).start() for index, delay in enumerate(delays)]
+        urls = [peer.url for peer in peers]
+        try:
+            times, data = timed(lambda: legacy_pull_info(urls), runs)
+            print(json.dumps(report(scenario, "legacy", times, delays, sum(1 for svr in data if svr[0] == 0))))
+            server_services.pull_info(urls, fresh=True)     # Warm the pool, as a running server would have it
+            times, (pi_data, valid, invalid) = timed(lambda: server_services.pull_info(urls, fresh=True), runs)
+            print(json.dumps(report(scenario, "pooled", times, delays, len(valid))))
+        finally:
+            for peer in peers:
+                peer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# Entry classification benchmark. Times what labelling an entry costs (displayed source name, user shade and severity
+# flavor) with the compiled registry against the original substring and if chains (kept below as the legacy_
+# functions), both on first sight of a source or severity ("cold", nothing cached) and for ones seen before ("warm",
+# where both sit behind a per source and per severity cache).
+# Prints one JSON object per result
+# Usage: python benchmarks/bench_registry.py [--entries 200000] [--sources 4096]
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_common import Results                                # noqa: E402
+from log_registry import load_registry, DEFAULT_REGISTRY, _host     # noqa: E402
+
+severities = ["Information", "Warning", "erro", "Sucesso", "CRITICAL", "alerta"]
+
+
+def legacy_nickname(url):   # Before the registry
+    if "https://sd-rdm.herokuapp.com" in url:
+        return " (Ramon)"
+    elif "https://sd-201620236.herokuapp.com" in url:
+        return " (Saionara)"
+    elif "https://sd-jhsq.herokuapp.com" in url:
+        return " (João)"
+    elif "https://sd-app-server-jesulino.herokuapp.com" in url:
+        return " (Jesulino)"
+    elif "https://sd-mgs.herokuapp.com" in url:
+        return " (Maira)"
+    elif "https://sd-dmss.herokuapp.com" in url:
+        return " (Diêgo)"
+    return ""
+
+
+def legacy_severity_flavor_keys(severity):
+    sev = severity.lower()
+    if sev == "warning" or sev == "aviso":
+        return "sev_warning"
+    if sev == "attention" or sev == "atencao" or sev == "alerta":
+        return "sev_attention"
+    if sev == "error" or sev == "erro":
+        return "sev_error"
+    if sev == "critical" or sev == "critico":
+        return "sev_critical"
+    if sev == "success" or sev == "sucesso":
+        return "sev_success"
+    else:
+        return "sev_default"
+
+
+def legacy_user_shade_flavor_keys():
+    return "usr_default"
+
+
+def legacy_classify(s_from, severity):
+    return s_from + legacy_nickname(s_from), legacy_user_shade_flavor_keys(), legacy_severity_flavor_keys(severity)
+
+
+def legacy_cached():    # The legacy functions behind the per source and per severity caches, as the server had them
+    source_names = {}
+    severity_names = {}
+
+    def source_name(s_from):
+        name = source_names.get(s_from)
+        if name is None:
+            name = source_names[s_from] = sys.intern(s_from + legacy_nickname(s_from))
+        return name
+
+    def severity_codes(severity):
+        codes = severity_names.get(severity)
+        if codes is None:
+            codes = severity_names[severity] = (sys.intern(severity), legacy_severity_flavor_keys(severity))
+        return codes
+
+    def classify(s_from, severity):
+        name = source_name(s_from)
+        severity, key = severity_codes(severity)
+        return name, legacy_user_shade_flavor_keys(), key
+    return classify
+
+
+def arguments(count, distinct):     # Fresh strings, like the ones parsed from requests. Peers and other sources
+    peers = [peer["url"] for peer in DEFAULT_REGISTRY["peers"]]
+    sources = [peers[i % len(peers)] if i % 2 else f"https://client-{i}.local" for i in range(distinct)]
+    return [("".join(sources[i % distinct]), "".join(severities[i % len(severities)])) for i in range(count)]
+
+
+def timed(classify, args):  # ns per entry
+    start = time.perf_counter()
+    for s_from, severity in args:
+        classify(s_from, severity)
+    return (time.perf_counter() - start) / len(args) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=200000)
+    parser.add_argument("--sources", type=int, default=4096)   # Distinct sources the entries come from
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    results = Results(args)
+    entries = arguments(args.entries, args.sources)
+
+    def compiled(registry):     # As LogEntry does it
+        def classify(s_from, severity):
+            name, shade = registry.sources.get(s_from) or registry.source(s_from)
+            severity, key = registry.severities.get(severity) or registry.severity(severity)
+            return name, shade, key
+        return classify
+
+    def cold(s_from, severity):     # Compiled tables, nothing cached
+        nickname, shade = registry._hosts.get(_host(s_from), ("", registry.default_shade))
+        return s_from + nickname, shade, registry.severity_key(severity)
+
+    registry = load_registry(DEFAULT_REGISTRY)
+    warm = compiled(registry)
+    legacy_warm = legacy_cached()
+    timed(warm, entries)    # Fills the caches
+    timed(legacy_warm, entries)
+    for name, classify in (("legacy_cold", legacy_classify), ("registry_cold", cold), ("legacy_warm", legacy_warm),
+                           ("registry_warm", warm)):
+        per_entry = min(timed(classify, entries) for _ in range(3))
+        results.add({"bench": "registry", "scenario": name, "entries": args.entries, "sources": args.sources,
+                     "ns_per_entry": round(per_entry, 1)})
+    start = time.perf_counter()
+    for _ in range(100):
+        load_registry(DEFAULT_REGISTRY)
+    results.add({"bench": "registry", "scenario": "compile", "ms": round((time.perf_counter() - start) * 10, 3)})
+    results.save()
+
+
+if __name__ == "__main__":
+    main()
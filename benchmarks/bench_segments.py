@@ -0,0 +1,76 @@
+# Segment storage benchmark. Measures ingestion with and without persistence, and how long a restart takes to
+# recover the recent window for several segment sizes. Prints one JSON object per result
+# Usage: python benchmarks/bench_segments.py [--entries 200000] [--window 100000]
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from log_segments import SegmentLog, FSYNC_POLICIES   # noqa: E402
+from log_server import LogEntry                       # noqa: E402
+from log_store import LogStore                        # noqa: E402
+
+
+def make_entries(count):
+    entries = [LogEntry("https://sd-rdm.herokuapp.com", "Warning", f"Benchmark entry {i}", {"n": i, "peer": "x" * 40})
+               for i in range(count)]
+    for i, entry in enumerate(entries):     # The store is fed directly here, so give the ids 'log_writer' would
+        entry.msg_id = i
+    return entries
+
+
+def ingest(entries, directory=None, segment_bytes=16 * 1024 * 1024, fsync=None):
+    store = LogStore(len(entries))
+    segment_log = None
+    if directory is not None:
+        segment_log = SegmentLog(directory, segment_bytes=segment_bytes, fsync=fsync, max_segments=1 << 20)
+        store.add_listener(segment_log.on_store_event)
+        segment_log.start()
+    start = time.perf_counter()
+    for entry in entries:
+        store.append(entry)
+    appended = time.perf_counter() - start
+    if segment_log is not None:
+        segment_log.close()     # Waits for the writer to drain
+    return appended, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=200000)
+    parser.add_argument("--window", type=int, default=100000)
+    args = parser.parse_args()
+    entries = make_entries(args.entries)
+    appended, _ = ingest(entries)
+    print(json.dumps({"bench": "ingest", "storage": "memory", "entries": args.entries,
+                      "entries_per_s": round(args.entries / appended)}))
+    for fsync in FSYNC_POLICIES:
+        directory = tempfile.mkdtemp(prefix="bench_segments_")
+        try:
+            appended, drained = ingest(entries, directory, fsync=fsync)
+            print(json.dumps({"bench": "ingest", "storage": "segments", "fsync": fsync, "entries": args.entries,
+                              "entries_per_s": round(args.entries / appended),
+                              "durable_entries_per_s": round(args.entries / drained)}))
+        finally:
+            shutil.rmtree(directory)
+    for segment_bytes in (256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024):
+        directory = tempfile.mkdtemp(prefix="bench_segments_")
+        try:
+            ingest(entries, directory, segment_bytes=segment_bytes, fsync="never")
+            start = time.perf_counter()
+            recovered, next_id = SegmentLog(directory).recover(args.window)
+            elapsed = time.perf_counter() - start
+            print(json.dumps({"bench": "recover", "segment_bytes": segment_bytes,
+                              "segments": len(os.listdir(directory)), "entries": args.entries,
+                              "window": len(recovered), "next_id": next_id, "seconds": round(elapsed, 4)}))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
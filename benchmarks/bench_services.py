@@ -0,0 +1,78 @@
+# Service benchmark. Runs 'handle_demanding' (what '?ssrc=...' triggers) against local stub peers with injected
+# latency and failures, reporting how long each kind of run takes and what it logged
+# Usage: python benchmarks/bench_services.py [--peers 6] [--runs 20] [--delay 0.02] [--fail-rate 0.1]
+#                                            [--fail-mode error|drop|hang] [--deadline 2] [--out results.json]
+import argparse
+import collections
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.pop("LOG_DATA_DIR", None)
+os.environ["PEER_REFRESH"] = "0"    # Only the runs being measured call the peers
+
+from bench_common import Results, latency_summary   # noqa: E402
+from stub_peers import start_peers, FAIL_MODES      # noqa: E402
+import log_server                                   # noqa: E402
+
+# name -> handle_demanding arguments: [pull info, simulate election, set all to, find leader, ask for resource]
+scenarios = {
+    "pull_info": ["v", None, None, None, None],
+    "find_leader": [None, None, None, "1", None],
+    "simulate_election": [None, "ring", None, None, None],
+    "set_all_elections": [None, None, "ring", None, None],
+    "ask_resource": [None, None, None, None, "1"],
+    "everything": ["v", "ring", "ring", "1", "1"]
+}
+
+
+def logged_since(last_id):  # Severity -> count of the entries logged after 'last_id'
+    return collections.Counter(entry.severity for entry in log_server.log_store.since(last_id, 1 << 20))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--peers", type=int, default=6)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.02)        # Seconds each peer takes to answer
+    parser.add_argument("--fail-rate", type=float, default=0.1)
+    parser.add_argument("--fail-mode", default="error", choices=FAIL_MODES)
+    parser.add_argument("--busy-rate", type=float, default=0.2)     # Share of 409 answers to elections and resources
+    parser.add_argument("--deadline", type=float, default=2.0)      # Seconds a service run may take
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    results = Results(args)
+    peers = start_peers(args.peers, delay=args.delay, fail_rate=args.fail_rate, fail_mode=args.fail_mode,
+                        busy_rate=args.busy_rate, hang=args.deadline * 2, seed=0)
+    peers[0].leader = True
+    urls = [peer.url for peer in peers]
+    log_server.peer_client.read_timeout = args.deadline
+    log_server.peer_client.deadline = args.deadline
+    try:
+        for fresh in (True, False):
+            for name, arguments in scenarios.items():
+                times = []
+                logged = collections.Counter()
+                for _ in range(args.runs):
+                    last_id = log_server.last_entry_id()
+                    start = time.perf_counter()
+                    log_server.handle_demanding(list(urls), list(arguments), fresh)
+                    times.append(time.perf_counter() - start)
+                    logged.update(logged_since(last_id))
+                result = {"bench": "services", "scenario": name, "fresh": fresh, "peers": args.peers,
+                          "delay_ms": args.delay * 1000, "fail_rate": args.fail_rate, "fail_mode": args.fail_mode,
+                          "runs": args.runs, "logged_per_run": round(sum(logged.values()) / args.runs, 2),
+                          "logged": dict(logged)}
+                result.update(latency_summary(times))
+                results.add(result)
+        results.add({"bench": "services", "scenario": "peer_requests", "per_peer": [peer.requests for peer in peers]})
+    finally:
+        for peer in peers:
+            peer.close()
+    results.save()
+    log_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Log shipping benchmark. Starts log server processes on loopback: one upstream forwarding to '--downstreams' others
+# (LOG_SHIP_TO), then posts '--entries' entries to the upstream through '/log/batch' and follows its '/server/status'
+# until every downstream acknowledged them all. Reports how fast the upstream ingested, how fast and how far behind
+# each downstream followed, and whether every entry arrived. With '--outage', the first downstream is stopped once
+# half the entries are in and started again that many seconds later, so shipping has to retry and resume. It comes
+# back empty (in memory only), so it then holds what was shipped after the outage
+# Usage: python benchmarks/bench_shipping.py [--downstreams 2] [--entries 20000] [--batch 500] [--outage 0]
+#                                            [--port 5300] [--out results.json]
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_common import Results, root  # noqa: E402
+
+
+def start_server(port, ship_to=()):
+    env = dict(os.environ, PORT=str(port), PEER_REFRESH="0", LOG_SHIP_TO=",".join(ship_to))
+    env.pop("LOG_DATA_DIR", None)
+    env.pop("LOG_SHARED_SOCKET", None)
+    process = subprocess.Popen([sys.executable, os.path.join(root, "log_server.py")], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            requests.get(url + "/server/status", timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"Log server on port {port} didn't start")
+
+
+def status(url):
+    return requests.get(url + "/server/status", timeout=5).json()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--downstreams", type=int, default=2)
+    parser.add_argument("--entries", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=500)       # Entries per '/log/batch' sent to the upstream
+    parser.add_argument("--outage", type=float, default=0.0)    # Seconds the first downstream is down for
+    parser.add_argument("--port", type=int, default=5300)       # Of the upstream, downstreams take the next ones
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    results = Results(args)
+    downstreams = [start_server(args.port + 1 + index) for index in range(args.downstreams)]
+    upstream = start_server(args.port, [url for process, url in downstreams])
+    processes = [upstream[0]] + [process for process, url in downstreams]
+    session = requests.Session()
+    try:
+        before = [status(url)["entry_count"] for process, url in downstreams]
+        stopped = None
+        max_lag = {}     # url -> most entries it was behind by
+        start = time.perf_counter()
+        for sent in range(0, args.entries, args.batch):
+            lines = "\n".join('{"from": "https://bench.local", "severity": "Information", "comment": "Shipped %d", '
+                              '"body": {"n": %d}}' % (index, index) for index in range(sent, min(sent + args.batch,
+                                                                                                   args.entries)))
+            session.post(upstream[1] + "/log/batch", data=lines, headers={"Content-Type": "application/x-ndjson"})
+            if args.outage and stopped is None and sent >= args.entries // 2:
+                downstreams[0][0].terminate()
+                downstreams[0][0].wait()
+                stopped = time.perf_counter()
+            if sent % (args.batch * 10) == 0:
+                for shipping in status(upstream[1])["shipping"]:
+                    max_lag[shipping["url"]] = max(max_lag.get(shipping["url"], 0), shipping["lag"])
+        ingested = time.perf_counter() - start
+        last_id = status(upstream[1])["last_id"]
+        caught_up = {}
+        while len(caught_up) < len(downstreams):
+            if stopped is not None and time.perf_counter() - stopped >= args.outage:
+                downstreams[0] = start_server(args.port + 1, ())
+                processes.append(downstreams[0][0])
+                stopped = None
+            for shipping in status(upstream[1])["shipping"]:
+                max_lag[shipping["url"]] = max(max_lag.get(shipping["url"], 0), shipping["lag"])
+                if shipping["url"] not in caught_up and shipping["acked"] >= last_id:
+                    caught_up[shipping["url"]] = (time.perf_counter() - start, shipping)
+            time.sleep(0.02)
+        results.add({"bench": "shipping", "scenario": "ingest", "entries": args.entries, "batch": args.batch,
+                     "seconds": round(ingested, 3), "entries_per_s": round(args.entries / ingested)})
+        for index, (process, url) in enumerate(downstreams):
+            seconds, shipping = caught_up[url]
+            received = status(url)["entry_count"] - (0 if index == 0 and args.outage else before[index])
+            results.add({"bench": "shipping", "scenario": "downstream", "url": url, "outage_s": args.outage if index == 0 else 0,
+                         "seconds": round(seconds, 3), "entries_per_s": round(args.entries / seconds),
+                         "lag_after_ingest_s": round(max(seconds - ingested, 0), 3), "max_lag_entries": max_lag[url],
+                         "received": received, "shipped": shipping["shipped"], "batches": shipping["batches"],
+                         "kb_per_entry": round(shipping["bytes"] / 1024 / max(shipping["shipped"], 1), 4),
+                         "failures_left": shipping["failures"], "skipped": shipping["skipped"]})
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+    results.save()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Ingestion stress benchmark. Several producer threads append through LogWriter while reader threads page the
+# store, then checks that every id is unique, that store order is id order and that no read saw a torn page.
+# Prints one JSON object per thread count
+# Usage: python benchmarks/bench_writer.py [--entries 20000] [--threads 1,2,4,8,16] [--readers 2]
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from log_server import LogEntry     # noqa: E402
+from log_store import LogStore      # noqa: E402
+from log_writer import LogWriter    # noqa: E402
+
+
+def produce(writer, count, name):
+    for i in range(count):
+        writer.append(LogEntry(name, "Information", f"Stress entry {i}"))
+
+
+def read(store, stop, torn):    # A dashboard refreshing as fast as it can, with a short pause between pages
+    while not stop.is_set():
+        time.sleep(0.001)
+        page = store.newest(0, 50)
+        ids = [entry.msg_id for entry in page]
+        if ids != list(range(ids[0], ids[0] - len(ids), -1)) if ids else False:
+            torn.append(ids)
+
+
+def run(threads, entries, readers, capacity):
+    store = LogStore(capacity)
+    writer = LogWriter(store)
+    writer.start()
+    per_thread = entries // threads
+    producers = [threading.Thread(target=produce, args=(writer, per_thread, f"producer-{i}")) for i in range(threads)]
+    stop = threading.Event()
+    torn = []
+    reader_threads = [threading.Thread(target=read, args=(store, stop, torn)) for _ in range(readers)]
+    for thread in reader_threads:
+        thread.start()
+    start = time.perf_counter()
+    for thread in producers:
+        thread.start()
+    for thread in producers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in reader_threads:
+        thread.join()
+    writer.close()
+    held = store.oldest(0, capacity)
+    ids = [entry.msg_id for entry in held]
+    total = per_thread * threads
+    return {
+        "bench": "writer", "threads": threads, "readers": readers, "entries": total,
+        "entries_per_s": round(total / elapsed),
+        "commits": writer.commits,
+        "ids_unique": len(set(ids)) == len(ids),
+        "ids_in_order": ids == sorted(ids),
+        "ids_complete": writer.next_id == total and (not ids or ids[-1] == total - 1),
+        "torn_reads": len(torn)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=20000)
+    parser.add_argument("--threads", default="1,2,4,8,16")
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--capacity", type=int, default=5000)      # Smaller than 'entries', so eviction runs too
+    args = parser.parse_args()
+    for threads in (int(value) for value in args.threads.split(",")):
+        print(json.dumps(run(threads, args.entries, args.readers, args.capacity)))
+
+
+if __name__ == "__main__":
+    main()
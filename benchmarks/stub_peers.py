@@ -0,0 +1,113 @@
+# Local stand-ins for the peer servers, used by the benchmarks. Each one answers '/info' (GET and POST), '/eleicao'
+# and '/recurso' like the real peers, after 'delay' seconds, and fails a 'fail_rate' share of the requests:
+# 'error' answers 500, 'drop' closes the connection without answering and 'hang' never answers in time
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAIL_MODES = ("error", "drop", "hang")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):    # Clients giving up on a slow peer is expected here
+        pass
+
+
+class StubPeer:
+    def __init__(self, peer_id, delay=0.0, fail_rate=0.0, fail_mode="error", election="anel", leader=False,
+                 busy_rate=0.0, hang=30.0, seed=None):
+        if fail_mode not in FAIL_MODES:
+            raise ValueError(f"Unknown fail mode '{fail_mode}'. Use one of {FAIL_MODES}")
+        self.peer_id = peer_id
+        self.delay = delay              # Seconds before answering
+        self.fail_rate = fail_rate      # Share of requests failed the 'fail_mode' way
+        self.fail_mode = fail_mode
+        self.election = election        # 'anel' or 'valentao'
+        self.leader = leader
+        self.busy_rate = busy_rate      # Share of '/eleicao' and '/recurso' answered 409
+        self.hang = hang                # Seconds a hung request takes
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def info(self):
+        return {"status": "up", "identificacao": self.peer_id, "eleicao": self.election, "lider": int(self.leader)}
+
+    def _roll(self, rate):
+        with self._lock:
+            return self._random.random() < rate
+
+    def _handler(self):
+        peer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # Keep-alive, like the real peers
+            disable_nagle_algorithm = True  # Headers and body go out in separate writes
+
+            def do_GET(self):
+                if not self.begin():
+                    return
+                if self.path == "/info":
+                    self.reply(200, peer.info())
+                else:
+                    self.reply(404, {})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"null")
+                if not self.begin():
+                    return
+                if self.path == "/info":
+                    if isinstance(body, dict) and body.get("eleicao") in ("anel", "valentao"):
+                        peer.election = body["eleicao"]
+                    self.reply(200, peer.info())
+                elif self.path in ("/eleicao", "/recurso"):
+                    self.reply(409 if peer._roll(peer.busy_rate) else 200, {})
+                else:
+                    self.reply(404, {})
+
+            def begin(self):    # Applies the delay and failures. False if the request was failed
+                with peer._lock:
+                    peer.requests += 1
+                time.sleep(peer.delay)
+                if not peer._roll(peer.fail_rate):
+                    return True
+                if peer.fail_mode == "error":
+                    self.reply(500, {})
+                elif peer.fail_mode == "drop":
+                    self.close_connection = True
+                else:
+                    time.sleep(peer.hang)
+                    self.close_connection = True
+                return False
+
+            def reply(self, code, data):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def start_peers(count, seed=None, **options):  # 'count' started peers sharing the same options, ids from 0
+    return [StubPeer(index, seed=None if seed is None else seed + index, **options).start() for index in range(count)]
@@ -0,0 +1,53 @@
+import threading
+from collections import OrderedDict
+
+from log_store import EVENT_EVICT, EVENT_CLEAR, EVENT_UPDATE
+
+# Entries hardly ever change once logged (only a folded repeat does, see EVENT_UPDATE), so their json() and rendered
+# table rows can be reused by every page and API response that shows them. Least recently used rows are dropped past
+# 'capacity', and the store listener drops the rows of evicted and updated entries right away
+
+
+class RowCache:
+    def __init__(self, capacity=5000):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._rows = OrderedDict()      # msg_id -> [<json>, <rendered row or None>]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def json(self, entry):  # Shared dict, never modify it
+        return self._get(entry)[0]
+
+    def row(self, entry, render):   # render(<json>) builds the row the first time it is needed
+        item = self._get(entry)
+        if item[1] is None:
+            item[1] = render(item[0])
+        return item[1]
+
+    def on_store_event(self, event, entries):   # Store listener
+        if event == EVENT_EVICT or event == EVENT_UPDATE:   # Updated ones are built again when next shown
+            with self._lock:
+                for entry in entries:
+                    self._rows.pop(entry.msg_id, None)
+        elif event == EVENT_CLEAR:
+            with self._lock:
+                self._rows.clear()
+
+    def _get(self, entry):
+        with self._lock:
+            item = self._rows.get(entry.msg_id)
+            if item is not None:
+                self._rows.move_to_end(entry.msg_id)
+                self.hits += 1
+                return item
+            self.misses += 1
+        item = [entry.json(), None]
+        with self._lock:
+            self._rows[entry.msg_id] = item
+            while len(self._rows) > self.capacity:
+                self._rows.popitem(last=False)
+        return item
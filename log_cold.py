@@ -0,0 +1,271 @@
+import collections
+import json
+import threading
+import time
+import zlib
+
+from log_search import entry_terms, matches
+from log_store import EVENT_EVICT, EVENT_CLEAR
+
+# Cold tier of the log. Entries evicted from the store (the hot tier) are gathered into blocks of 'block_size' and
+# each full block is sealed: encoded as one JSON list of records, compressed and never changed again. Blocks live in
+# a deque, oldest first, so retention drops whole blocks from the left in O(1) once there are more than 'max_entries',
+# they take more than 'max_bytes' or their newest entry is older than 'max_age' seconds. Memory then stays flat
+# however long the server runs: the store's capacity plus the retained blocks
+# Each block keeps how many entries it holds per (severity key, source) pair, and a bloom filter of its search terms,
+# so filters and searches only open the blocks that can hold a match. The last few opened blocks are kept decoded
+# for paging. With 'tally', each block also sums the repeats of its entries per tally(<entry>) key, handed to
+# 'on_drop' when retention drops the block, so counts kept elsewhere (see 'LogRollup') can follow without decoding it
+
+_bloom_bits_per_term = 12   # With 7 hashes, about 1 in 300 blocks opened for nothing
+_bloom_hashes = 7
+
+
+class ColdBlock:
+    __slots__ = ("first_id", "last_id", "first_ts", "last_ts", "count", "keys", "tallies", "data", "entries", "terms",
+                 "bloom")
+
+    def __init__(self):
+        self.first_id = None
+        self.last_id = None
+        self.first_ts = None
+        self.last_ts = None
+        self.count = 0
+        self.keys = {}          # (severity key, source) -> how many entries
+        self.tallies = {}       # tally(<entry>) -> repeats of its entries, see ColdStore
+        self.data = None        # Compressed JSON lines, once sealed
+        self.entries = []       # Entries, until sealed
+        self.terms = {}         # term -> entries holding it, until sealed
+        self.bloom = None       # bytearray, once sealed
+
+    def add(self, entry, tally=None):
+        if self.count == 0:
+            self.first_id, self.first_ts = entry.msg_id, entry.ts
+        self.last_id, self.last_ts = entry.msg_id, entry.ts
+        self.count += 1
+        key = (entry.severity_key, entry.log_from)
+        self.keys[key] = self.keys.get(key, 0) + 1
+        if tally is not None:
+            key = tally(entry)
+            self.tallies[key] = self.tallies.get(key, 0) + entry.repeats
+        self.entries.append(entry)
+        for term in entry_terms(entry):
+            holding = self.terms.get(term)
+            if holding is None:
+                self.terms[term] = [entry]
+            else:
+                holding.append(entry)
+
+    def seal(self, encode, level):
+        records = json.dumps([encode(entry) for entry in self.entries], separators=(",", ":"), check_circular=False)
+        self.data = zlib.compress(records.encode("utf-8"), level)
+        self.bloom = bytearray(max(len(self.terms) * _bloom_bits_per_term // 8, 64))
+        for term in self.terms:
+            for bit in _bloom_positions(term, len(self.bloom) * 8):
+                self.bloom[bit >> 3] |= 1 << (bit & 7)
+        self.entries = None
+        self.terms = None
+
+    def may_hold(self, term):   # False only if 'term' is surely not in any entry of the block
+        if self.bloom is None:
+            terms = self.terms  # Open block. Its own copy, as it can be sealed meanwhile
+            return terms is None or term in terms
+        return all(self.bloom[bit >> 3] & (1 << (bit & 7)) for bit in _bloom_positions(term, len(self.bloom) * 8))
+
+    def key_count(self, severities, sources):
+        if not severities and not sources:
+            return self.count
+        return sum(count for (severity, source), count in self.keys.items()
+                   if (not severities or severity in severities) and (not sources or source in sources))
+
+    def overlaps(self, min_id, max_id, start_ts, end_ts):
+        return ((min_id is None or self.last_id >= min_id) and (max_id is None or self.first_id <= max_id) and
+                (start_ts is None or self.last_ts >= start_ts) and (end_ts is None or self.first_ts < end_ts))
+
+    def inside(self, min_id, max_id, start_ts, end_ts):
+        return ((min_id is None or self.first_id >= min_id) and (max_id is None or self.last_id <= max_id) and
+                (start_ts is None or self.first_ts >= start_ts) and (end_ts is None or self.last_ts < end_ts))
+
+
+class ColdStore:
+    def __init__(self, encode, decode, block_size=4096, max_entries=None, max_bytes=None, max_age=None, level=3,
+                 cache_blocks=4, tally=None, on_drop=None):
+        self.encode = encode    # encode(<entry>) -> JSON serializable record
+        self.decode = decode    # decode(<record>) -> entry
+        self.block_size = block_size
+        self.max_entries = max_entries      # Retention limits. None is no limit
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.level = level                  # zlib compression level
+        self.cache_blocks = cache_blocks    # Sealed blocks kept decoded
+        self.tally = tally                  # tally(<entry>) -> hashable key
+        self.on_drop = on_drop              # on_drop(<tallies of a block>) once it is dropped. Lock held
+        self.dropped = 0                    # Blocks dropped by retention so far. Changes whenever old pages do
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._blocks = collections.deque()  # Sealed blocks, oldest first
+        self._open = ColdBlock()            # Block being filled
+        self._count = 0
+        self._bytes = 0
+        self._decoded = collections.OrderedDict()   # block -> entries
+
+    def __len__(self):
+        return self._count
+
+    def size(self):     # tuple(<sealed blocks>, <compressed bytes>)
+        return len(self._blocks), self._bytes
+
+    def on_store_event(self, event, entries):   # Store listener
+        with self._lock:
+            if event == EVENT_EVICT:
+                for entry in entries:
+                    self._open.add(entry, self.tally)
+                    self._count += 1
+                    if self._open.count == self.block_size:
+                        self._seal()
+                self._expire(time.time())
+            elif event == EVENT_CLEAR:
+                self.reset()
+
+    def first(self):    # Oldest entry, or None if empty
+        entries = self.query(count=1, newest_first=False)[0]
+        return entries[0] if entries else None
+
+    def newest(self, offset=0, count=1):
+        return self.query(offset=offset, count=count)[0]
+
+    def oldest(self, offset=0, count=1):
+        return self.query(offset=offset, count=count, newest_first=False)[0]
+
+    def since(self, msg_id, count):     # Up to 'count' entries with an id above 'msg_id', oldest first
+        return self.query(min_id=msg_id + 1, count=count, newest_first=False)[0]
+
+    def before(self, msg_id, count):    # Up to 'count' entries with an id below 'msg_id', newest first
+        return self.query(max_id=msg_id - 1, count=count)[0]
+
+    def query(self, severities=None, sources=None, min_id=None, max_id=None, start_ts=None, end_ts=None,
+              offset=0, count=20, newest_first=True):
+        # Same as LogIndex.query. Returns tuple(<page of matching entries>, <total matching entries>)
+        bounds = (min_id, max_id, start_ts, end_ts)
+        with self._lock:
+            self._expire(time.time())   # 'max_age' also applies when nothing is being evicted
+            blocks = self._snapshot()
+        counted = []    # tuple(<block>, <its open entries>, <matching entries if read to count them>, <count>)
+        for block, entries in blocks:
+            if entries is None and not block.overlaps(*bounds):
+                continue
+            if entries is not None and not _ends_overlap(entries[0], entries[-1], *bounds):
+                continue
+            if entries is None and block.inside(*bounds):
+                matching = block.key_count(severities, sources)
+                if matching:
+                    counted.append((block, None, None, matching))
+            elif entries is not None or block.key_count(severities, sources):
+                found = [entry for entry in self._entries(block, entries)
+                         if _match(entry, severities, sources, *bounds)]
+                if found:
+                    counted.append((block, entries, found, len(found)))
+        total = sum(matching for block, entries, found, matching in counted)
+        offset = max(offset, 0)
+        if offset >= total or count <= 0:
+            return [], total
+        out = []
+        for block, entries, found, matching in (reversed(counted) if newest_first else counted):
+            if offset >= matching:
+                offset -= matching
+                continue
+            if found is None:
+                found = [entry for entry in self._entries(block, entries) if _match(entry, severities, sources)]
+            if newest_first:
+                found = found[::-1]
+            out.extend(found[offset:offset + count - len(out)])
+            offset = 0
+            if len(out) == count:
+                break
+        return out, total
+
+    def search(self, groups, before_id=None, limit=20):
+        # Entries holding every (term, is_prefix) group of a query parsed by SearchIndex.parse, newest first
+        # Returns tuple(<entries>, <id to continue from, None if there is nothing else>)
+        exact = [term for term, prefix in groups if not prefix]
+        with self._lock:
+            self._expire(time.time())
+            blocks = self._snapshot()
+            if exact and blocks and blocks[-1][1] is not None:  # Only entries of the open block holding every term
+                lists = [self._open.terms.get(term, []) for term in exact]
+                blocks[-1] = (self._open, list(min(lists, key=len)))
+        out = []
+        for block, entries in reversed(blocks):
+            if entries is None and before_id is not None and block.first_id >= before_id:
+                continue
+            if not all(block.may_hold(term) for term in exact):
+                continue
+            for entry in reversed(self._entries(block, entries)):
+                if before_id is not None and entry.msg_id >= before_id:
+                    continue
+                if matches(entry_terms(entry), groups):
+                    if len(out) == limit:
+                        return out, out[-1].msg_id
+                    out.append(entry)
+        return out, None
+
+    def _snapshot(self):    # [(block, <copy of its entries if still open>)], oldest first. Lock held
+        blocks = [(block, None) for block in self._blocks]
+        if self._open.count:
+            blocks.append((self._open, list(self._open.entries)))
+        return blocks
+
+    def _entries(self, block, entries):     # Entries of a block, oldest first
+        if entries is not None:
+            return entries
+        with self._lock:
+            cached = self._decoded.get(block)
+            if cached is not None:
+                self._decoded.move_to_end(block)
+                return cached
+        decoded = [self.decode(record) for record in json.loads(zlib.decompress(block.data).decode("utf-8"))]
+        with self._lock:
+            self._decoded[block] = decoded
+            while len(self._decoded) > self.cache_blocks:
+                self._decoded.popitem(last=False)
+        return decoded
+
+    def _seal(self):    # Lock held
+        self._open.seal(self.encode, self.level)
+        self._blocks.append(self._open)
+        self._bytes += len(self._open.data)
+        self._open = ColdBlock()
+
+    def _expire(self, now):     # Lock held
+        while self._blocks:
+            block = self._blocks[0]
+            if not ((self.max_entries is not None and self._count > self.max_entries) or
+                    (self.max_bytes is not None and self._bytes > self.max_bytes) or
+                    (self.max_age is not None and block.last_ts < now - self.max_age)):
+                return
+            self._blocks.popleft()
+            self._count -= block.count
+            self._bytes -= len(block.data)
+            self._decoded.pop(block, None)
+            self.dropped += 1
+            if self.on_drop is not None:
+                self.on_drop(block.tallies)
+
+
+def _match(entry, severities, sources, min_id=None, max_id=None, start_ts=None, end_ts=None):
+    return ((not severities or entry.severity_key in severities) and (not sources or entry.log_from in sources) and
+            (min_id is None or entry.msg_id >= min_id) and (max_id is None or entry.msg_id <= max_id) and
+            (start_ts is None or entry.ts >= start_ts) and (end_ts is None or entry.ts < end_ts))
+
+
+def _ends_overlap(first, last, min_id, max_id, start_ts, end_ts):   # Whether entries from 'first' to 'last' may match
+    return ((min_id is None or last.msg_id >= min_id) and (max_id is None or first.msg_id <= max_id) and
+            (start_ts is None or last.ts >= start_ts) and (end_ts is None or first.ts < end_ts))
+
+
+def _bloom_positions(term, bits):
+    value = hash(term)
+    step = (value >> 32) | 1
+    return [(value + i * step) % bits for i in range(_bloom_hashes)]
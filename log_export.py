@@ -0,0 +1,62 @@
+import csv
+import io
+import json
+import zlib
+
+# Bulk export of the log. Entries are read a chunk at a time, oldest first, and each chunk is encoded (and compressed)
+# as soon as it is read, so an export of any size only ever holds one chunk in memory
+
+FORMAT_NDJSON = "ndjson"
+FORMAT_CSV = "csv"
+EXPORT_FORMATS = {  # format -> tuple(<mimetype>, <file extension>)
+    FORMAT_NDJSON: ("application/x-ndjson", "ndjson"),
+    FORMAT_CSV: ("text/csv", "csv")
+}
+csv_columns = ["id", "ts", "timestamp", "from", "severity", "comment", "body", "user_shade", "repeats", "last_ts",
+               "last_timestamp"]
+
+
+def iter_pages(read, min_id=None, max_id=None, chunk=1000):
+    # Lists of entries with min_id <= id <= max_id, oldest first
+    # read(<id of the last entry sent, or None>, <most entries>, <max id>) returns the next entries after it
+    last = min_id - 1 if min_id is not None else None
+    while True:
+        entries = read(last, chunk, max_id)
+        if max_id is not None:
+            entries = [entry for entry in entries if entry.msg_id <= max_id]
+        if not entries:
+            return
+        yield entries
+        last = entries[-1].msg_id
+
+
+def iter_export(pages, fmt, compress=False, level=6):   # Encoded export, as bytes chunks
+    encode = _csv_chunks(pages) if fmt == FORMAT_CSV else _ndjson_chunks(pages)
+    if not compress:
+        yield from encode
+        return
+    gzip = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)   # gzip container, not raw zlib
+    for data in encode:
+        data = gzip.compress(data)
+        if data:
+            yield data
+    yield gzip.flush()
+
+
+def _ndjson_chunks(pages):
+    for entries in pages:
+        yield "".join(json.dumps(entry.json()) + "\n" for entry in entries).encode("utf-8")
+
+
+def _csv_chunks(pages):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(csv_columns)
+    for entries in pages:
+        for entry in entries:
+            writer.writerow([entry.msg_id, entry.ts, entry.timestamp, entry.log_from, entry.severity, entry.comment,
+                             json.dumps(entry.body), entry.user_shade, entry.repeats, entry.last_ts,
+                             entry.last_timestamp])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
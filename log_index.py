@@ -0,0 +1,188 @@
+import heapq
+import threading
+
+from log_store import EVENT_APPEND, EVENT_EVICT, EVENT_CLEAR
+
+# Secondary indexes kept up to date by a store listener. Every key maps to its entries in id order, so a filtered
+# page is a couple of binary searches plus the page itself. Entries get their id and 'ts' together, so id order is
+# also time order and the same lists serve the time range filters
+# Keys: severity flavor ('severity_key'), source ('log_from') and the pair of both
+
+_compact_after = 1024   # Evicted slots kept at the front of a list before it is compacted
+
+
+class Postings:     # Entries of one key, oldest first. Evicted entries are skipped by 'start' and dropped lazily
+    __slots__ = ("items", "start")
+
+    def __init__(self):
+        self.items = []
+        self.start = 0
+
+    def __len__(self):
+        return len(self.items) - self.start
+
+    def append(self, entry):
+        self.items.append(entry)
+
+    def evict(self, entry):     # 'entry' is the oldest one held by the store, so it can only be at the front
+        if self.start < len(self.items) and self.items[self.start] is entry:
+            self.items[self.start] = None
+            self.start += 1
+            if self.start >= _compact_after and self.start * 2 >= len(self.items):
+                del self.items[:self.start]
+                self.start = 0
+
+    def bisect(self, value, right, key):
+        lo = self.start
+        hi = len(self.items)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_value = getattr(self.items[mid], key)
+            if mid_value < value or (right and mid_value == value):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def bounds(self, min_id, max_id, start_ts, end_ts):     # [lo, hi) of the entries inside every given bound
+        lo = self.start
+        hi = len(self.items)
+        if min_id is not None:
+            lo = max(lo, self.bisect(min_id, False, "msg_id"))
+        if max_id is not None:
+            hi = min(hi, self.bisect(max_id, True, "msg_id"))
+        if start_ts is not None:
+            lo = max(lo, self.bisect(start_ts, False, "ts"))
+        if end_ts is not None:
+            hi = min(hi, self.bisect(end_ts, False, "ts"))
+        return lo, max(lo, hi)
+
+
+class LogIndex:
+    def __init__(self):
+        self._lock = threading.Lock()   # Writes come from the store listener, reads from request threads
+        self.reset()
+
+    def reset(self):
+        self.everything = Postings()
+        self.by_severity = {}
+        self.by_source = {}
+        self.by_pair = {}
+
+    def on_store_event(self, event, entries):   # Store listener
+        with self._lock:
+            self._apply(event, entries)
+
+    def _apply(self, event, entries):
+        if event == EVENT_APPEND:
+            for entry in entries:
+                self.everything.append(entry)
+                for index, key in self._keys(entry):
+                    postings = index.get(key)
+                    if postings is None:
+                        postings = index[key] = Postings()
+                    postings.append(entry)
+        elif event == EVENT_EVICT:
+            for entry in entries:
+                self.everything.evict(entry)
+                for index, key in self._keys(entry):
+                    postings = index.get(key)
+                    if postings is not None:
+                        postings.evict(entry)
+                        if len(postings) == 0:
+                            del index[key]
+        elif event == EVENT_CLEAR:
+            self.reset()
+
+    def postings(self, severities=None, sources=None):     # Lists that together hold every matching entry
+        if severities and sources:
+            keys = [(sev, src) for sev in severities for src in sources]
+            return [self.by_pair[key] for key in keys if key in self.by_pair]
+        if severities:
+            return [self.by_severity[key] for key in severities if key in self.by_severity]
+        if sources:
+            return [self.by_source[key] for key in sources if key in self.by_source]
+        return [self.everything]
+
+    def query(self, severities=None, sources=None, min_id=None, max_id=None, start_ts=None, end_ts=None,
+              offset=0, count=20, newest_first=True):
+        # Returns tuple(<page of matching entries>, <total matching entries>)
+        with self._lock:
+            return self._query(severities, sources, min_id, max_id, start_ts, end_ts, offset, count, newest_first)
+
+    def _query(self, severities, sources, min_id, max_id, start_ts, end_ts, offset, count, newest_first):
+        ranges = []
+        for postings in self.postings(severities, sources):
+            lo, hi = postings.bounds(min_id, max_id, start_ts, end_ts)
+            if hi > lo:
+                ranges.append((postings.items, lo, hi))
+        total = sum(hi - lo for items, lo, hi in ranges)
+        offset = max(offset, 0)
+        if offset >= total or count <= 0:
+            return [], total
+        if len(ranges) == 1:
+            items, lo, hi = ranges[0]
+            if newest_first:
+                return [items[i] for i in range(hi - 1 - offset, max(hi - offset - count, lo) - 1, -1)], total
+            return items[lo + offset:min(lo + offset + count, hi)], total
+        return _merge_page(ranges, offset, count, newest_first), total
+
+    def _keys(self, entry):
+        severity = entry.severity_key
+        source = entry.log_from
+        return (self.by_severity, severity), (self.by_source, source), (self.by_pair, (severity, source))
+
+
+def _merge_page(ranges, offset, count, newest_first):
+    # Several lists: binary search the id of the first entry of the page, then merge only what the page needs
+    lo_id = min(items[lo].msg_id for items, lo, hi in ranges)
+    hi_id = max(items[hi - 1].msg_id for items, lo, hi in ranges)
+    rank = offset + 1
+    while lo_id < hi_id:    # Find the id with exactly 'rank' matching entries at or past it
+        if newest_first:
+            mid = (lo_id + hi_id + 1) // 2
+            if _count_from(ranges, mid, True) >= rank:
+                lo_id = mid
+            else:
+                hi_id = mid - 1
+        else:
+            mid = (lo_id + hi_id) // 2
+            if _count_from(ranges, mid, False) >= rank:
+                hi_id = mid
+            else:
+                lo_id = mid + 1
+    pivot = lo_id
+    runs = []
+    for items, lo, hi in ranges:
+        cut = _bisect_id(items, lo, hi, pivot)
+        if newest_first:    # Entries with id <= pivot, newest first
+            stop = cut + 1 if cut < hi and items[cut].msg_id == pivot else cut
+            runs.append([items[i] for i in range(stop - 1, max(stop - count, lo) - 1, -1)])
+        else:               # Entries with id >= pivot, oldest first
+            runs.append(items[cut:min(cut + count, hi)])
+    if newest_first:
+        merged = heapq.merge(*runs, key=lambda entry: -entry.msg_id)
+    else:
+        merged = heapq.merge(*runs, key=lambda entry: entry.msg_id)
+    return [entry for _, entry in zip(range(count), merged)]
+
+
+def _count_from(ranges, msg_id, newest_first):  # Matching entries with id >= msg_id (or <= when oldest first)
+    total = 0
+    for items, lo, hi in ranges:
+        cut = _bisect_id(items, lo, hi, msg_id)
+        if newest_first:
+            total += hi - cut
+        else:
+            total += (cut + 1 if cut < hi and items[cut].msg_id == msg_id else cut) - lo
+    return total
+
+
+def _bisect_id(items, lo, hi, msg_id):  # First position in [lo, hi) with an id >= msg_id
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if items[mid].msg_id < msg_id:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
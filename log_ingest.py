@@ -0,0 +1,145 @@
+import codecs
+import json
+import zlib
+
+# Incremental parsers for the batch ingestion endpoint. Both take an iterable of raw byte chunks (like a request
+# stream) and yield tuple(<ok>, <value>), where value is the decoded item or the error message when 'ok' is False.
+# Only one chunk plus one pending item are kept in memory at a time. Gzip bodies are inflated the same way, a chunk at
+# a time, see 'iter_gunzip'
+
+read_chunk_size = 64 * 1024
+_START, _FIRST, _ITEM, _AFTER, _DONE = range(5)     # 'iter_json_array' states: before '[', after it, after a ',',
+_number_chars = frozenset("0123456789.eE+-")        # after an item and after ']'
+
+
+def iter_chunks(stream, size=read_chunk_size):
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_gunzip(chunks, size=read_chunk_size):   # Raises ValueError if the data isn't gzip
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        for chunk in chunks:
+            while chunk:
+                data = inflater.decompress(chunk, size)     # Bounded, however well the data compresses
+                chunk = inflater.unconsumed_tail
+                if data:
+                    yield data
+        data = inflater.flush()
+    except zlib.error as exc:
+        raise ValueError(f"Invalid gzip body: {exc}") from exc
+    if data:
+        yield data
+    if not inflater.eof:
+        raise ValueError("Truncated gzip body")
+
+
+def iter_body(chunks):   # Sniffs the first non blank char: '[' means a JSON array, anything else NDJSON
+    chunks = iter(chunks)
+    first = b""
+    for chunk in chunks:
+        first += chunk
+        if first.strip():
+            break
+    lead = first.lstrip()[:1]
+    rest = _prepend(first, chunks)
+    if lead == b"[":
+        return iter_json_array(rest)
+    return iter_ndjson(rest)
+
+
+def iter_ndjson(chunks):
+    pending = b""
+    for chunk in chunks:
+        pending += chunk
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield _decode_line(line)
+    if pending.strip():
+        yield _decode_line(pending)
+
+
+def iter_json_array(chunks):
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    state = _START
+    chunks = iter(chunks)
+    eof = False
+    while True:
+        try:
+            buf = buf[pos:] + text_decoder.decode(next(chunks))
+        except StopIteration:
+            buf = buf[pos:] + text_decoder.decode(b"", final=True)
+            eof = True
+        except UnicodeDecodeError as exc:
+            yield False, f"Invalid encoding: {exc}"
+            return
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos >= len(buf):
+                break
+            char = buf[pos]
+            if state == _START:
+                if char != "[":
+                    yield False, "Expected a JSON array"
+                    return
+                state = _FIRST
+                pos += 1
+            elif state == _AFTER:
+                if char not in ",]":
+                    yield False, "Malformed JSON array: Expecting ',' or ']' after an item"
+                    return
+                state = _ITEM if char == "," else _DONE
+                pos += 1
+            elif state == _DONE:
+                yield False, "Malformed JSON array: Extra data after ']'"
+                return
+            elif char == "]" and state == _FIRST:
+                state = _DONE
+                pos += 1
+            else:
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError as exc:
+                    if eof:
+                        yield False, f"Malformed JSON array: {exc.msg}"
+                        return
+                    break   # Incomplete item, wait for the next chunk
+                if not eof and _may_continue(item, buf, end):
+                    break
+                pos = end
+                state = _AFTER
+                yield True, item
+        if eof:
+            if state != _DONE:
+                yield False, "Unterminated JSON array"
+            return
+
+
+def _may_continue(item, buf, end):  # Whether a number decoded up to 'end' might go on in the next chunk
+    if not isinstance(item, (int, float)) or isinstance(item, bool):
+        return False
+    return end == len(buf) or buf[end] in _number_chars
+
+
+def _decode_line(line):
+    try:
+        return True, json.loads(line)
+    except ValueError as exc:   # Covers both bad JSON and bad utf-8
+        return False, f"Malformed line: {exc}"
+
+
+def _prepend(first, chunks):
+    if first:
+        yield first
+    yield from chunks
@@ -0,0 +1,181 @@
+import bisect
+import math
+import threading
+import weakref
+
+# Metrics in the Prometheus text format, cheap enough to update on every request. Counters and histograms keep one
+# set of values per thread, so an update is a dict lookup and an add on values no other thread writes, with no lock.
+# Histogram buckets are fixed when the metric is made, so an observation is one bisect. A scrape adds the threads'
+# values up; those of finished threads are folded into a single set when the thread goes away, so short lived
+# request threads don't pile up
+# Gauges are read from a callback at scrape time, so whatever they measure costs nothing until then
+
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)    # Seconds
+PEER_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0)
+
+OTHER = "other"     # Label value standing for every series past 'max_series'
+
+
+class _Shard:   # One thread's values of one metric
+    __slots__ = ("values", "__weakref__")
+
+    def __init__(self):
+        self.values = {}    # tuple(<label values>) -> value
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, doc, labels=(), max_series=1000):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.max_series = max_series    # Past this many label sets per thread, new ones are counted as OTHER
+        self._local = threading.local()
+        self._shards = weakref.WeakSet()
+        self._retired = {}              # Values of the threads that are gone
+        self._lock = threading.RLock()  # Only taken by a thread's first update, its end and scrapes
+
+    def _values(self):  # This thread's values
+        try:
+            return self._local.shard.values
+        except AttributeError:
+            shard = _Shard()
+            with self._lock:
+                self._shards.add(shard)
+            weakref.finalize(shard, self._retire, shard.values)
+            self._local.shard = shard
+            return shard.values
+
+    def _key(self, values, label_values):
+        if label_values in values or len(values) < self.max_series:
+            return label_values
+        return (OTHER,) * len(self.labels)
+
+    def _retire(self, values):
+        with self._lock:
+            for key, value in list(values.items()):
+                self._retired[key] = self._merge(self._retired.get(key), value)
+
+    def collect(self):  # tuple(<label values>) -> value, summed over every thread
+        with self._lock:
+            parts = [shard.values.copy() for shard in self._shards]
+            parts.append(self._retired.copy())
+        out = {}
+        for part in parts:
+            for key, value in part.items():
+                out[key] = self._merge(out.get(key), value)
+        return out
+
+    @staticmethod
+    def _merge(total, value):
+        raise NotImplementedError
+
+    def render(self):   # Lines of the exposition format
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount=1):
+        values = self._values()
+        key = self._key(values, label_values)
+        values[key] = values.get(key, 0) + amount
+
+    @staticmethod
+    def _merge(total, value):
+        return value if total is None else total + value
+
+    def _samples(self):
+        values = self.collect()
+        if not self.labels and not values:  # Counted from the start, even if nothing happened yet
+            values[()] = 0
+        return [f"{self.name}{_labels(self.labels, key)} {_number(value)}" for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=REQUEST_BUCKETS, max_series=1000):
+        super().__init__(name, doc, labels, max_series)
+        self.buckets = tuple(sorted(buckets))   # Upper bounds. '+Inf' is added at the end
+
+    def observe(self, value, *label_values):
+        values = self._values()
+        key = self._key(values, label_values)
+        counts = values.get(key)
+        if counts is None:
+            counts = values[key] = [0] * (len(self.buckets) + 1) + [0.0]     # Per bucket counts, then the sum
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @staticmethod
+    def _merge(total, value):
+        return list(value) if total is None else [a + b for a, b in zip(total, value)]
+
+    def _samples(self):
+        lines = []
+        for key, counts in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _labels(self.labels + ("le",), key + (_number(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(counts[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, doc, read, labels=()):
+        self.name = name
+        self.doc = doc
+        self.read = read    # read() -> number, or {tuple(<label values>): number} when there are labels
+        self.labels = tuple(labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        value = self.read()
+        if not self.labels:
+            return lines + [f"{self.name} {_number(value)}"]
+        return lines + [f"{self.name}{_labels(self.labels, key)} {_number(number)}"
+                        for key, number in sorted(value.items())]
+
+
+class Metrics:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, *metrics):
+        self.metrics.extend(metrics)
+        return metrics[0] if len(metrics) == 1 else metrics
+
+    def render(self):   # The whole exposition, as served by '/server/metrics'
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
@@ -0,0 +1,116 @@
+import json
+import sys
+
+# Who the peers are and how entries are labelled: the nickname and user shade of each peer's entries, and which
+# severity names (in any case, Portuguese ones too) get which severity flavor. Loaded from JSON (LOG_REGISTRY, or the
+# defaults below) and compiled into dicts, so classifying an entry is a lookup: sources by their exact host,
+# severities by their lowercased name. A Registry never changes; reloading compiles a new one and swaps it in, and
+# entries keep what they were classified as, so a reload only changes the entries that come after it
+# Format:
+#   {"peers": [{"url": <url>, "nickname": <name>, "shade": <user shade, optional>}],
+#    "shadows": [<url>], "severities": {<flavor key>: [<severity name>]},
+#    "default_severity": <flavor key>, "default_shade": <user shade>}
+
+DEFAULT_REGISTRY = {
+    "peers": [
+        {"url": "https://sd-rdm.herokuapp.com", "nickname": "Ramon"},
+        {"url": "https://sd-201620236.herokuapp.com", "nickname": "Saionara"},
+        {"url": "https://sd-jhsq.herokuapp.com", "nickname": "João"},
+        {"url": "https://sd-app-server-jesulino.herokuapp.com", "nickname": "Jesulino"},
+        {"url": "https://sd-mgs.herokuapp.com", "nickname": "Maira"},
+        {"url": "https://sd-dmss.herokuapp.com", "nickname": "Diêgo"}
+    ],
+    "shadows": ["https://sd-rdm-shadow1.herokuapp.com", "https://sd-rdm-shadow2.herokuapp.com"],
+    "severities": {
+        "sev_warning": ["warning", "aviso"],
+        "sev_attention": ["attention", "atencao", "alerta"],
+        "sev_error": ["error", "erro"],
+        "sev_critical": ["critical", "critico"],
+        "sev_success": ["success", "sucesso"]
+    },
+    "default_severity": "sev_default",
+    "default_shade": "usr_default"     # NEVER make it "internal", that one is only for the server's own entries
+}
+
+
+class Registry:
+    def __init__(self, data, max_cached=4096):
+        self.data = data                    # As loaded, what '/info' shows
+        self.max_cached = max_cached        # Past this many sources or severities, they are still worked out
+        self.peers = [peer["url"] for peer in data["peers"]]
+        self.shadows = list(data["shadows"])
+        self.default_severity = sys.intern(data["default_severity"])
+        self.default_shade = sys.intern(data["default_shade"])
+        self._hosts = {}        # Host -> tuple(" (<nickname>)", <user shade>)
+        for peer in data["peers"]:
+            self._hosts[_host(peer["url"])] = (f" ({peer['nickname']})",
+                                               sys.intern(peer.get("shade") or self.default_shade))
+        self._aliases = {name.strip().lower(): sys.intern(key)    # Severity name -> flavor key
+                         for key, names in data["severities"].items() for name in names}
+        # Lookup tables filled as sources and severities are first seen. Read them directly on hot paths, falling
+        # back to 'source' and 'severity' on a miss: a method call costs about as much as the lookup itself
+        self.sources = {}       # Raw 'from' -> tuple(<displayed name>, <user shade>), shared by equal sources
+        self.severities = {}    # Raw severity -> tuple(<severity>, <flavor key>), shared the same way
+
+    def source(self, s_from):   # tuple(<'s_from' with its nickname>, <user shade>)
+        codes = self.sources.get(s_from)
+        if codes is None:
+            nickname, shade = self._hosts.get(_host(s_from), ("", self.default_shade))
+            codes = (sys.intern(s_from + nickname), shade)
+            if len(self.sources) < self.max_cached:
+                self.sources[s_from] = codes
+        return codes
+
+    def nickname(self, url):    # " (<nickname>)" of a peer's url, empty for any other
+        return self._hosts.get(_host(url), ("",))[0]
+
+    def raw_source(self, name):     # 'from' a displayed source name was given, undoing 'source'
+        head, sep, nickname = name.rpartition(" (")
+        if sep and self.nickname(head) == sep + nickname:
+            return head
+        return name
+
+    def severity(self, severity):   # tuple(<severity>, <flavor key>)
+        codes = self.severities.get(severity)
+        if codes is None:
+            codes = (sys.intern(severity), self.severity_key(severity))
+            if len(self.severities) < self.max_cached:
+                self.severities[severity] = codes
+        return codes
+
+    def severity_key(self, severity):
+        return self._aliases.get(severity.strip().lower(), self.default_severity)
+
+
+def load_registry(data):    # Raises ValueError if 'data' isn't a registry
+    if not isinstance(data, dict):
+        raise ValueError("The registry must be a JSON object")
+    data = dict(DEFAULT_REGISTRY, **data)   # Missing parts are the defaults
+    peers = data["peers"]
+    if not isinstance(peers, list) or not all(isinstance(peer, dict) and isinstance(peer.get("url"), str) and
+                                              isinstance(peer.get("nickname"), str) and
+                                              isinstance(peer.get("shade", ""), str) for peer in peers):
+        raise ValueError("'peers' must be a list of {\"url\", \"nickname\", \"shade\" (optional)} with string values")
+    if not isinstance(data["shadows"], list) or not all(isinstance(url, str) for url in data["shadows"]):
+        raise ValueError("'shadows' must be a list of urls")
+    severities = data["severities"]
+    if not isinstance(severities, dict) or not all(isinstance(names, list) and
+                                                   all(isinstance(name, str) for name in names)
+                                                   for names in severities.values()):
+        raise ValueError("'severities' must map each flavor key to a list of severity names")
+    if not isinstance(data["default_severity"], str) or not isinstance(data["default_shade"], str):
+        raise ValueError("'default_severity' and 'default_shade' must be strings")
+    return Registry(data)
+
+
+def read_registry(path):    # The registry data of a JSON file. Raises ValueError if it can't be read
+    try:
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+    except OSError as exc:
+        raise ValueError(f"Can't read the registry '{path}': {exc}") from exc
+
+
+def _host(url):     # Lowercased host (and port) of 'url', which may have no scheme. Cheaper than urlsplit
+    scheme, sep, rest = url.partition("://")
+    return (rest if sep else url).split("/", 1)[0].split("?", 1)[0].lower()
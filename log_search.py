@@ -0,0 +1,173 @@
+import bisect
+import heapq
+import re
+import threading
+
+from log_index import Postings
+from log_store import EVENT_APPEND, EVENT_EVICT, EVENT_CLEAR
+
+# Full text search over 'comment' and the values inside 'body', kept up to date by a store listener. Each term maps
+# to the entries holding it in id order, so an AND query walks the shortest list newest first and checks the other
+# terms by binary search, stopping as soon as the page is full. 'term*' matches every term starting with 'term'
+
+_token = re.compile(r"\w+")
+_merge_terms_after = 4096   # New terms kept outside the sorted vocabulary before merging them in
+
+
+def tokenize(value):    # Set of lowercase terms in a comment or body, looking inside dicts and lists
+    terms = set()
+    _collect(value, terms)
+    return terms
+
+
+def entry_terms(entry):     # Terms of an entry's comment and body
+    terms = tokenize(entry.comment)
+    _collect(entry.body, terms)
+    return terms
+
+
+def matches(terms, groups):     # Whether a set of terms holds every (term, is_prefix) group of a parsed query
+    for term, prefix in groups:
+        if prefix:
+            if not any(t.startswith(term) for t in terms):
+                return False
+        elif term not in terms:
+            return False
+    return True
+
+
+def _collect(value, terms):
+    if isinstance(value, dict):
+        for item in value.values():
+            _collect(item, terms)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _collect(item, terms)
+    elif value is not None:
+        terms.update(_token.findall(str(value).lower()))
+
+
+class SearchIndex:
+    def __init__(self, min_prefix=2, max_prefix_terms=256):
+        self.min_prefix = min_prefix                # Shorter prefixes would match most of the vocabulary
+        self.max_prefix_terms = max_prefix_terms    # Most terms a single prefix expands to
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.terms = {}             # term -> Postings
+        self._sorted_terms = []     # Vocabulary for prefix lookups. May hold terms that were dropped since
+        self._new_terms = []        # Terms not merged into '_sorted_terms' yet
+
+    def on_store_event(self, event, entries):   # Store listener
+        with self._lock:
+            if event == EVENT_APPEND:
+                for entry in entries:
+                    for term in entry_terms(entry):
+                        postings = self.terms.get(term)
+                        if postings is None:
+                            postings = self.terms[term] = Postings()
+                            self._new_terms.append(term)
+                        postings.append(entry)
+                if len(self._new_terms) > _merge_terms_after:
+                    self._merge_terms()
+            elif event == EVENT_EVICT:
+                for entry in entries:
+                    for term in entry_terms(entry):
+                        postings = self.terms.get(term)
+                        if postings is not None:
+                            postings.evict(entry)
+                            if len(postings) == 0:
+                                del self.terms[term]
+            elif event == EVENT_CLEAR:
+                self.reset()
+
+    def search(self, query, before_id=None, limit=20):
+        # Returns tuple(<matching entries, newest first>, <id to continue from, None if there is nothing else>)
+        # Raises ValueError if the query has no usable term
+        groups = self.parse(query)
+        with self._lock:
+            lists = [(term, prefix, self._lookup(term, prefix)) for term, prefix in groups]
+            if any(len(group) == 0 for term, prefix, group in lists):
+                return [], None
+            max_id = before_id - 1 if before_id is not None else None
+            lists.sort(key=lambda item: sum(len(postings) for postings in item[2]))
+            driver, others = lists[0][2], lists[1:]
+            out = []
+            for entry in _newest_first(driver, max_id):
+                if all(self._matches(entry, term, prefix, group) for term, prefix, group in others):
+                    if len(out) == limit:
+                        return out, out[-1].msg_id
+                    out.append(entry)
+            return out, None
+
+    def _matches(self, entry, term, prefix, group):
+        if not prefix:
+            return _contains(group[0], entry.msg_id)
+        # A prefix can span hundreds of lists, and reading the entry again is cheaper than searching all of them
+        return any(t.startswith(term) for t in entry_terms(entry))
+
+    def parse(self, query):     # [(term, is_prefix)]. Raises ValueError
+        groups = []
+        for word in query.lower().split():
+            prefix = word.endswith("*")
+            terms = _token.findall(word)
+            for index, term in enumerate(terms):    # 'sd-rdm*' is 'sd' AND 'rdm*', like it was indexed
+                groups.append((term, prefix and index == len(terms) - 1))
+        if not groups:
+            raise ValueError("The search has no terms")
+        for term, prefix in groups:
+            if prefix and len(term) < self.min_prefix:
+                raise ValueError(f"Prefix '{term}*' is too short. Use at least {self.min_prefix} characters")
+        return groups
+
+    def _lookup(self, term, prefix):    # Posting lists for a term, or for every term starting with it
+        if not prefix:
+            postings = self.terms.get(term)
+            return [postings] if postings is not None else []
+        matches = set(t for t in self._new_terms if t.startswith(term) and t in self.terms)
+        start = bisect.bisect_left(self._sorted_terms, term)
+        for index in range(start, len(self._sorted_terms)):
+            if not self._sorted_terms[index].startswith(term):
+                break
+            if self._sorted_terms[index] in self.terms:
+                matches.add(self._sorted_terms[index])
+            if len(matches) > self.max_prefix_terms:
+                raise ValueError(f"Prefix '{term}*' matches too many terms. Use a longer prefix")
+        return [self.terms[t] for t in matches]
+
+    def _merge_terms(self):     # Both parts are sorted, so this sort is a linear merge
+        merged = [t for t in self._sorted_terms if t in self.terms]
+        merged.extend(sorted(set(self._new_terms)))
+        merged.sort()
+        self._sorted_terms = merged
+        self._new_terms = []
+
+
+def _newest_first(group, max_id):   # Entries of one or more lists, newest first, with an id up to 'max_id'
+    runs = []
+    for postings in group:
+        hi = len(postings.items) if max_id is None else postings.bisect(max_id, True, "msg_id")
+        runs.append(_reversed_run(postings.items, postings.start, hi))
+    if len(runs) == 1:
+        return runs[0]
+    return _unique(heapq.merge(*runs, key=lambda entry: -entry.msg_id))
+
+
+def _reversed_run(items, lo, hi):
+    for index in range(hi - 1, lo - 1, -1):
+        yield items[index]
+
+
+def _unique(entries):   # Drops repeats from an id sorted stream. The same entry can hold several prefix matches
+    last = None
+    for entry in entries:
+        if entry is not last:
+            yield entry
+        last = entry
+
+
+def _contains(postings, msg_id):
+    index = postings.bisect(msg_id, False, "msg_id")
+    return index < len(postings.items) and postings.items[index].msg_id == msg_id
+
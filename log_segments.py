@@ -0,0 +1,222 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from log_store import EVENT_APPEND, EVENT_CLEAR, EVENT_UPDATE
+
+# Durable append-only storage for the log. Entries are handed over by a store listener (no I/O on the ingestion
+# path) and a single writer thread group commits whatever piled up since its last write. Files are named after
+# the first id they hold, so they sort by name, and each record is:
+# [payload length u32][msg id i64][kind u8][payload crc32 u32][payload: LogEntry.json() as utf-8 JSON]
+
+# How often the writer forces the data to disk
+FSYNC_ALWAYS = "always"         # After every group commit
+FSYNC_INTERVAL = "interval"     # At most once every 'fsync_interval' seconds
+FSYNC_NEVER = "never"           # Left to the OS
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+
+RECORD_ENTRY = 0
+RECORD_CLEAR = 1    # Everything before it was cleared. Its id is the last one given before the clear
+RECORD_UPDATE = 2   # Newer json() of an entry written before, which had a repeat folded in. Replaces that one
+
+_header = struct.Struct("<IqBI")
+_suffix = ".seg"
+
+
+class SegmentLog:
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024, fsync=FSYNC_INTERVAL, fsync_interval=1.0,
+                 max_segments=64):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy '{fsync}'. Use one of {FSYNC_POLICIES}")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.max_segments = max_segments    # Oldest segments past this are deleted
+        self.written = 0                    # Records written since opened
+        self._pending = []                  # tuple(<kind>, <entry>) waiting for the writer
+        self._cond = threading.Condition()
+        self._file = None
+        self._size = 0
+        self._dirty = False
+        self._last_sync = time.monotonic()
+        self._last_id = -1
+        self._closed = False
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def segments(self):
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.endswith(_suffix))
+
+    def recover(self, window):
+        # Returns tuple(<json of up to 'window' newest entries, oldest first>, <next free id>). Only record headers
+        # are read to find them, and only the returned records are decoded
+        picked = []     # tuple(<id>, <mmap>, <offset>, <length>)
+        seen = set()    # Ids picked. Read newest record first, so an updated entry is picked as it was last written
+        found = 0       # Entries picked
+        maps = []
+        next_id = None
+        segments = self.segments()
+        try:
+            for index in range(len(segments) - 1, -1, -1):
+                records, end, mm = _scan(segments[index])
+                if mm is None:
+                    continue
+                maps.append(mm)
+                if index == len(segments) - 1 and end < len(mm):   # Torn write from a crash, drop the tail
+                    with open(segments[index], "r+b") as file:
+                        file.truncate(end)
+                if records and next_id is None:     # Updates are of older ids, the newest is the one to go on from
+                    next_id = max(record[1] for record in records) + 1
+                done = False
+                for offset, msg_id, kind, length in reversed(records):
+                    if kind == RECORD_CLEAR or found == window:
+                        done = True
+                        break
+                    if msg_id not in seen:
+                        seen.add(msg_id)
+                        picked.append((msg_id, mm, offset, length))
+                        found += kind == RECORD_ENTRY   # Updates may be of entries past the window
+                if done:
+                    break
+            entries = []
+            picked = sorted(picked, key=lambda item: item[0])[-window:] if window > 0 else []
+            for msg_id, mm, offset, length in picked:
+                payload = mm[offset + _header.size:offset + _header.size + length]
+                entries.append(json.loads(payload.decode("utf-8")))
+        finally:
+            for mm in maps:
+                mm.close()
+        if next_id is None:
+            next_id = 0
+        self._last_id = next_id - 1
+        return entries, next_id
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="segment-writer", daemon=True)
+        self._thread.start()
+
+    def close(self):    # Writes whatever is pending and stops the writer
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        if self._file is not None:
+            self._file.flush()
+            if self.fsync != FSYNC_NEVER:
+                os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    def on_store_event(self, event, entries):   # Store listener, only queues references
+        if event == EVENT_APPEND:
+            with self._cond:
+                self._pending.extend((RECORD_ENTRY, entry) for entry in entries)
+                self._cond.notify()
+        elif event == EVENT_UPDATE:
+            with self._cond:
+                self._pending.extend((RECORD_UPDATE, entry) for entry in dict.fromkeys(entries))
+                self._cond.notify()
+        elif event == EVENT_CLEAR:
+            with self._cond:
+                self._pending.append((RECORD_CLEAR, None))
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    if not self._cond.wait(self.fsync_interval if self._dirty else None):
+                        break   # Timed out with unsynced data
+                batch = self._pending
+                self._pending = []
+                closed = self._closed
+            if batch:
+                self._write(batch)
+            self._sync(force=False)
+            if closed:
+                return
+
+    def _write(self, batch):
+        for kind, entry in batch:
+            if kind == RECORD_CLEAR:
+                self._roll(self._last_id + 1)
+                self._append(RECORD_CLEAR, self._last_id, b"")
+                self._file.flush()
+                self._dirty = True
+                self._sync(force=True)
+                self._drop_segments(keep=1)
+                continue
+            if kind == RECORD_UPDATE:   # Never opens a segment, so each one starts with its newest ids
+                self._append(RECORD_UPDATE, entry.msg_id, json.dumps(entry.json()).encode("utf-8"))
+                continue
+            if self._file is None or self._size >= self.segment_bytes:
+                self._roll(entry.msg_id)
+            self._append(RECORD_ENTRY, entry.msg_id, json.dumps(entry.json()).encode("utf-8"))
+            self._last_id = entry.msg_id
+        self._file.flush()
+        self._dirty = True
+        if self.fsync == FSYNC_ALWAYS:
+            self._sync(force=True)
+
+    def _append(self, kind, msg_id, payload):
+        self._file.write(_header.pack(len(payload), msg_id, kind, zlib.crc32(payload)))
+        self._file.write(payload)
+        self._size += _header.size + len(payload)
+        self.written += 1
+
+    def _sync(self, force):
+        if self._file is None or not self._dirty or self.fsync == FSYNC_NEVER:
+            return
+        if force or time.monotonic() - self._last_sync >= self.fsync_interval:
+            os.fsync(self._file.fileno())
+            self._last_sync = time.monotonic()
+            self._dirty = False
+
+    def _roll(self, first_id):
+        if self._file is not None:
+            self._file.flush()
+            if self.fsync != FSYNC_NEVER:
+                os.fsync(self._file.fileno())
+            self._file.close()
+        path = os.path.join(self.directory, f"{max(first_id, 0):020d}{_suffix}")
+        self._file = open(path, "ab")
+        self._size = self._file.tell()
+        self._dirty = False
+        self._drop_segments(keep=self.max_segments)
+
+    def _drop_segments(self, keep):
+        segments = self.segments()
+        for path in segments[:max(len(segments) - keep, 0)]:
+            os.remove(path)
+
+
+def _scan(path):
+    # Hops over the record headers. Returns tuple(<[(offset, id, kind, length)]>, <end of the last good record>, <mmap>)
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return [], 0, None
+        mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    records = []
+    offset = 0
+    size = len(mm)
+    while offset + _header.size <= size:
+        length, msg_id, kind, crc = _header.unpack_from(mm, offset)
+        end = offset + _header.size + length
+        if end > size:
+            break
+        records.append((offset, msg_id, kind, length))
+        offset = end
+    if records:     # Only the last record can be torn, so that is the only crc worth checking here
+        last, msg_id, kind, length = records[-1]
+        start = last + _header.size
+        if zlib.crc32(mm[start:start + length]) != _header.unpack_from(mm, last)[3]:
+            records.pop()
+            return records, last, mm
+    return records, offset, mm
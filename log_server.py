@@ -1,53 +1,205 @@
+import atexit
 import datetime
+import hashlib
+import hmac
 import json
+import math
 import os
+import re
+import sys
+import threading
 import time
 
 from flask import Flask
+from flask import Response
+from flask import g
 from flask import request
 from flask import render_template
+from markupsafe import Markup
+from urllib.parse import urlencode
 from werkzeug.exceptions import BadRequest
+from werkzeug.http import http_date
 
+from log_cache import RowCache
+from log_cold import ColdStore
+from log_export import iter_export, iter_pages, EXPORT_FORMATS, FORMAT_NDJSON
+from log_index import LogIndex
+from log_ingest import iter_body, iter_chunks, iter_gunzip
+from log_registry import load_registry, read_registry, DEFAULT_REGISTRY
+from log_metrics import Counter, Gauge, Histogram, Metrics
+from log_search import SearchIndex
+from log_segments import SegmentLog, FSYNC_INTERVAL
+from log_shipper import LogShipper
+from log_shared import SharedLog, StoreDaemon, SharedStoreUnavailable, ROLE_DAEMON, ROLE_WORKER, SHARED_ROLES
+from log_stats import LogRollup
+from log_store import LogStore, EVICT_OLDEST, EVENT_APPEND, EVENT_EVICT, EVENT_UPDATE
+from log_stream import LogBroadcaster, event_stream
+from log_writer import LogWriter
+from rate_limit import RateLimiter
 from server_services import *
 
 app = Flask(__name__)
 
-global_id = 0
-service_timeout = 10        # How many seconds between services? Used to prevent spam abuse and lock the log server
-is_service_locked = False   # If true, another service cannot be invoked
+timestamp_format = "%H:%M:%S.%f - %d/%m/%Y"
+formatted_seconds = {}      # Whole second -> its 'timestamp_format' text around "%f". See 'format_ts'
+max_formatted_seconds = 4096
+# Service runs allowed per second and burst, for each service and for each client. Prevents spam abuse of the peers
+# The service default is the old lock: one run of each service every 10 seconds
+service_limiter = RateLimiter(float(os.environ.get("SERVICE_RATE", 0.1)), int(os.environ.get("SERVICE_BURST", 1)))
+client_limiter = RateLimiter(float(os.environ.get("CLIENT_SERVICE_RATE", 0.2)),
+                             int(os.environ.get("CLIENT_SERVICE_BURST", 3)))
 def_per_page = 20           # How many entries per page
-entry_list = []
-
-known_servers = ["https://sd-rdm.herokuapp.com", "https://sd-201620236.herokuapp.com",
-                 "https://sd-jhsq.herokuapp.com", "https://sd-app-server-jesulino.herokuapp.com",
-                 "https://sd-mgs.herokuapp.com", "https://sd-dmss.herokuapp.com"]
-shadow_servers = ["https://sd-rdm-shadow1.herokuapp.com", "https://sd-rdm-shadow2.herokuapp.com"]
+log_capacity = int(os.environ.get("LOG_CAPACITY", 100000))     # How many entries are held before evicting
+log_eviction = os.environ.get("LOG_EVICTION", EVICT_OLDEST)     # What to do when full. See 'log_store.py'
+log_store = LogStore(log_capacity, log_eviction)
+# Repeats folded into one entry: unset never, 'runs' for consecutive repeats, or seconds within which they are
+log_coalesce = os.environ.get("LOG_COALESCE")
+log_coalesce = None if not log_coalesce else 0 if log_coalesce == "runs" else float(log_coalesce)
+# Set, several processes share one log through a store daemon. See 'log_shared.py'
+log_shared_socket = os.environ.get("LOG_SHARED_SOCKET")
+log_shared_role = os.environ.get("LOG_SHARED_ROLE", ROLE_WORKER) if log_shared_socket else None
+if log_shared_role is not None and log_shared_role not in SHARED_ROLES:
+    raise ValueError(f"Unknown LOG_SHARED_ROLE '{log_shared_role}'. Use one of {SHARED_ROLES}")
+if log_shared_role == ROLE_WORKER:  # Writes go to the daemon, this store is a replica of its store
+    log_writer = SharedLog(log_shared_socket, log_store, lambda data: LogEntry.from_record(data),
+                           on_setting=lambda name, value: apply_setting(name, value))
+else:   # Every write goes through here. See 'log_writer.py'
+    log_writer = LogWriter(log_store, coalesce=log_coalesce)
+store_daemon = None
+max_batch_errors = 10       # How many parse errors are reported back by '/log/batch'
+max_api_limit = 1000        # Most entries '/api/log' returns at once
+compact_fields = ("id", "from", "severity", "severity_key", "user_shade", "comment", "timestamp", "body", "repeats",
+                  "last_timestamp")     # Order of the values of an entry sent compact, see 'compact_entry'
+export_chunk = 1000         # Entries '/log/export' reads and encodes at a time
+stream_heartbeat = 15       # Seconds between keep-alive comments on '/log/stream'
+broadcaster = LogBroadcaster(int(os.environ.get("LOG_MAX_STREAMS", 50)))
+log_store.add_listener(broadcaster.on_store_event)
+log_index = LogIndex()      # Severity, source and time filters
+log_store.add_listener(log_index.on_store_event)
+search_index = SearchIndex()    # Words in 'comment' and 'body'
+log_store.add_listener(search_index.on_store_event)
+log_rollup = LogRollup(float(os.environ.get("LOG_STATS_BUCKET", 60)))     # Counts per severity, source and minute
+log_store.add_listener(log_rollup.on_store_event)
+max_stats_buckets = 1440    # Most time buckets '/log/stats' returns at once
+row_cache = RowCache(int(os.environ.get("LOG_ROW_CACHE", 5000)))     # Rendered rows and json() of recent entries
+log_store.add_listener(row_cache.on_store_event)
+# Evicted entries move to compressed blocks, dropped once past any of these limits. See 'log_cold.py'
+log_retention_bytes = int(os.environ.get("LOG_RETENTION_BYTES", 64 * 1024 * 1024))     # 0 keeps nothing evicted
+log_retention_entries = int(os.environ["LOG_RETENTION_ENTRIES"]) if os.environ.get("LOG_RETENTION_ENTRIES") else None
+log_retention_age = float(os.environ["LOG_RETENTION_AGE"]) if os.environ.get("LOG_RETENTION_AGE") else None   # Seconds
+cold_store = ColdStore(lambda entry: entry.record(), lambda data: LogEntry.from_record(data),
+                       max_entries=log_retention_entries,
+                       max_bytes=log_retention_bytes, max_age=log_retention_age,
+                       tally=log_rollup.tally, on_drop=log_rollup.drop)
+if log_retention_bytes > 0:
+    log_store.add_listener(cold_store.on_store_event)
+    log_rollup.keep_evicted = True  # Counted until dropped from the cold tier
+# Served by '/server/metrics' in the Prometheus text format. See 'log_metrics.py'
+metrics = Metrics()
+request_latency = metrics.add(Histogram("logserver_http_request_seconds", "Time to answer a request, by route",
+                                        ("method", "route")))
+request_count = metrics.add(Counter("logserver_http_requests_total", "Requests answered, by route and status",
+                                    ("method", "route", "code")))
+ingested_count = metrics.add(Counter("logserver_entries_ingested_total",
+                                     "Entries committed to the log, by severity and source", ("severity", "source")))
+evicted_count = metrics.add(Counter("logserver_entries_evicted_total", "Entries evicted from the store"))
+metrics.add(peer_latency, peer_errors)
+log_data_dir = os.environ.get("LOG_DATA_DIR")   # If set, the log survives restarts. See 'log_segments.py'
+log_fsync = os.environ.get("LOG_FSYNC", FSYNC_INTERVAL)
+log_segment_bytes = int(os.environ.get("LOG_SEGMENT_BYTES", 16 * 1024 * 1024))
+segment_log = None
+# Peers, their nicknames and shades, and severity names. Reloaded by 'POST /info' with "registry". See 'log_registry.py'
+log_registry_path = os.environ.get("LOG_REGISTRY")     # JSON file, the built-in registry if not set
+registry = load_registry(read_registry(log_registry_path) if log_registry_path else DEFAULT_REGISTRY)
+known_servers = registry.peers
+shadow_servers = registry.shadows
 secondary_servers = []
+# Log servers every appended entry is forwarded to, comma separated. 'shadow' stands for 'shadow_servers'. Forwarding
+# both ways between two servers would loop. See 'log_shipper.py'
+log_ship_to = [url for name in os.environ.get("LOG_SHIP_TO", "").split(",") if name.strip()
+               for url in (shadow_servers if name.strip() == "shadow" else [name.strip()])]
+log_shipper = None
+# Shared by the servers shipping to each other. Batches posted with it are replicas: they keep the time, repeats and
+# user shade they were shipped with. Unset, every shipped entry is logged anew, at the time it arrives
+log_replica_key = os.environ.get("LOG_REPLICA_KEY")
 
 
 class LogEntry:
-    def __init__(self, s_from="Unknown", severity="Information", comm="Not Specified", body=None):
-        global global_id
-        self.msg_id = global_id
-        self.log_from = s_from + nickname(s_from)
-        self.severity = severity
+    # Kept small since there can be millions of them: no per entry dict, source names and severities are shared
+    # between entries (see 'Registry.source' and 'Registry.severity') and 'timestamp' is only formatted when asked for
+    __slots__ = ("msg_id", "log_from", "severity", "severity_key", "user_shade", "comment", "ts", "body", "repeats",
+                 "last_ts")
+
+    def __init__(self, s_from="Unknown", severity="Information", comm="Not Specified", body=None, user_shade=None):
+        self.msg_id = None      # Given by 'log_writer', along with the final 'ts'
+        self.log_from, shade = registry.sources.get(s_from) or registry.source(s_from)
+        self.severity, self.severity_key = registry.severities.get(severity) or registry.severity(severity)
+        self.user_shade = user_shade if user_shade is not None else shade
         self.comment = comm
-        self.timestamp = datetime.datetime.now().strftime("%H:%M:%S.%f - %d/%m/%Y")
+        self.ts = time.time()   # Sortable, used by the time filters
         self.body = body
-        self.flavor = {  # Cosmetic hints
-            "severity": severity_flavor_keys(severity),
-            "user_shade": user_shade_flavor_keys()
+        self.repeats = 1        # Raised by 'log_writer' when coalescing, along with 'last_ts' (see 'log_coalesce')
+        self.last_ts = self.ts
+
+    @property
+    def timestamp(self):
+        return format_ts(self.ts)
+
+    @property
+    def last_timestamp(self):
+        return format_ts(self.last_ts)
+
+    @property
+    def flavor(self):   # Cosmetic hints
+        return {
+            "severity": self.severity_key,
+            "user_shade": self.user_shade
         }
-        global_id += 1
+
+    @staticmethod
+    def restore(data):  # Rebuilds an entry from its json(), keeping the id. Used when loading from disk
+        entry = LogEntry.__new__(LogEntry)
+        entry.msg_id = data["id"]
+        entry.log_from = sys.intern(data["from"])
+        entry.severity, entry.severity_key = registry.severity(data["severity"])
+        entry.user_shade = sys.intern(data["flavor"]["user_shade"])
+        entry.comment = data["comment"]
+        if "ts" in data:
+            entry.ts = data["ts"]
+        else:
+            entry.ts = datetime.datetime.strptime(data["timestamp"], timestamp_format).timestamp()
+        entry.body = data["body"]
+        entry.repeats = data.get("repeats", 1)
+        entry.last_ts = data.get("last_ts", entry.ts)
+        return entry
+
+    def record(self):   # Compact form for the cold tier, see 'from_record'
+        return [self.msg_id, self.log_from, self.severity, self.user_shade, self.comment, self.ts, self.body,
+                self.repeats, self.last_ts]
+
+    @staticmethod
+    def from_record(data):
+        entry = LogEntry.__new__(LogEntry)
+        (entry.msg_id, log_from, severity, user_shade, entry.comment, entry.ts, entry.body, entry.repeats,
+         entry.last_ts) = data
+        entry.log_from = sys.intern(log_from)
+        entry.severity, entry.severity_key = registry.severity(severity)
+        entry.user_shade = sys.intern(user_shade)
+        return entry
 
     def json(self):
+        timestamp = format_ts(self.ts)
         out = {
             "id": self.msg_id,
             "from": self.log_from,
             "severity": self.severity,
             "comment": self.comment,
-            "timestamp": self.timestamp,
+            "timestamp": timestamp,
+            "ts": self.ts,
             "body": self.body,
+            "repeats": self.repeats,
+            "last_timestamp": timestamp if self.last_ts == self.ts else format_ts(self.last_ts),
+            "last_ts": self.last_ts,
             "flavor": self.flavor
         }
         return out
@@ -55,11 +207,46 @@ class LogEntry:
 
 @app.route('/server/status', methods=["GET"])   # Used to fetch data
 def server_fetch():
+    limits = {"service": service_limiter.status(), "client": client_limiter.status()}
+    shipping = log_shipper.status() if log_shipper is not None else []
+    headers = conditional_headers(json.dumps([limits, shipping], sort_keys=True))
+    if is_not_modified(headers):
+        return "", 304, headers
     internal = {
-        "entry_count": len(entry_list),
-        "services_timedout": is_service_locked
+        "entry_count": len(log_store),
+        "last_id": last_entry_id(),
+        "services_timedout": len(limits["service"]["waiting"]) > 0,
+        "rate_limits": limits,
+        "shipping": shipping
     }
-    return json.dumps(internal), 200
+    return json.dumps(internal), 200, headers
+
+
+@app.route('/server/metrics', methods=["GET"])  # Prometheus scrape target
+def server_metrics():
+    return Response(metrics.render(), 200, content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):   # Streamed answers are timed up to their first byte
+    start = g.get("request_start")
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        request_latency.observe(time.perf_counter() - start, request.method, route)
+        request_count.inc(request.method, route, str(response.status_code))
+    return response
+
+
+@app.route('/server/peers', methods=["GET"])    # Cached info, latency and failure history of the known peers
+def server_peers():
+    if request.args.get("refresh") is not None:
+        peer_registry.refresh()
+    return json_response({"ttl": peer_registry.ttl, "peers": peer_registry.status()}, 200)
 
 
 @app.route('/log/clear', methods=["POST"])
@@ -75,8 +262,9 @@ def clear_logs():
         except KeyError:
             req_comm = "Log Clear Request"
         entry = LogEntry(s_from=req_from, severity="Information", comm=req_comm)
-        entry_list.clear()
-        entry_list.append(entry)
+        log_writer.clear(entry)
+        if wants_ack():
+            return ack_entry(entry)
         return show_recent_entries()
     except BadRequest:
         return "Bad Request Ignored", 400
@@ -85,30 +273,13 @@ def clear_logs():
 @app.route('/log', methods=["POST"])
 def add_entry():
     try:
-        req = request.json
-        req_severity = "Unknown"
-        req_from = "Unknown"
-        req_comm = "Not Specified"
-        req_body = {}
-        inputs = 4
-        try:
-            req_severity = req["severity"]
-        except KeyError:
-            inputs -= 1
-        try:
-            req_from = req["from"]
-        except KeyError:
-            inputs -= 1
-        try:
-            req_comm = req["comment"]
-        except KeyError:
-            inputs -= 1
-        try:
-            req_body = req["body"]
-        except KeyError:
-            inputs -= 1
-        if inputs > 0:
-            entry_list.append(LogEntry(req_from, req_severity, req_comm, req_body))
+        fields = read_entry_fields(request.json)
+        if fields is not None:
+            entry = LogEntry(*fields)
+            if not log_writer.append(entry):
+                return "Log is full. Entry Ignored", 507
+            if wants_ack():
+                return ack_entry(entry)
             return show_recent_entries()
         else:
             return "Empty Entry Ignored", 400
@@ -116,42 +287,362 @@ def add_entry():
         return "Bad Entry Ignored", 400
 
 
+@app.route('/log/batch', methods=["POST"])     # Accepts a JSON array or NDJSON (one entry per line)
+def add_entries():
+    entries = []
+    rejected = 0
+    errors = []
+    chunks = iter_chunks(request.stream)
+    if request.headers.get("Content-Encoding", "").lower() == "gzip":   # As sent by 'log_shipper'
+        chunks = iter_gunzip(chunks)
+    replica = is_replica_post()
+    try:
+        for ok, item in iter_body(chunks):
+            fields = read_entry_fields(item) if ok else None
+            if fields is None:
+                rejected += 1
+                if not ok and len(errors) < max_batch_errors:
+                    errors.append(item)
+                continue
+            try:
+                entry = LogEntry(*fields)
+            except (TypeError, AttributeError):     # 'from' or 'severity' weren't strings
+                rejected += 1
+                continue
+            if replica:
+                keep_replica_fields(entry, item)
+            entries.append(entry)
+    except ValueError as exc:   # Broken gzip
+        return json.dumps({"accepted": 0, "rejected": rejected + len(entries), "errors": [str(exc)]}), 400
+    accepted = log_writer.extend(entries, replica=replica)
+    out = {
+        "accepted": accepted,
+        "rejected": rejected + len(entries) - accepted,     # Whatever didn't fit in the store is also rejected
+        "errors": errors
+    }
+    return json.dumps(out), (400 if accepted == 0 and out["rejected"] > 0 else 200)
+
+
+def is_replica_post():  # Sent by a 'log_shipper' with the same LOG_REPLICA_KEY
+    key = request.headers.get("X-Log-Replica")
+    return bool(log_replica_key) and key is not None and hmac.compare_digest(key.encode(), log_replica_key.encode())
+
+
+def keep_replica_fields(entry, item):   # What a replica keeps of the entry it was shipped from. See 'ship_item'
+    ts = item.get("ts")
+    if isinstance(ts, (int, float)) and not isinstance(ts, bool):
+        entry.ts = entry.last_ts = ts
+    last_ts = item.get("last_ts")
+    if isinstance(last_ts, (int, float)) and not isinstance(last_ts, bool) and last_ts >= entry.ts:
+        entry.last_ts = last_ts
+    repeats = item.get("repeats")
+    if isinstance(repeats, int) and not isinstance(repeats, bool) and repeats >= 1:
+        entry.repeats = repeats
+    user_shade = item.get("user_shade")
+    if isinstance(user_shade, str):
+        entry.user_shade = sys.intern(user_shade)
+
+
+def read_filters():     # Keyword arguments for LogIndex.query from the url, empty if there is no filter
+    filters = {}
+    severities = split_args("severity")
+    if severities:
+        filters["severities"] = {registry.severity_key(severity) for severity in severities}
+    sources = split_args("from")
+    if sources:     # Sources are stored with their nickname, so accept both forms
+        filters["sources"] = set(sources) | {source + registry.nickname(source) for source in sources}
+    if request.args.get("start"):
+        filters["start_ts"] = parse_time(request.args.get("start"))
+    if request.args.get("end"):
+        filters["end_ts"] = parse_time(request.args.get("end"))
+    return filters
+
+
+def split_args(name):   # Accepts both 'name=a&name=b' and 'name=a,b'
+    return [value.strip() for arg in request.args.getlist(name) for value in arg.split(",") if value.strip()]
+
+
+def parse_time(value):  # Epoch seconds or ISO 8601 in server time. Raises ValueError
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid time '{value}'. Use epoch seconds or ISO 8601 (YYYY-MM-DDTHH:MM:SS)")
+
+
+def filter_args():  # Filters in the current url, to be kept by the page links
+    args = [(name, value) for name in ("severity", "from", "start", "end") for value in request.args.getlist(name)]
+    return ("&" + urlencode(args)) if args else ""
+
+
+def wants_ack():    # Machine clients get a short ack, browsers get the rendered page
+    flag = request.args.get("ack", request.headers.get("X-Log-Ack"))
+    if flag is not None:    # Explicitly asked by the client
+        return flag.lower() not in ("0", "false", "no")
+    return request.accept_mimetypes.best_match(["application/json", "text/html"]) != "text/html"
+
+
+def ack_entry(entry):
+    return json_response({"id": entry.msg_id}, 202)
+
+
+def json_response(data, return_code):
+    return json.dumps(data), return_code, {"Content-Type": "application/json"}
+
+
+def optional_int_arg(name):     # Raises ValueError if the argument is there but isn't an integer
+    value = request.args.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be an integer, got '{value}'")
+
+
+def read_entry_fields(req):     # Returns the LogEntry arguments, or None if the entry has no known field
+    if not isinstance(req, dict):
+        return None
+    req_severity = "Unknown"
+    req_from = "Unknown"
+    req_comm = "Not Specified"
+    req_body = {}
+    inputs = 4
+    try:
+        req_severity = req["severity"]
+    except KeyError:
+        inputs -= 1
+    try:
+        req_from = req["from"]
+    except KeyError:
+        inputs -= 1
+    try:
+        req_comm = req["comment"]
+    except KeyError:
+        inputs -= 1
+    try:
+        req_body = req["body"]
+    except KeyError:
+        inputs -= 1
+    if inputs > 0:
+        return req_from, req_severity, req_comm, req_body
+    return None
+
+
 @app.route('/log', methods=['GET'])
 def show_recent_entries():
-    handle_log_services()
-    out, cur_page, max_page, per_page = prepare_page()
-    rev = entry_list[::-1]
-    for entry in rev[(cur_page - 1) * per_page:]:
-        out["entries"].append(entry.json())
-        if len(out["entries"]) == per_page:
-            break
-    return serve_page(out, 200)
+    return show_page(newest_first=True)
 
 
 @app.route('/log/old', methods=['GET'])
 def show_entries():
+    return show_page(newest_first=False)
+
+
+def show_page(newest_first):
+    headers = conditional_headers(request.query_string.decode("utf-8", "replace"))
+    if request.args.get("ssrc") is None and is_not_modified(headers):    # Service requests must always run
+        return "", 304, headers
     handle_log_services()
-    out, cur_page, max_page, per_page = prepare_page()
-    for entry in entry_list[(cur_page - 1) * per_page:]:
-        out["entries"].append(entry.json())
-        if len(out["entries"]) == per_page:
-            break
-    return serve_page(out, 200)
+    try:
+        filters = read_filters()
+    except ValueError as exc:
+        return str(exc), 400
+    hot_total, cold_total = held_counts(filters)
+    out, cur_page, max_page, per_page = prepare_page(hot_total + cold_total)
+    offset = (cur_page - 1) * per_page
+    if filters:
+        def read_hot(skip, count):
+            return log_index.query(offset=skip, count=count, newest_first=newest_first, **filters)[0]
+    elif newest_first:
+        read_hot = log_store.newest
+    else:
+        read_hot = log_store.oldest
+
+    def read_cold(skip, count):
+        return cold_store.query(offset=skip, count=count, newest_first=newest_first, **filters)[0]
+    entries = tiered_page(read_hot, hot_total, read_cold, cold_total, offset, per_page, newest_first)
+    if request.args.get("format") == "json":    # The same page for the table script, which renders it itself
+        out["entries"] = [compact_entry(entry) for entry in entries]
+        out["fields"] = compact_fields
+        return json.dumps(out), 200, headers
+    out["rows"] = [row_cache.row(entry, render_row) for entry in entries]
+    return serve_page(out, 200, headers)
+
+
+@app.route('/api/log', methods=['GET'])    # Cursor based JSON read. Cursors are entry ids, so they never shift
+def api_entries():
+    try:
+        since_id = optional_int_arg("since_id")
+        before_id = optional_int_arg("before_id")
+        limit = optional_int_arg("limit")
+        filters = read_filters()
+    except ValueError as exc:
+        return json_response({"error": str(exc)}, 400)
+    limit = def_per_page if limit is None else min(max(limit, 1), max_api_limit)
+    max_id = before_id - 1 if before_id is not None else None
+    if since_id is not None:    # Oldest first, from the cold tier on into the store
+        entries = cold_store.query(min_id=since_id + 1, max_id=max_id, count=limit, newest_first=False, **filters)[0]
+        min_id = entries[-1].msg_id + 1 if entries else since_id + 1
+        if len(entries) < limit:
+            entries += read_store(filters, min_id, max_id, limit - len(entries), False)
+    else:                       # Newest first, from the store on into the cold tier
+        entries = read_store(filters, None, max_id, limit, True)
+        if len(entries) < limit:
+            max_id = entries[-1].msg_id - 1 if entries else max_id
+            entries += cold_store.query(max_id=max_id, count=limit - len(entries), **filters)[0]
+    first = oldest_entry()
+    ids = [entry.msg_id for entry in entries]
+    if ids:
+        next_since = max(ids)
+        if filters:
+            older = (log_index.query(max_id=min(ids) - 1, count=0, **filters)[1] +
+                     cold_store.query(max_id=min(ids) - 1, count=0, **filters)[1]) > 0
+        else:
+            older = first is not None and first.msg_id < min(ids)
+        next_before = min(ids) if older else None
+    else:
+        next_since = since_id if since_id is not None else (before_id - 1 if before_id is not None else last_entry_id())
+        next_before = None
+    out = {
+        "entries": [row_cache.json(entry) for entry in entries],
+        "next_since_id": next_since,        # Poll with this to get only the newer entries
+        "next_before_id": next_before,      # Page back with this. None when there are no older entries held
+        "oldest_id": first.msg_id if first is not None else -1,     # Anything below was evicted
+        "last_id": last_entry_id(),
+        "updates": log_store.updates        # Moves when a repeat is folded into an entry already read
+    }
+    if request.args.get("compact") == "1":     # Values only, in the order of 'fields'
+        out["entries"] = [compact_entry(entry) for entry in entries]
+        out["fields"] = compact_fields
+        out["count"] = sum(held_counts(filters))   # What the table shows as the total
+    return json_response(out, 200)
+
+
+@app.route('/log/search', methods=['GET'])     # q=election logserver_ab* matches entries holding every term
+def search_entries():
+    try:
+        before_id = optional_int_arg("before_id")
+        limit = optional_int_arg("limit")
+        limit = def_per_page if limit is None else min(max(limit, 1), max_api_limit)
+        entries, next_before = search_index.search(request.args.get("q", ""), before_id, limit)
+        if next_before is None and len(cold_store) > 0:     # Nothing else in the store, go on into the cold tier
+            if len(entries) == limit:
+                next_before = entries[-1].msg_id
+            else:
+                first = log_store.first()
+                cold_before = first.msg_id if first is not None else None
+                if before_id is not None and (cold_before is None or before_id < cold_before):
+                    cold_before = before_id
+                older, next_before = cold_store.search(search_index.parse(request.args.get("q", "")), cold_before,
+                                                       limit - len(entries))
+                entries += older
+    except ValueError as exc:
+        return json_response({"error": str(exc)}, 400)
+    out = {
+        "entries": [row_cache.json(entry) for entry in entries],
+        "next_before_id": next_before   # Next page, newest first. None when there are no more matches
+    }
+    return json_response(out, 200)
+
+
+@app.route('/log/stats', methods=['GET'])  # Counts of the held entries by severity, source and time bucket
+def log_stats():
+    headers = conditional_headers(request.query_string.decode("utf-8"))
+    if is_not_modified(headers):
+        return "", 304, headers
+    try:
+        filters = read_filters()
+        limit = optional_int_arg("buckets")
+        limit = 60 if limit is None else min(max(limit, 1), max_stats_buckets)
+        width = request.args.get("bucket")     # Seconds, a multiple of LOG_STATS_BUCKET
+        out = log_rollup.stats(bucket_seconds=float(width) if width else None, limit=limit, **filters)
+    except ValueError as exc:
+        return json_response({"error": str(exc)}, 400)
+    return json.dumps(out), 200, headers
+
+
+@app.route('/log/export', methods=['GET'])     # Everything held, or what is inside the bounds, oldest first
+def export_entries():
+    fmt = request.args.get("format", FORMAT_NDJSON)
+    if fmt not in EXPORT_FORMATS:
+        return json_response({"error": f"Unknown format '{fmt}'. Use one of {sorted(EXPORT_FORMATS)}"}, 400)
+    try:
+        min_id = optional_int_arg("min_id")
+        max_id = optional_int_arg("max_id")
+        filters = read_filters()
+    except ValueError as exc:
+        return json_response({"error": str(exc)}, 400)
+    last_id = last_entry_id()   # Entries logged during the export are left out, so it always ends
+    max_id = last_id if max_id is None else min(max_id, last_id)
+    flag = request.args.get("gzip")
+    if flag is not None:
+        compress = flag.lower() not in ("0", "false", "no")
+    else:
+        compress = "gzip" in request.accept_encodings
+
+    def read(last, count, max_id):     # The cold tier first, then the store
+        min_id = last + 1 if last is not None else None
+        entries = cold_store.query(min_id=min_id, max_id=max_id, count=count, newest_first=False, **filters)[0]
+        return entries or read_store(filters, min_id, max_id, count, False)
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    headers = {"Content-Disposition": f"attachment; filename=log_export.{extension}", "Vary": "Accept-Encoding"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    body = iter_export(iter_pages(read, min_id, max_id, export_chunk), fmt, compress)
+    return Response(body, 200, headers, mimetype=mimetype)
+
+
+@app.route('/log/stream', methods=['GET'])     # Live tail as Server-Sent Events
+def stream_entries():
+    try:
+        last_id = optional_int_arg("since_id")
+        if request.headers.get("Last-Event-ID"):    # Browser reconnecting, resume where it stopped
+            last_id = int(request.headers.get("Last-Event-ID"))
+    except ValueError:
+        return "Invalid stream cursor", 400
+    if last_id is None:
+        last_id = last_entry_id()
+    if not broadcaster.subscribe():
+        return "Too many live viewers. Try again later", 503
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    hint = request.args.get("hint") is not None     # Ids only, see 'event_stream'
+    response = Response(event_stream(log_store, broadcaster, last_id, stream_heartbeat, to_json=row_cache.json,
+                                     hint=hint), 200, headers, mimetype="text/event-stream")
+    response.call_on_close(broadcaster.unsubscribe)
+    return response
 
 
 # noinspection PyBroadException
 @app.route('/info', methods=['POST'])
 def set_info():
-    global secondary_servers
     try:
         if "secondary_servers" in request.json:
-            secondary_servers = request.json["secondary_servers"]
-    except ValueError:
+            share_setting("secondary_servers", request.json["secondary_servers"])
+        if "registry" in request.json:  # A new registry, or "reload" to read LOG_REGISTRY again
+            data = request.json["registry"]
+            if data == "reload":
+                if log_registry_path is None:
+                    raise ValueError("There is no LOG_REGISTRY file to reload")
+                data = read_registry(log_registry_path)
+            load_registry(data)     # Only shared once it is known to compile
+            share_setting("registry", data)
+            internal_log(severity="Success", comment="Registry reloaded",
+                         body={"peers": len(registry.peers), "shadows": len(registry.shadows)})
+    except ValueError as exc:
         internal_log(severity="Attention", comment="Invalid value received when setting data", body=request.json)
+        return json.dumps({"error": str(exc)}), 400
     except TypeError:
         internal_log(severity="Error", comment="Request have an invalid type", body=request.json)
+        return json.dumps({"error": "Invalid type"}), 400
     except Exception as exc:
         log_uncaught_exception(str(exc), request.json)
+        return json.dumps({"error": str(exc)}), 500
+    return "", 204
 
 
 @app.route('/info', methods=['GET'])
@@ -172,12 +663,35 @@ def info():
             "servers": {
                 "known_servers": known_servers,
                 "secondary_servers": secondary_servers
-            }
+            },
+            "registry": registry.data
         }
     }
     return json.dumps(out), 418
 
 
+def share_setting(name, value):     # Applied here and, when the log is shared, in every other worker too
+    if log_shared_role == ROLE_WORKER:
+        log_writer.set(name, value)     # Comes back through 'apply_setting'
+    else:
+        apply_setting(name, value)
+
+
+def apply_setting(name, value):
+    global secondary_servers, registry, known_servers, shadow_servers
+    if name == "secondary_servers":
+        secondary_servers = value
+    elif name == "registry":    # Swapped whole, so a request sees either the old one or the new one
+        registry = load_registry(value)
+        known_servers = registry.peers
+        shadow_servers = registry.shadows
+
+
+@app.errorhandler(SharedStoreUnavailable)
+def shared_store_unavailable(exc):
+    return "Log store unavailable. Try again later", 503
+
+
 # noinspection PyBroadException
 def handle_log_services():     # If supplied by the url, execute services
     try:
@@ -198,28 +712,40 @@ def handle_log_services():     # If supplied by the url, execute services
             internal_log(severity="Error", comment="Request for internal service without url database defined!")
             return
         # All ready to process the request
-        if is_service_locked is False:
-            internal_log(severity="Success", comment="Working on your service request. Results coming shortly...")
-            arg_list = [request.args.get("pi"),     # [0] - Pull Info
-                        request.args.get("sime"),   # [1] - SIMulate Election
-                        request.args.get("stt"),    # [2] - SeT all To
-                        request.args.get("fl"),     # [3] - Find Leader
-                        request.args.get("afr")]    # [4] - Ask For Resource
-            threading.Thread(target=handle_demanding, args=(urls, arg_list)).start()
-        else:
-            internal_log(severity="Warning",
-                         comment=f"Services are in time out. Wait {service_timeout} seconds before another request")
-        threading.Thread(target=enforce_timeout).start()
+        service_names = ["pi", "sime", "stt", "fl", "afr"]
+        arg_list = [request.args.get("pi"),     # [0] - Pull Info
+                    request.args.get("sime"),   # [1] - SIMulate Election
+                    request.args.get("stt"),    # [2] - SeT all To
+                    request.args.get("fl"),     # [3] - Find Leader
+                    request.args.get("afr")]    # [4] - Ask For Resource
+        # Every run pulls info, so a request without services still counts as 'pi'
+        services = [name for name, arg in zip(service_names, arg_list) if arg is not None] or ["pi"]
+        client = request.access_route[-1]   # Address added by the closest proxy, or the peer's own
+        wait = client_limiter.acquire([client])
+        if wait > 0:
+            internal_log(severity="Warning", comment=f"Too many service requests from '{client}'. "
+                                                     f"Wait {math.ceil(wait)} seconds before another request")
+            return
+        wait = service_limiter.acquire(services)
+        if wait > 0:    # Not run, so it doesn't count against the client
+            client_limiter.release([client])
+            internal_log(severity="Warning", comment=f"Services {services} are in time out. "
+                                                     f"Wait {math.ceil(wait)} seconds before another request")
+            return
+        internal_log(severity="Success", comment="Working on your service request. Results coming shortly...")
+        fresh = request.args.get("fresh") is not None   # Ask every server again instead of using 'peer_registry'
+        threading.Thread(target=handle_demanding, args=(urls, arg_list, fresh)).start()
     except Exception as exc:
         log_uncaught_exception(str(exc), request.json)
 
 
-def handle_demanding(urls, args=None):    # All demanding tasks that require an update afterwards
+def handle_demanding(urls, args=None, fresh=False):    # All demanding tasks that require an update afterwards
     try:
         if args is None:
             internal_log(severity="Attention", comment="Empty Demanding request ignored")
             return
-        pi_data, valid_servers, invalid_servers = pull_info(urls)
+        deadline = peer_client.new_deadline()   # Shared by every step, so a hung peer can't hold the run up
+        pi_data, valid_servers, invalid_servers = pull_info(urls, deadline, fresh)
         if args[0] is not None:     # Pull info from all servers
             if 'v' in args[0]:
                 for server in pi_data:
@@ -242,7 +768,8 @@ def handle_demanding(urls, args=None):    # All demanding tasks that require an
                 internal_log(severity="Attention", comment=f"There are no servers running '{args[1]}' elections")
             elif len(election_servers) == 1:
                 internal_log(severity="Warning", comment=f"Only '{election_servers[0]}' is running '{args[1]}' elections")
-            entry_dump = simulate_election(election_servers, args[1])
+            entry_dump = simulate_election(election_servers, args[1], deadline)
+            peer_registry.invalidate(election_servers)   # The leader may have changed
             for entry in entry_dump:
                 internal_log(entry[0], entry[1], entry[2])
         if args[2] is not None:     # Set all servers election to...
@@ -254,7 +781,7 @@ def handle_demanding(urls, args=None):    # All demanding tasks that require an
                 internal_log(severity="Warning", comment=f"Unsupported election of type '{args[2]}' requested")
                 return
             internal_log(severity="Information", comment=f"Attempting to set all servers to '{tgt_election}'...")
-            entry_dump = set_all_elections(valid_servers, tgt_election)
+            entry_dump = set_all_elections(valid_servers, tgt_election, deadline)
             for entry in entry_dump:
                 internal_log(entry[0], entry[1], entry[2])
         if args[3] is not None:     # Find who is the leader
@@ -262,30 +789,29 @@ def handle_demanding(urls, args=None):    # All demanding tasks that require an
                 internal_log(severity="Warning", comment="An invalid service was request and ignored",
                              body={"find_leader": args[3]})
                 return
-            leaders, leader_count, entry_dump = find_leader(valid_servers)
+            leaders, leader_count, entry_dump = find_leader(valid_servers, deadline)
             for entry in entry_dump:
                 internal_log(entry[0], entry[1], entry[2])
             if leader_count == 1:
-                internal_log(severity="Success", comment=f"'{leaders[0]}' {nickname(leaders[0])} is the leader / coordinator")
+                internal_log(severity="Success", comment=f"'{leaders[0]}' {registry.nickname(leaders[0])} is the leader / coordinator")
             elif leader_count > 1:
                 for leader in leaders:
                     internal_log(severity="Warning",
-                                 comment=f"'{leader}' {nickname(leader)} is ALSO the leader / coordinator")
+                                 comment=f"'{leader}' {registry.nickname(leader)} is ALSO the leader / coordinator")
         if args[4] is not None:     # Ask a random server to post '/recurso'
             if args[4] != '1':
                 internal_log(severity="Warning", comment="An invalid service was request and ignored",
                              body={"ask_for_resource": args[4]})
                 return
             servers_to_ask = [svr for svr, elec, svr_id in valid_servers]
-            entry_dump = ask_resource(servers_to_ask)
+            entry_dump = ask_resource(servers_to_ask, deadline)
             for entry in entry_dump:
                 internal_log(entry[0], entry[1], entry[2])
     except Exception as exc:
         log_uncaught_exception(str(exc), request.json)
 
 
-def get_page_format():      # Returns the page, max page and epp based on the url arguments
-    entry_count = len(entry_list)
+def get_page_format(entry_count):     # Returns the page, max page and epp based on the url arguments
     try:
         if request.args.get("epp") is not None and 0 < int(request.args.get("epp")) <= entry_count:
             per_page = int(request.args.get("epp"))
@@ -308,77 +834,208 @@ def get_page_format():      # Returns the page, max page and epp based on the ur
     return cur_page, max_page, per_page
 
 
-def prepare_page():
-    cur_page, max_page, per_page = get_page_format()
-    entries = len(entry_list)
+def prepare_page(entries):  # 'entries' is how many entries can be paged through
+    cur_page, max_page, per_page = get_page_format(entries)
     out = {
         "page": (cur_page if entries > 0 else 0),
         "page_max": max_page,
         "epp": per_page,
         "count": entries,
+        "last_id": last_entry_id(),
+        "filters": filter_args(),
+        "updates": log_store.updates,
         "last_update": datetime.datetime.now().strftime("%H:%M:%S - %d/%m/%Y"),
         "entries": []
     }
     return out, cur_page, max_page, per_page
 
 
-def serve_page(json_data, return_code):
-    return render_template("log_table_flask.html", data=json_data), return_code
+def held_counts(filters):   # tuple(<entries matching 'filters' in the store>, <in the cold tier>)
+    if not filters:
+        return len(log_store), len(cold_store)
+    return log_index.query(count=0, **filters)[1], cold_store.query(count=0, **filters)[1]
 
 
-def severity_flavor_keys(severity: str):
-    sev = severity.lower()
-    if sev == "warning" or sev == "aviso":
-        return "sev_warning"
-    if sev == "attention" or sev == "atencao" or sev == "alerta":
-        return "sev_attention"
-    if sev == "error" or sev == "erro":
-        return "sev_error"
-    if sev == "critical" or sev == "critico":
-        return "sev_critical"
-    if sev == "success" or sev == "sucesso":
-        return "sev_success"
-    else:
-        return "sev_default"
+def serve_page(json_data, return_code, headers=None):
+    return render_template("log_table_flask.html", data=json_data), return_code, (headers or {})
 
 
-def user_shade_flavor_keys():
-    # usr = user_shade.lower()
-    # If more users want colors, add them here, but NEVER add the "Internal", that should be handled manually!
-    return "usr_default"
+def compact_entry(entry):   # Values of 'compact_fields', from the cached json()
+    data = row_cache.json(entry)
+    return [data["id"], data["from"], data["severity"], data["flavor"]["severity"], data["flavor"]["user_shade"],
+            data["comment"], data["timestamp"], data["body"], data["repeats"], data["last_timestamp"]]
 
 
-def nickname(url):
-    if "https://sd-rdm.herokuapp.com" in url:
-        return " (Ramon)"
-    elif "https://sd-201620236.herokuapp.com" in url:
-        return " (Saionara)"
-    elif "https://sd-jhsq.herokuapp.com" in url:
-        return " (João)"
-    elif "https://sd-app-server-jesulino.herokuapp.com" in url:
-        return " (Jesulino)"
-    elif "https://sd-mgs.herokuapp.com" in url:
-        return " (Maira)"
-    elif "https://sd-dmss.herokuapp.com" in url:
-        return " (Diêgo)"
-    return ""
+def render_row(entry_json):     # Table rows of a single entry, cached by 'row_cache'
+    return Markup(app.jinja_env.get_template("log_row.html").render(entry=entry_json))
+
+
+def conditional_headers(key):   # ETag and Last-Modified of a view, from the newest entry and 'key' (the view args)
+    newest = log_store.last()
+    last_id = newest.msg_id if newest is not None else -1
+    version = f"{last_id}.{log_store.updates}.{cold_store.dropped}"    # Folded repeats don't move the newest id
+    headers = {
+        "ETag": '"' + hashlib.sha1(f"{request.path}?{key}#{version}".encode("utf-8")).hexdigest()[:24] + '"',
+        "Cache-Control": "no-cache"     # Always revalidate, it is cheap
+    }
+    if newest is not None:
+        headers["Last-Modified"] = http_date(int(max(newest.ts, log_store.updated_ts)))
+    return headers
+
+
+def is_not_modified(headers):
+    if request.if_none_match:
+        return request.if_none_match.contains(headers["ETag"].strip('"'))
+    if request.if_modified_since is not None and "Last-Modified" in headers:
+        newest = log_store.last()
+        return int(max(newest.ts, log_store.updated_ts)) <= request.if_modified_since.timestamp()
+    return False
 
 
 def internal_log(severity="Information", comment="Not Specified", body=None):
-    global entry_list
-    entry_list.append(LogEntry("Internal", severity, comment, body))
-    entry_list[-1].flavor["user_shade"] = "internal"
+    log_writer.append(LogEntry("Internal", severity, comment, body, user_shade="internal"))
+
+
+def oldest_entry():     # Oldest entry still held by either tier, or None
+    return cold_store.first() if len(cold_store) > 0 else log_store.first()
+
+
+def read_store(filters, min_id, max_id, count, newest_first):   # Bounded read of the store, indexed if filtered
+    if filters:
+        return log_index.query(min_id=min_id, max_id=max_id, count=count, newest_first=newest_first, **filters)[0]
+    if newest_first:
+        entries = log_store.before(max_id + 1, count) if max_id is not None else log_store.newest(0, count)
+        return [entry for entry in entries if min_id is None or entry.msg_id >= min_id]
+    entries = log_store.since(min_id - 1 if min_id is not None else -1, count)
+    return [entry for entry in entries if max_id is None or entry.msg_id <= max_id]
+
+
+def tiered_page(read_hot, hot_total, read_cold, cold_total, offset, count, newest_first):
+    # A page spanning both tiers. read_*(<offset>, <count>) reads one tier in page order. Newest first pages start in
+    # the store (every stored entry is newer than the cold ones) and oldest first ones in the cold tier
+    tiers = [(read_hot, hot_total), (read_cold, cold_total)]
+    if not newest_first:
+        tiers.reverse()
+    entries = []
+    for read, total in tiers:
+        if offset < total and len(entries) < count:
+            entries += read(offset, count - len(entries))
+        offset = max(offset - total, 0)
+    return entries
+
+
+def format_ts(ts):  # 'ts' in 'timestamp_format'. strftime only runs once per second, the microseconds are added
+    whole = math.floor(ts)
+    micro = round((ts - whole) * 1e6)   # Rounded as datetime.fromtimestamp does
+    if micro >= 1000000:
+        whole += 1
+        micro -= 1000000
+    parts = formatted_seconds.get(whole)
+    if parts is None:
+        if len(formatted_seconds) >= max_formatted_seconds:
+            formatted_seconds.clear()
+        moment = datetime.datetime.fromtimestamp(whole)
+        parts = formatted_seconds[whole] = tuple(moment.strftime(part) for part in timestamp_format.split("%f", 1))
+    return f"{parts[0]}{micro:06d}{parts[1]}"
+
+
+def count_entries(event, entries):  # Store listener feeding the ingestion metrics. Runs on the writer thread
+    if event == EVENT_APPEND:
+        for entry in entries:
+            ingested_count.inc(entry.severity, entry.log_from, amount=entry.repeats)
+    elif event == EVENT_UPDATE:     # A repeat folded into an entry is still an entry ingested
+        for entry in entries:
+            ingested_count.inc(entry.severity, entry.log_from)
+    elif event == EVENT_EVICT:
+        evicted_count.inc(amount=len(entries))
+
+
+def log_sizes():    # Gauge reading. {(<tier>, <unit>): <size>}
+    sizes = {("hot", "entries"): len(log_store), ("cold", "entries"): len(cold_store),
+             ("cold", "bytes"): cold_store.size()[1]}
+    if segment_log is not None:
+        disk = 0
+        for path in segment_log.segments():
+            try:
+                disk += os.path.getsize(path)
+            except OSError:     # Dropped meanwhile
+                pass
+        sizes[("disk", "bytes")] = disk
+    return sizes
+
+
+def thread_counts():    # Gauge reading. {(<thread name without its number>,): <threads>}
+    counts = {}
+    for thread in threading.enumerate():
+        name = (re.sub(r"[-_]\d+.*$", "", thread.name),)
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def last_entry_id():    # Id of the newest entry held, -1 if empty. Unlike the count, it moves even when full
+    entry = log_store.last()
+    return entry.msg_id if entry is not None else -1
 
 
 def log_uncaught_exception(exc, body_json):
     internal_log(severity="Critical", comment=f"Uncaught exception: '{exc}'", body=body_json)
 
 
-def enforce_timeout():
-    global is_service_locked
-    is_service_locked = True
-    time.sleep(service_timeout)
-    is_service_locked = False
+def open_segment_log():     # Reloads the newest entries from disk, then keeps persisting the new ones
+    global segment_log
+    if log_data_dir is None:
+        return
+    segment_log = SegmentLog(log_data_dir, segment_bytes=log_segment_bytes, fsync=log_fsync)
+    data, next_id = segment_log.recover(log_capacity)
+    log_store.extend([LogEntry.restore(item) for item in data])     # Nothing else writes yet
+    log_writer.next_id = max(log_writer.next_id, next_id)
+    log_store.add_listener(segment_log.on_store_event)    # Only now, or the recovered entries would be written again
+    segment_log.start()
+
+
+def open_log_shipper():     # After 'open_segment_log', so shipping resumes past what was acknowledged before
+    global log_shipper
+    if not log_ship_to:
+        return
+    log_shipper = LogShipper(log_store, log_ship_to, ship_item, peer_client.post,
+                             batch_size=int(os.environ.get("LOG_SHIP_BATCH", 500)),
+                             max_outbox=int(os.environ.get("LOG_SHIP_OUTBOX", 10000)),
+                             state_path=os.path.join(log_data_dir, "shipping.json") if log_data_dir else None,
+                             replica_key=log_replica_key)
+    log_store.add_listener(log_shipper.on_store_event)
+    log_shipper.start()
+
+
+def ship_item(entry):   # '/log/batch' item of an entry. The source as it was sent, the downstream adds the nickname
+    return {"from": registry.raw_source(entry.log_from), "severity": entry.severity, "comment": entry.comment,
+            "body": entry.body, "ts": entry.ts, "repeats": entry.repeats, "last_ts": entry.last_ts,
+            "user_shade": entry.user_shade}
+
+
+def shipping_lag():     # Gauge reading. {(<downstream>,): <entries not acknowledged yet>}
+    return {(status["url"],): status["lag"] for status in log_shipper.status()} if log_shipper is not None else {}
+
+
+def become_store_daemon():  # Only keeps the log for the workers, which do the indexing and serving themselves
+    global store_daemon
+    for listener in (broadcaster.on_store_event, log_index.on_store_event, search_index.on_store_event,
+                     log_rollup.on_store_event, row_cache.on_store_event):
+        log_store.remove_listener(listener)
+    if log_retention_bytes > 0:
+        log_store.remove_listener(cold_store.on_store_event)
+    store_daemon = StoreDaemon(log_shared_socket, log_store, log_writer, lambda data: LogEntry.from_record(data))
+
+
+def shutdown():     # Commits what is still queued, then flushes it to disk
+    if store_daemon is not None:
+        store_daemon.shutdown()
+    log_writer.close()
+    if log_shipper is not None:
+        log_shipper.close()
+    peer_registry.close()
+    peer_client.close()
+    if segment_log is not None:
+        segment_log.close()
 
 
 def d_fill_server():
@@ -387,9 +1044,30 @@ def d_fill_server():
 
 
 def main():
+    if store_daemon is not None:
+        store_daemon.serve_forever()
+        return
     app.run(host='0.0.0.0', port=int(os.environ.get("PORT", 5000)))
 
 
+metrics.add(Gauge("logserver_log_size", "Entries and bytes held, by tier", log_sizes, ("tier", "unit")),
+            Gauge("logserver_log_capacity", "Entries the store holds before evicting", lambda: log_store.capacity),
+            Gauge("logserver_writer_pending", "Writes queued for the log writer", lambda: log_writer.pending()),
+            Gauge("logserver_stream_subscribers", "Open '/log/stream' connections", lambda: broadcaster.subscribers),
+            Gauge("logserver_threads", "Running threads, by name", thread_counts, ("name",)),
+            Gauge("logserver_shipping_lag_entries", "Entries not acknowledged yet, by downstream log server",
+                  shipping_lag, ("downstream",)))
+if log_shared_role == ROLE_DAEMON:
+    become_store_daemon()
+if log_shared_role != ROLE_WORKER:     # Workers get the log from the daemon, which keeps it on disk
+    open_segment_log()
+    open_log_shipper()
+log_store.add_listener(count_entries)  # Only now, or reloading from disk would count as ingestion
+log_writer.start()
+if log_shared_role != ROLE_DAEMON:
+    peer_registry.start()
+atexit.register(shutdown)
+
 if __name__ == "__main__":
     internal_log(severity="Success", comment="Log Server Started successfully")
     main()
@@ -0,0 +1,343 @@
+import collections
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import traceback
+import uuid
+
+from log_store import EVENT_APPEND, EVENT_CLEAR, EVENT_UPDATE
+
+# One log shared by several server processes on the same machine (e.g. gunicorn workers). A store daemon owns the
+# log: it runs the only LogWriter, so ids stay unique and monotonic across every worker, and the only SegmentLog.
+# Workers hold a replica: their own store, indexes and caches, fed from the daemon over a Unix socket, so every read
+# is served locally and reads scale with the workers. Writes are sent to the daemon, which commits them and sends
+# every commit back to all the workers; a writer waits until its own replica has it, so a worker always shows what
+# it just wrote. Every message the daemon sends is numbered ("s"), which is how a writer knows its replica has it
+# Running it, with the same environment for every process:
+#   LOG_SHARED_SOCKET=/tmp/log.sock LOG_SHARED_ROLE=daemon python log_server.py &
+#   LOG_SHARED_SOCKET=/tmp/log.sock gunicorn -w 4 log_server:app
+# Messages are JSON, one per line. Entries travel as LogEntry.record()
+# Worker to daemon, each answered with one line:
+#   {"op": "write", "clear": <bool>, "replica": <bool, see 'LogWriter.extend'>, "r": [<records>]}
+#       -> {"ids": [<id given to each entry, null if rejected>], "ts": [<their ts>], "s": <last message number>}
+#   {"op": "set", "name": <name>, "value": <value>}   -> {"s": <last message number>}
+#   {"op": "subscribe"}     -> The connection then only carries the daemon's messages:
+#       {"t": "hello", "epoch": <id of this daemon run>, "settings": {<name>: <value>}}
+#       {"t": "append", "r": [<records>]}   The store held at subscription time, then every commit, in store order
+#       {"t": "ready", "s": <number of the last message sent before subscribing>}    After the held entries
+#       {"t": "append", "r": [<records>], "s": <number>}
+#       {"t": "update", "r": [<records>], "s": <number>}    Entries folded into, as they are now
+#       {"t": "clear", "s": <number>}
+#       {"t": "set", "name": <name>, "value": <value>, "s": <number>}
+
+ROLE_DAEMON = "daemon"
+ROLE_WORKER = "worker"
+SHARED_ROLES = (ROLE_DAEMON, ROLE_WORKER)
+
+
+class SharedStoreUnavailable(ConnectionError):
+    pass
+
+
+def _encode(message):
+    return json.dumps(message, separators=(",", ":"), check_circular=False).encode("utf-8") + b"\n"
+
+
+class _DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class StoreDaemon:
+    def __init__(self, path, store, writer, decode, snapshot_chunk=1000, max_behind=10000):
+        self.path = path
+        self.store = store
+        self.writer = writer            # The one LogWriter of every worker
+        self.decode = decode            # decode(<record>) -> entry
+        self.snapshot_chunk = snapshot_chunk    # Entries per message when catching a worker up
+        self.max_behind = max_behind    # Messages a worker may fall behind by before it is dropped (then it resyncs)
+        self.epoch = uuid.uuid4().hex
+        self.settings = {}
+        self.seq = 0                    # Number of the last message sent
+        self._subscribers = []          # Queue of messages of each subscribed worker
+        self._lock = threading.Lock()   # Subscriptions and settings. Taken inside the store lock by the listener
+        self._server = None
+
+    def on_store_event(self, event, entries):   # Store listener. Encoded once for every subscriber
+        if event == EVENT_APPEND:
+            self._publish({"t": "append", "r": [entry.record() for entry in entries]})
+        elif event == EVENT_UPDATE:
+            # Once per entry, however many repeats were folded into it: workers count them from its 'repeats'
+            self._publish({"t": "update", "r": [entry.record() for entry in dict.fromkeys(entries)]})
+        elif event == EVENT_CLEAR:
+            self._publish({"t": "clear"})
+
+    def serve_forever(self):
+        if os.path.exists(self.path):  # Left behind by a previous run
+            os.remove(self.path)
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                daemon._handle(self.rfile, self.wfile)
+
+        self._server = _DaemonServer(self.path, Handler)
+        self.store.add_listener(self.on_store_event)
+        try:
+            self._server.serve_forever()
+        finally:
+            self.store.remove_listener(self.on_store_event)
+            self._server.server_close()
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+    def _handle(self, rfile, wfile):
+        for line in rfile:
+            request = json.loads(line)
+            op = request.get("op")
+            if op == "write":
+                reply = self._write(request["r"], request.get("clear", False), request.get("replica", False))
+            elif op == "set":
+                with self._lock:
+                    self.settings[request["name"]] = request["value"]
+                reply = {"s": self._publish({"t": "set", "name": request["name"], "value": request["value"]})}
+            elif op == "subscribe":
+                self._subscribe(wfile)
+                return
+            else:
+                reply = {"error": f"Unknown op '{op}'"}
+            wfile.write(_encode(reply))
+            wfile.flush()
+
+    def _write(self, records, clear, replica):
+        entries = [self.decode(record) for record in records]
+        if clear:
+            self.writer.clear(entries[0])
+        else:
+            self.writer.extend(entries, replica=replica)
+        # Committed and published by now, so the last message number covers it
+        return {"ids": [entry.msg_id for entry in entries], "ts": [entry.ts for entry in entries], "s": self.seq}
+
+    def _subscribe(self, wfile):
+        messages = queue.Queue()
+        with self._lock:    # Commits after this are queued. Those before it are in the store read below
+            self._subscribers.append(messages)
+            hello = _encode({"t": "hello", "epoch": self.epoch, "settings": self.settings})
+            ready = _encode({"t": "ready", "s": self.seq})
+            held = self.store.since(-1, self.store.capacity)
+        try:
+            wfile.write(hello)
+            for start in range(0, len(held), self.snapshot_chunk):
+                chunk = held[start:start + self.snapshot_chunk]
+                wfile.write(_encode({"t": "append", "r": [entry.record() for entry in chunk]}))
+            wfile.write(ready)
+            wfile.flush()
+            while True:
+                message = messages.get()
+                if message is None:
+                    return
+                wfile.write(message)
+                if messages.empty():
+                    wfile.flush()
+        except OSError:     # The worker went away
+            pass
+        finally:
+            with self._lock:
+                if messages in self._subscribers:
+                    self._subscribers.remove(messages)
+
+    def _publish(self, message):    # Returns its number
+        with self._lock:
+            self.seq += 1
+            message["s"] = self.seq
+            data = _encode(message)
+            for subscriber in list(self._subscribers):
+                self._send(subscriber, data)
+            return self.seq
+
+    def _send(self, subscriber, message):   # Lock held
+        if subscriber.qsize() >= self.max_behind:
+            self._subscribers.remove(subscriber)
+            subscriber.put(None)
+        else:
+            subscriber.put(message)
+
+
+class SharedLog:
+    # Worker side. Stands in for the LogWriter: the same append, extend and clear, committed by the daemon. The
+    # replica thread applies the daemon's messages to 'store', whose listeners then see the same changes as the
+    # daemon's store did
+    def __init__(self, path, store, decode, on_setting=None, timeout=10.0, pool_size=8):
+        self.path = path
+        self.store = store
+        self.decode = decode            # decode(<record>) -> entry
+        self.on_setting = on_setting    # on_setting(<name>, <value>), for every setting the daemon holds or gets
+        self.timeout = timeout          # Seconds to wait on the daemon, and on the replica to catch up with a write
+        self.applied = -1               # Id of the newest entry the replica holds
+        self.seq = 0                    # Number of the last daemon message applied
+        self.epoch = None
+        self.ready = threading.Event()  # Set once caught up with the daemon
+        self.pool_size = pool_size      # Most idle write connections kept
+        self._connections = collections.deque()
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._subscription = None
+        self._thread = None
+
+    @property
+    def next_id(self):
+        return self.applied + 1
+
+    def start(self):    # Waits up to 'timeout' to catch up. Keeps trying in the background past that
+        self._thread = threading.Thread(target=self._run, name="log-replica", daemon=True)
+        self._thread.start()
+        self.ready.wait(self.timeout)
+
+    def close(self):
+        self._stop.set()
+        if self._subscription is not None:
+            try:
+                self._subscription.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        while self._connections:
+            sock, rfile = self._connections.pop()
+            rfile.close()
+            sock.close()
+
+    def pending(self):  # Nothing is queued here, the daemon's writer does the queuing
+        return 0
+
+    def append(self, entry, wait=True):
+        return self.extend([entry], wait) == 1
+
+    def extend(self, entries, wait=True, replica=False):   # How many were accepted. Raises SharedStoreUnavailable
+        if not entries:
+            return 0
+        return self._write(entries, False, wait, replica)
+
+    def clear(self, entry, wait=True):
+        self._write([entry], True, wait)
+
+    def set(self, name, value):     # Shares a setting with every worker, this one included
+        self._wait(self._call({"op": "set", "name": name, "value": value})["s"])
+
+    def _write(self, entries, clear, wait, replica=False):
+        reply = self._call({"op": "write", "clear": clear, "replica": replica,
+                            "r": [entry.record() for entry in entries]})
+        for entry, msg_id, ts in zip(entries, reply["ids"], reply["ts"]):
+            entry.msg_id, entry.ts = msg_id, ts
+        accepted = sum(1 for msg_id in reply["ids"] if msg_id is not None)
+        if wait and accepted:
+            self._wait(reply["s"])
+        return accepted
+
+    def _wait(self, seq):   # Until the replica applied the daemon's message 'seq'
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.seq >= seq, self.timeout):
+                raise SharedStoreUnavailable(f"Replica didn't catch up with the log store in {self.timeout}s")
+
+    def _call(self, request):
+        try:
+            connection = self._connections.pop()
+        except IndexError:
+            connection = None
+        try:
+            if connection is None:
+                connection = self._connect()
+            connection[0].sendall(_encode(request))
+            line = connection[1].readline()
+            if not line:
+                raise OSError("The store daemon closed the connection")
+        except OSError as exc:
+            if connection is not None:
+                connection[0].close()
+            raise SharedStoreUnavailable(f"Log store daemon at '{self.path}' unavailable: {exc}") from exc
+        if len(self._connections) < self.pool_size:
+            self._connections.append(connection)
+        else:
+            connection[0].close()
+        return json.loads(line)
+
+    def _connect(self):     # tuple(<socket>, <its read file>)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        return sock, sock.makefile("rb")
+
+    def _run(self):
+        delay = 0.1
+        while not self._stop.is_set():
+            try:
+                sock, rfile = self._connect()
+            except OSError:
+                self._stop.wait(delay)
+                delay = min(delay * 2, 5.0)
+                continue
+            delay = 0.1
+            self._subscription = sock
+            try:
+                sock.settimeout(None)   # Quiet logs send nothing for long
+                sock.sendall(_encode({"op": "subscribe"}))
+                for line in rfile:
+                    self._apply(json.loads(line))
+            except OSError:
+                pass
+            except Exception:   # A broken listener mustn't stop the replica
+                traceback.print_exc()
+            finally:
+                self.ready.clear()
+                self._subscription = None
+                sock.close()
+            self._stop.wait(delay)
+
+    def _apply(self, message):
+        kind = message["t"]
+        if kind == "append":
+            entries = [self.decode(record) for record in message["r"]]
+            entries = [entry for entry in entries if entry.msg_id > self.applied]  # Both in the snapshot and queued
+            if entries:
+                self.store.extend(entries)
+                self.applied = entries[-1].msg_id
+        elif kind == "update":
+            # Records hold the whole count and the listeners expect an entry once per repeat folded into it, so a
+            # held entry is listed once per repeat it gains. One the snapshot already had the repeats of gains none
+            updated = []
+            for record in message["r"]:
+                entry = self.decode(record)
+                held = self.store.since(entry.msg_id - 1, 1)
+                if held and held[0].msg_id == entry.msg_id and entry.repeats > held[0].repeats:
+                    updated.extend([held[0]] * (entry.repeats - held[0].repeats))
+                    held[0].repeats, held[0].last_ts = entry.repeats, entry.last_ts
+            if updated:
+                self.store.update(updated)
+        elif kind == "clear":
+            self.store.clear()
+        elif kind == "set":
+            if self.on_setting is not None:
+                self.on_setting(message["name"], message["value"])
+        elif kind == "hello":
+            if self.epoch is not None:  # Subscribed again. Anything may have happened meanwhile, so start over
+                self.store.clear()
+                self.applied = -1
+            self.epoch = message["epoch"]
+            if self.on_setting is not None:
+                for name, value in message["settings"].items():
+                    self.on_setting(name, value)
+        if "s" in message:
+            with self._cond:
+                self.seq = message["s"]
+                self._cond.notify_all()
+            if kind == "ready":
+                self.ready.set()
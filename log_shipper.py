@@ -0,0 +1,202 @@
+import collections
+import gzip
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import traceback
+
+from log_store import EVENT_APPEND
+
+# Forwards every entry appended to the log to other log servers, through their '/log/batch', as gzip NDJSON. Each
+# downstream has its own outbox and sender thread, so a slow or dead one holds up nobody, ingestion least of all: the
+# store listener only queues the entries. An outbox is bounded; once full, newer entries are left in the store and
+# read back from it once the sender caught up. Batches are retried with backoff until acknowledged, and the id of
+# the last acknowledged entry of each downstream is where shipping resumes after an outage, or a restart when
+# 'state_path' is set (only useful along with LOG_DATA_DIR, since ids start over otherwise)
+# Delivery is at least once: a batch the downstream took but whose answer was lost is sent again. Entries evicted
+# before being shipped are skipped and counted. Repeats folded into an entry after it was shipped aren't forwarded
+# With 'replica_key', batches are sent as replicas ("X-Log-Replica"): a downstream with the same key keeps the time,
+# repeats and user shade of each entry. Any other downstream logs them as new entries, at the time they arrive
+
+
+class Downstream:
+    def __init__(self, url, acked=-1):
+        self.url = url
+        self.acked = acked          # Id of the newest entry the downstream took
+        self.outbox = collections.deque()   # Entries to ship, in id order
+        self.behind = False         # Outbox was full: what follows it is read from the store
+        self.queued = acked         # Id of the newest entry queued or acknowledged
+        self.shipped = 0            # Entries acknowledged
+        self.batches = 0
+        self.bytes = 0              # Compressed bytes acknowledged
+        self.skipped = 0            # Entries evicted before they were shipped
+        self.failures = 0           # Failed attempts in a row
+        self.last_error = None
+        self.oldest_ts = None       # 'ts' of the oldest entry not acknowledged yet
+        self.wake = threading.Event()
+
+
+class LogShipper:
+    def __init__(self, store, urls, encode, post, batch_size=500, max_outbox=10000, max_backoff=30.0,
+                 state_path=None, level=6, replica_key=None):
+        self.store = store
+        self.encode = encode            # encode(<entry>) -> the '/log/batch' item of an entry
+        self.post = post                # post(<url>, data=, headers=) -> response, like requests.post. Sets its timeouts
+        self.batch_size = batch_size    # Most entries sent at once
+        self.max_outbox = max_outbox    # Most entries queued per downstream
+        self.max_backoff = max_backoff  # Longest wait between retries, in seconds
+        self.state_path = state_path    # JSON file keeping the acknowledged ids
+        self.level = level              # Gzip level
+        self.headers = {"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"}
+        if replica_key:
+            self.headers["X-Log-Replica"] = replica_key
+        acked = self._load()
+        self.downstreams = [Downstream(url, acked.get(url, -1)) for url in urls]
+        self.newest = store.last().msg_id if len(store) else -1   # Id of the newest entry seen appended
+        self._lock = threading.Lock()   # Outboxes and 'newest'. Taken inside the store lock by the listener
+        self._stop = threading.Event()
+        self._saved = 0.0
+        self._save_lock = threading.Lock()
+        self._threads = []
+        for downstream in self.downstreams:     # Whatever is held past the acknowledged ids is read from the store
+            downstream.behind = downstream.acked < self.newest
+
+    def on_store_event(self, event, entries):   # Store listener. Only queues
+        if event != EVENT_APPEND or not entries:
+            return
+        with self._lock:
+            self.newest = entries[-1].msg_id
+            for downstream in self.downstreams:
+                if downstream.behind:
+                    continue
+                if len(downstream.outbox) + len(entries) > self.max_outbox:
+                    downstream.behind = True
+                else:
+                    if not downstream.outbox:
+                        downstream.oldest_ts = entries[0].ts
+                    downstream.outbox.extend(entries)
+                    downstream.queued = entries[-1].msg_id
+                downstream.wake.set()
+
+    def start(self):
+        for downstream in self.downstreams:
+            thread = threading.Thread(target=self._run, args=(downstream,), name="log-shipper", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self, timeout=5.0):   # Waits up to 'timeout' for the batches being sent
+        self._stop.set()
+        for downstream in self.downstreams:
+            downstream.wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._save(force=True)
+
+    def status(self):   # [{"url", "acked", "lag", ...}], what '/server/status' shows of each downstream
+        with self._lock:
+            newest = self.newest
+            return [{
+                "url": downstream.url,
+                "acked": downstream.acked,
+                "lag": max(newest - downstream.acked, 0),   # Entries not acknowledged yet
+                "lag_seconds": round(time.time() - downstream.oldest_ts, 3) if downstream.oldest_ts is not None else 0,
+                "queued": len(downstream.outbox),
+                "behind": downstream.behind,
+                "shipped": downstream.shipped,
+                "batches": downstream.batches,
+                "bytes": downstream.bytes,
+                "skipped": downstream.skipped,
+                "failures": downstream.failures,
+                "last_error": downstream.last_error
+            } for downstream in self.downstreams]
+
+    def _run(self, downstream):
+        delay = 0.5
+        while not self._stop.is_set():
+            try:
+                batch = self._next_batch(downstream)
+                if not batch:
+                    downstream.wake.wait(1.0)
+                    downstream.wake.clear()
+                    continue
+                self._send(downstream, batch)
+                delay = 0.5
+            except Exception as exc:    # Kept for the next attempt
+                downstream.failures += 1
+                downstream.last_error = str(exc) or type(exc).__name__
+                if not isinstance(exc, (OSError, ValueError)):     # Not just the downstream being unavailable
+                    traceback.print_exc()
+                self._stop.wait(delay * random.uniform(0.5, 1.0))
+                delay = min(delay * 2, self.max_backoff)
+
+    def _next_batch(self, downstream):  # Oldest entries not acknowledged yet, up to 'batch_size'
+        with self._lock:
+            if downstream.outbox or not downstream.behind:
+                return list(itertools.islice(downstream.outbox, self.batch_size))
+            queued = downstream.queued
+            newest = self.newest
+        # Behind, with the outbox drained: read on from the store, outside of the lock the listener takes
+        entries = self.store.since(queued, self.batch_size)
+        with self._lock:
+            if not entries:     # Everything up to 'newest' was appended before the read, so it was evicted or cleared
+                downstream.skipped += newest - queued
+                downstream.queued = newest
+            else:
+                downstream.skipped += max(entries[0].msg_id - queued - 1, 0)  # Ids are consecutive, gaps were evicted
+                downstream.outbox.extend(entries)
+                downstream.queued = entries[-1].msg_id
+                downstream.oldest_ts = entries[0].ts
+            if downstream.queued >= self.newest:    # Caught up: the listener queues from here on
+                downstream.behind = False
+            return list(downstream.outbox)
+
+    def _send(self, downstream, batch):
+        body = gzip.compress(b"\n".join(json.dumps(self.encode(entry), separators=(",", ":")).encode("utf-8")
+                                        for entry in batch), self.level)
+        response = self.post(downstream.url.rstrip("/") + "/log/batch", data=body, headers=self.headers)
+        if response.status_code >= 500 or response.status_code in (408, 429):
+            raise OSError(f"'{downstream.url}' answered {response.status_code}")
+        # Any other answer is final: a 4xx would be the same on every retry
+        with self._lock:
+            for _ in batch:
+                downstream.outbox.popleft()
+            downstream.acked = batch[-1].msg_id
+            downstream.oldest_ts = downstream.outbox[0].ts if downstream.outbox else None
+            downstream.shipped += len(batch)
+            downstream.batches += 1
+            downstream.bytes += len(body)
+            downstream.failures = 0
+            downstream.last_error = None if response.status_code < 400 else f"Answered {response.status_code}"
+        self._save()
+
+    def _load(self):    # url -> acknowledged id, as last saved
+        if self.state_path is None or not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            traceback.print_exc()
+            return {}
+
+    def _save(self, force=False):   # At most once a second, unless forced
+        if self.state_path is None:
+            return
+        with self._save_lock:   # Every sender saves
+            now = time.monotonic()
+            if not force and now - self._saved < 1.0:
+                return
+            self._saved = now
+            with self._lock:
+                acked = {downstream.url: downstream.acked for downstream in self.downstreams}
+            temp = self.state_path + ".tmp"
+            try:
+                with open(temp, "w") as file:
+                    json.dump(acked, file)
+                os.replace(temp, self.state_path)
+            except OSError:
+                traceback.print_exc()
@@ -0,0 +1,148 @@
+import collections
+import threading
+
+from log_store import EVENT_APPEND, EVENT_EVICT, EVENT_CLEAR, EVENT_UPDATE
+
+# Counts of the entries held, kept up to date by a store listener so '/log/stats' never reads the entries themselves.
+# Entries are counted per (severity flavor key, source) pair, in total and per time bucket of 'bucket_seconds'.
+# Entries get their 'ts' in id order, so appends only ever land in the newest bucket (or open a new one) and the
+# evictions, oldest first, only ever take from the oldest ones: buckets are a deque, added to on the right and
+# dropped from the left once empty. An entry counts once per repeat folded into it, in the bucket of its first one
+# With 'keep_evicted', evicted entries are still held, in the cold tier: they are only taken off once 'drop' is given
+# their tallies, when retention drops them from there (see 'ColdStore')
+
+
+class StatsBucket:
+    __slots__ = ("start", "total", "counts")
+
+    def __init__(self, start):
+        self.start = start
+        self.total = 0
+        self.counts = {}    # (severity key, source) -> entries
+
+
+class LogRollup:
+    def __init__(self, bucket_seconds=60, keep_evicted=False):
+        self.bucket_seconds = bucket_seconds
+        self.keep_evicted = keep_evicted
+        self._lock = threading.Lock()   # Writes come from the store listener, reads from request threads
+        self.reset()
+
+    def reset(self):
+        self.total = 0
+        self.counts = {}                        # (severity key, source) -> entries
+        self.buckets = collections.deque()      # StatsBucket, oldest first
+
+    def on_store_event(self, event, entries):   # Store listener
+        with self._lock:
+            if event == EVENT_APPEND:
+                for entry in entries:
+                    self._add(entry, entry.repeats)
+            elif event == EVENT_EVICT and not self.keep_evicted:
+                for entry in entries:
+                    self._add(entry, -entry.repeats)
+            elif event == EVENT_UPDATE:
+                for entry in entries:
+                    self._add(entry, 1, repeat=True)
+            elif event == EVENT_CLEAR:
+                self.reset()
+
+    def tally(self, entry):     # Key of an entry in the tallies given to 'drop'
+        return entry.ts - entry.ts % self.bucket_seconds, entry.severity_key, entry.log_from
+
+    def drop(self, tallies):    # Takes off entries no longer held. {tally(<entry>): <repeats>}, of the oldest entries
+        with self._lock:
+            for (start, severity, source), delta in tallies.items():
+                key = (severity, source)
+                self.total -= delta
+                _count(self.counts, key, -delta)
+                for bucket in self.buckets:     # Oldest first, so it is one of the first few
+                    if bucket.start >= start:
+                        if bucket.start == start:
+                            bucket.total -= delta
+                            _count(bucket.counts, key, -delta)
+                        break
+            while self.buckets and self.buckets[0].total == 0:
+                self.buckets.popleft()
+
+    def stats(self, severities=None, sources=None, start_ts=None, end_ts=None, bucket_seconds=None, limit=60):
+        # Counts of the held entries matching the filters, and of each of the newest 'limit' buckets of
+        # 'bucket_seconds' (a multiple of this rollup's) holding any. Time bounds are applied to whole buckets
+        width = bucket_seconds or self.bucket_seconds
+        if width <= 0 or width % self.bucket_seconds:
+            raise ValueError(f"Bucket width must be a multiple of {self.bucket_seconds} seconds, got {width}")
+        timed = start_ts is not None or end_ts is not None
+        with self._lock:
+            counts = dict(self.counts) if not timed else None
+            picked = []     # tuple(<start>, <counts>), newest first
+            starts = set()
+            for bucket in reversed(self.buckets):
+                if end_ts is not None and bucket.start >= end_ts:
+                    continue
+                if start_ts is not None and bucket.start + self.bucket_seconds <= start_ts:
+                    break
+                start = bucket.start - bucket.start % width
+                if start not in starts:
+                    if len(starts) == limit and not timed:
+                        break
+                    starts.add(start)
+                picked.append((start, dict(bucket.counts)))
+        if timed:   # Totals of the buckets inside the bounds, so every one of them is read
+            counts = {}
+            for start, bucket_counts in picked:
+                _merge(counts, bucket_counts)
+        merged = collections.OrderedDict()  # start -> counts, newest first
+        for start, bucket_counts in picked:
+            _merge(merged.setdefault(start, {}), bucket_counts)
+        out = _summary(counts, severities, sources)
+        out["bucket_seconds"] = width
+        out["buckets"] = [dict(start=start, **_summary(bucket_counts, severities, sources))
+                          for start, bucket_counts in list(merged.items())[:limit]]
+        out["buckets"].reverse()
+        return out
+
+    def _add(self, entry, delta, repeat=False):  # Lock held
+        key = (entry.severity_key, entry.log_from)
+        start = entry.ts - entry.ts % self.bucket_seconds
+        if repeat:  # Repeats are recent, so its bucket is near the newest end
+            bucket = next((bucket for bucket in reversed(self.buckets) if bucket.start <= start), None)
+            if bucket is None or bucket.start != start:     # No longer held, so the repeat isn't either
+                return
+        elif delta > 0:
+            if not self.buckets or self.buckets[-1].start < start:
+                self.buckets.append(StatsBucket(start))
+            bucket = self.buckets[-1]
+        else:
+            bucket = self.buckets[0]
+        self.total += delta
+        _count(self.counts, key, delta)
+        bucket.total += delta
+        _count(bucket.counts, key, delta)
+        if bucket.total == 0 and delta < 0:
+            self.buckets.popleft()
+
+
+def _count(counts, key, delta):
+    count = counts.get(key, 0) + delta
+    if count:
+        counts[key] = count
+    else:
+        del counts[key]
+
+
+def _merge(total, counts):
+    for key, count in counts.items():
+        total[key] = total.get(key, 0) + count
+
+
+def _summary(counts, severities, sources):  # {"total", "by_severity", "by_source"} of the matching pairs
+    by_severity = {}
+    by_source = {}
+    total = 0
+    for (severity, source), count in counts.items():
+        if (severities and severity not in severities) or (sources and source not in sources):
+            continue
+        total += count
+        by_severity[severity] = by_severity.get(severity, 0) + count
+        by_source[source] = by_source.get(source, 0) + count
+    return {"total": total, "by_severity": by_severity, "by_source": by_source}
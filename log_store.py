@@ -0,0 +1,161 @@
+import threading
+import time
+
+# Eviction policies, applied when the store is full and a new entry arrives
+EVICT_OLDEST = "oldest"     # Overwrite the oldest entry (ring buffer)
+EVICT_REJECT = "reject"     # Refuse the new entry until the store is cleared
+EVICTION_POLICIES = (EVICT_OLDEST, EVICT_REJECT)
+
+# Listeners are called as listener(<event>, <entries>) after each write, while the store is still locked, so they
+# see every change in the same order the store does. Keep them short and never call back into the store
+EVENT_APPEND = "append"     # 'entries' were added, oldest first
+EVENT_EVICT = "evict"       # 'entries' are being dropped to make room, oldest first. Sent while readers still see them
+EVENT_CLEAR = "clear"       # Everything was dropped. 'entries' is empty
+EVENT_UPDATE = "update"     # Held 'entries' were changed in place (a repeat folded in), listed once per change
+
+
+class LogStore:
+    # Fixed capacity ring buffer. Entries are kept oldest to newest, starting at the head. Every read is done by
+    # index, so a page costs O(per_page) regardless of how many entries are being held.
+    # Writes hold '_lock'. Reads don't: they work from '_state', tuple(<head>, <count>, <clears>, <evictions>), which
+    # is replaced in one go after every change, and read again if a write reused the slots they looked at
+    def __init__(self, capacity=100000, policy=EVICT_OLDEST):
+        if capacity <= 0:
+            raise ValueError(f"Log store capacity must be positive, got {capacity}")
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy '{policy}'. Use one of {EVICTION_POLICIES}")
+        self.capacity = capacity
+        self.policy = policy
+        self._ring = [None] * capacity
+        self._state = (0, 0, 0, 0)
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.updates = 0    # Changes in place so far. Unlike appends, they don't move the newest id
+        self.updated_ts = 0.0   # time.time() of the last one
+
+    def __len__(self):
+        return self._state[1]
+
+    def room(self):     # How many entries fit before the eviction policy kicks in
+        return self.capacity - self._state[1]
+
+    def add_listener(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            self._listeners.remove(listener)
+
+    def append(self, entry):    # Returns False if the entry was rejected by the eviction policy
+        return self.extend([entry]) == 1
+
+    def extend(self, entries):  # Appends all entries under a single lock. Returns how many were accepted
+        accepted = 0
+        with self._lock:
+            if self.policy == EVICT_REJECT and len(entries) > self.room():
+                entries = entries[:self.room()]
+            for start in range(0, len(entries), self.capacity):     # A batch never wraps over itself
+                chunk = entries[start:start + self.capacity] if len(entries) > self.capacity else entries
+                self._put(chunk)
+                accepted += len(chunk)
+        return accepted
+
+    def update(self, entries):  # Tells the listeners 'entries' were changed in place. Nothing moves
+        with self._lock:
+            self.updates += len(entries)
+            self.updated_ts = time.time()
+            self._notify(EVENT_UPDATE, entries)
+
+    def clear(self):
+        with self._lock:
+            head, count, clears, evictions = self._state
+            self._state = (0, 0, clears + 1, evictions)     # Readers stop looking at the old slots first
+            for i in range(count):  # Drop the references so the old entries can be collected
+                self._ring[(head + i) % self.capacity] = None
+            self._notify(EVENT_CLEAR, [])
+
+    def newest(self, offset=0, count=1):    # Up to 'count' entries, newest first, skipping the 'offset' newest
+        offset = max(offset, 0)
+
+        def read(head, held):
+            end = min(held, offset + count)
+            last = head + held - 1
+            return [self._ring[(last - i) % self.capacity] for i in range(offset, end)], held - end
+        return self._read(read)
+
+    def oldest(self, offset=0, count=1):    # Up to 'count' entries, oldest first, skipping the 'offset' oldest
+        offset = max(offset, 0)
+
+        def read(head, held):
+            end = min(held, offset + count)
+            return [self._ring[(head + i) % self.capacity] for i in range(offset, end)], offset
+        return self._read(read)
+
+    def since(self, msg_id, count):     # Up to 'count' entries with an id above 'msg_id', oldest first
+        def read(head, held):
+            start = self._bisect(head, held, msg_id, True)
+            end = min(held, start + count)
+            return [self._ring[(head + i) % self.capacity] for i in range(start, end)], 0
+        return self._read(read)
+
+    def before(self, msg_id, count):    # Up to 'count' entries with an id below 'msg_id', newest first
+        def read(head, held):
+            stop = self._bisect(head, held, msg_id, False)
+            return [self._ring[(head + i) % self.capacity] for i in range(stop - 1, max(stop - count, 0) - 1, -1)], 0
+        return self._read(read)
+
+    def first(self):    # Oldest entry, or None if empty
+        entries = self.oldest(0, 1)
+        return entries[0] if entries else None
+
+    def last(self):     # Newest entry, or None if empty
+        entries = self.newest(0, 1)
+        return entries[0] if entries else None
+
+    def _read(self, read):
+        # read(<head>, <count>) returns tuple(<result>, <lowest position it looked at, counting from the oldest>).
+        # The result stands if no clear happened meanwhile and no eviction reached that position
+        for attempt in range(3):
+            head, held, clears, evictions = self._state
+            try:
+                out, lowest = read(head, held)
+            except AttributeError:  # Looked at a slot that was being cleared
+                continue
+            now = self._state
+            if now[2] == clears and now[3] - evictions <= lowest:
+                return out
+        with self._lock:    # Writes keep getting in the way, wait for a gap
+            return read(self._state[0], self._state[1])[0]
+
+    def _bisect(self, head, held, msg_id, right):   # Entries are held in id order, so cursors resolve in O(log N)
+        lo = 0
+        hi = held
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_id = self._ring[(head + mid) % self.capacity].msg_id
+            if mid_id < msg_id or (right and mid_id == msg_id):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _notify(self, event, entries):
+        for listener in self._listeners:
+            listener(event, entries)
+
+    def _put(self, chunk):  # 'chunk' holds at most 'capacity' entries
+        head, count, clears, evictions = self._state
+        dropping = max(count + len(chunk) - self.capacity, 0)
+        evicted = []
+        if dropping:    # Full. Readers are moved past the oldest entries before their slots are reused
+            evicted = [self._ring[(head + i) % self.capacity] for i in range(dropping)]
+            self._notify(EVENT_EVICT, evicted)  # First, so a listener keeping them has them before they leave
+            head = (head + dropping) % self.capacity
+            count -= dropping
+            evictions += dropping
+            self._state = (head, count, clears, evictions)
+        for i, entry in enumerate(chunk):
+            self._ring[(head + count + i) % self.capacity] = entry
+        self._state = (head, count + len(chunk), clears, evictions)
+        self._notify(EVENT_APPEND, chunk)
@@ -0,0 +1,68 @@
+import json
+import threading
+
+from log_store import EVENT_APPEND, EVENT_CLEAR
+
+# Server-Sent Events fan out. The store wakes every subscriber at once through a single condition, and each one
+# then reads what it missed straight from the store. Nothing is queued per subscriber, so an idle dashboard is
+# just a thread parked on the condition. With 'hint', the entries themselves aren't sent: each batch read is one
+# event with the newest id and how many entries there were, for clients fetching what they show on their own
+
+
+class LogBroadcaster:
+    def __init__(self, max_subscribers=50):
+        self.max_subscribers = max_subscribers
+        self.last_id = -1           # Newest id appended so far
+        self.generation = 0         # Bumped on every clear, so subscribers know to drop their rows
+        self.subscribers = 0
+        self._cond = threading.Condition()
+
+    def on_store_event(self, event, entries):   # Store listener
+        with self._cond:
+            if event == EVENT_APPEND:
+                self.last_id = entries[-1].msg_id
+            elif event == EVENT_CLEAR:
+                self.generation += 1
+            else:
+                return
+            self._cond.notify_all()
+
+    def subscribe(self):    # Returns False if there are too many subscribers already
+        with self._cond:
+            if self.subscribers >= self.max_subscribers:
+                return False
+            self.subscribers += 1
+            return True
+
+    def unsubscribe(self):
+        with self._cond:
+            self.subscribers -= 1
+
+    def wait(self, last_id, generation, timeout):   # True if there is something new, False on timeout
+        with self._cond:
+            return self._cond.wait_for(lambda: self.last_id > last_id or self.generation != generation, timeout)
+
+
+def event_stream(store, broadcaster, last_id, heartbeat=15, batch=500, to_json=None, hint=False):
+    # Generator for a text/event-stream response. The caller is responsible for subscribing and unsubscribing
+    if to_json is None:
+        to_json = _entry_json
+    generation = broadcaster.generation
+    yield "retry: 3000\n\n"
+    while True:
+        if broadcaster.generation != generation:
+            generation = broadcaster.generation
+            yield "event: clear\ndata: {}\n\n"
+        entries = store.since(last_id, batch)
+        if entries:
+            last_id = entries[-1].msg_id
+            if hint:
+                yield f"id: {last_id}\ndata: {json.dumps({'id': last_id, 'count': len(entries)})}\n\n"
+                continue
+            yield "".join(f"id: {entry.msg_id}\ndata: {json.dumps(to_json(entry))}\n\n" for entry in entries)
+        elif not broadcaster.wait(last_id, generation, heartbeat):
+            yield ": keep-alive\n\n"    # Also how a closed connection is noticed
+
+
+def _entry_json(entry):
+    return entry.json()
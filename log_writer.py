@@ -0,0 +1,190 @@
+import collections
+import json
+import queue
+import threading
+import time
+import traceback
+
+from log_store import EVICT_REJECT
+
+# Single writer in front of the store. Request threads and service threads only queue their entries; the writer
+# thread gives them their id and time and commits everything it finds queued with one store write. Ids are then
+# unique and in store order with no lock around the producers, and a clear can't land in the middle of a batch
+# With 'coalesce' set, an entry equal to a recent one (same source, severity, comment and body) isn't stored again:
+# it is folded into that one, which counts the repeat and the time of the last one. 0 only folds into the newest
+# entry, so runs of the same entry become one; a number of seconds folds into any entry repeated within that window.
+# Producers get the id of the entry theirs was folded into
+# Replicas, entries another log server already committed (see 'log_shipper.py'), keep their time and repeats: they
+# are never folded, and only get a later time than their own if it would go back past the newest committed one
+
+
+class _Job:
+    __slots__ = ("entries", "clear", "replica", "accepted", "done")
+
+    def __init__(self, entries, clear, wait, replica=False):
+        self.entries = entries
+        self.clear = clear          # Clear the store before appending 'entries'
+        self.replica = replica      # 'entries' are replicas
+        self.accepted = 0
+        self.done = threading.Event() if wait else None
+
+
+class LogWriter:
+    def __init__(self, store, queue_size=10000, batch_size=5000, next_id=0, coalesce=None):
+        self.store = store
+        self.next_id = next_id          # Id of the next committed entry
+        self.batch_size = batch_size    # Most entries committed with one store write
+        self.coalesce = coalesce        # None never folds repeats. Seconds they are folded within, 0 for runs only
+        self.commits = 0                # Store writes so far
+        self.folded = 0                 # Entries folded into another so far
+        self._recent = collections.OrderedDict()    # Coalescing key -> entry, least recently repeated first
+        self._queue = queue.Queue(queue_size)   # Producers wait here when the writer falls behind
+        self._last_ts = 0.0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def close(self):    # Commits whatever is queued and stops the writer
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def append(self, entry, wait=True):     # False if the store rejected it. Always True when not waiting
+        return self.extend([entry], wait) == 1
+
+    def extend(self, entries, wait=True, replica=False):
+        # How many were accepted. When not waiting, how many were queued. 'replica': 'entries' are replicas
+        job = _Job(entries, False, wait, replica)
+        self._queue.put(job)
+        if not wait:
+            return len(entries)
+        job.done.wait()
+        return job.accepted
+
+    def clear(self, entry, wait=True):  # Empties the store and logs 'entry' as the first new one
+        job = _Job([entry], True, wait)
+        self._queue.put(job)
+        if wait:
+            job.done.wait()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            jobs = [job]
+            size = len(job.entries)
+            closing = False
+            while size < self.batch_size:   # Group everything already waiting into the same commit
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    closing = True
+                    break
+                jobs.append(job)
+                size += len(job.entries)
+            try:
+                self._commit(jobs)
+            except Exception:   # A broken listener must not leave the producers waiting forever
+                traceback.print_exc()
+            finally:
+                for job in jobs:
+                    if job.done is not None:
+                        job.done.set()
+            if closing:
+                return
+
+    def _commit(self, jobs):
+        batch = []
+        owners = []
+        replicas = set()
+        for job in jobs:
+            if job.clear:
+                self._flush(batch, owners, replicas)
+                batch = []
+                owners = []
+                self.store.clear()
+                self._recent.clear()
+            batch.extend(job.entries)
+            owners.append(job)
+            if job.replica:
+                replicas.update(job.entries)
+        self._flush(batch, owners, replicas)
+
+    def _flush(self, batch, jobs, replicas):
+        if not batch:
+            return
+        now = max(time.time(), self._last_ts)   # Never goes back, so id order is also time order
+        folds = []      # tuple(<entry>, <entry it was folded into>)
+        updated = []    # Held entries folded into, once per fold
+        if self.coalesce is not None:
+            batch = self._fold(batch, now, folds, updated, replicas)
+        if self.store.policy == EVICT_REJECT:
+            for entry in batch[self.store.room():]:     # Turned away, so left without an id
+                entry.msg_id = None
+            batch = batch[:self.store.room()]
+        last_ts = self._last_ts
+        for entry in batch:
+            entry.msg_id = self.next_id
+            if entry in replicas:
+                entry.ts = max(entry.ts, last_ts)
+                entry.last_ts = max(entry.last_ts, entry.ts)
+            else:
+                entry.ts = entry.last_ts = max(now, last_ts)
+            last_ts = entry.ts
+            self.next_id += 1
+        self._last_ts = last_ts
+        for entry, target in folds:
+            entry.msg_id, entry.ts = target.msg_id, target.ts
+        self.store.extend(batch)
+        if updated:
+            self.store.update(updated)
+        self.commits += 1
+        for job in jobs:    # Folded entries count as accepted as long as the one they went into was
+            job.accepted = sum(1 for entry in job.entries if entry.msg_id is not None)
+
+    def _fold(self, batch, now, folds, updated, replicas):  # The entries of 'batch' left to store
+        kept = []
+        fresh = set()   # Entries of this batch, stored along with it
+        # Older entries than 'held_from' were evicted or rejected, or are evicted by this very commit (at most the
+        # whole batch is stored), which would take the repeats folded into them along
+        evicted = max(len(self.store) + len(batch) - self.store.capacity, 0) if self.store.policy != EVICT_REJECT else 0
+        oldest = self.store.oldest(evicted)
+        held_from = oldest[0].msg_id if oldest else self.next_id
+        while self._recent:     # Past the window. Least recently repeated first, so the rest are inside it
+            entry = next(iter(self._recent.values()))
+            if self.coalesce == 0 or now - entry.last_ts <= self.coalesce:
+                break
+            self._recent.popitem(last=False)
+        for entry in batch:
+            if entry in replicas:   # Folded, if at all, where they were first committed
+                entry.msg_id = None
+                kept.append(entry)
+                continue
+            key = (entry.log_from, entry.severity, entry.comment,
+                   json.dumps(entry.body, sort_keys=True, separators=(",", ":"), default=str))
+            target = self._recent.get(key)
+            if target is not None and (target in fresh or (target.msg_id is not None and target.msg_id >= held_from)):
+                target.repeats += 1
+                target.last_ts = now
+                folds.append((entry, target))
+                if target not in fresh:     # Already stored. Those of this batch are stored with the count
+                    updated.append(target)
+                self._recent.move_to_end(key)
+                self.folded += 1
+                continue
+            entry.msg_id = None
+            kept.append(entry)
+            fresh.add(entry)
+            if self.coalesce == 0:  # Runs only: the newest entry is the only one to fold into
+                self._recent.clear()
+            self._recent[key] = entry
+        return kept
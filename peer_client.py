@@ -0,0 +1,127 @@
+import concurrent.futures
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Outbound HTTP to the peer servers. One keep-alive session is shared by every service, so repeated calls to the same
+# peer reuse its connection, and the fan-outs run on a bounded pool instead of a new thread per peer. Every call has
+# connect and read timeouts, and a service run carries a Deadline that also caps them, so a hung peer can only hold
+# the run up until the deadline
+# Each call is reported to 'on_call(<url>, <seconds, None if never sent>, <error, None if it went fine>)', errors
+# being 'deadline', 'timeout', 'connection' or 'server_error' (a 5xx answer)
+# Services that need a single peer to answer hedge: the next peer is asked once the ones asked so far have all failed,
+# or 'hedge_delay' seconds went by without an answer, and the first conclusive answer ends it. So a run takes about as
+# long as the fastest healthy peer instead of the sum of the dead ones' timeouts
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.end = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(self.end - time.monotonic(), 0.0)
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+class PeerClient:
+    def __init__(self, workers=8, connect_timeout=3.0, read_timeout=5.0, deadline=20.0, pool_size=16,
+                 on_call=None, hedge_delay=0.25):
+        self.connect_timeout = connect_timeout  # Seconds to open a connection
+        self.read_timeout = read_timeout        # Seconds to wait on a silent peer
+        self.deadline = deadline                # Default length of a service run
+        self.hedge_delay = hedge_delay          # Seconds a hedged call waits on the peers asked before asking another
+        self.on_call = on_call
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="peer")
+
+    def new_deadline(self, seconds=None):
+        return Deadline(self.deadline if seconds is None else seconds)
+
+    def get(self, url, deadline=None, **kwargs):
+        return self.request("GET", url, deadline, **kwargs)
+
+    def post(self, url, deadline=None, **kwargs):
+        return self.request("POST", url, deadline, **kwargs)
+
+    def request(self, method, url, deadline=None, **kwargs):    # Raises requests.Timeout once 'deadline' is over
+        connect, read = self.connect_timeout, self.read_timeout
+        if deadline is not None:
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                self._report(url, None, "deadline")
+                raise requests.Timeout(f"Service deadline reached before calling '{url}'")
+            connect, read = min(connect, remaining), min(read, remaining)
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, timeout=(connect, read), **kwargs)
+        except requests.Timeout:
+            self._report(url, time.perf_counter() - start, "timeout")
+            raise
+        except requests.RequestException:
+            self._report(url, time.perf_counter() - start, "connection")
+            raise
+        self._report(url, time.perf_counter() - start, "server_error" if response.status_code >= 500 else None)
+        return response
+
+    def fan_out(self, call, items, deadline):
+        # [call(item, deadline) for each item], run on the pool. None for the calls that didn't finish before the
+        # deadline or raised. Late calls are left to their own timeouts and their results are dropped
+        futures = [self._pool.submit(call, item, deadline) for item in items]
+        concurrent.futures.wait(futures, timeout=deadline.remaining())
+        results = []
+        for future in futures:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                results.append(future.result())
+            else:
+                future.cancel()     # Never started, so it never calls out
+                results.append(None)
+        return results
+
+    def hedge(self, call, items, deadline, done, delay=None):
+        # call(item, deadline) for one item after the other, on the pool, until one returns a result 'done(result)' is
+        # true for. The next item is started as soon as every running call finished without one, or after 'delay'
+        # seconds. Returns tuple(<[tuple(<item>, <result>)] of the calls that finished, in the order they did>,
+        # <whether the last one is done>). Calls still running then are left to their own timeouts and their results
+        # dropped, those raising are dropped too
+        delay = self.hedge_delay if delay is None else delay
+        items = list(items)
+        running = {}    # Future -> item
+        finished = []
+        started = 0
+        try:
+            while True:
+                if started < len(items) and not deadline.expired():
+                    running[self._pool.submit(call, items[started], deadline)] = items[started]
+                    started += 1
+                if not running:
+                    return finished, False
+                timeout = deadline.remaining()
+                if started < len(items):
+                    timeout = min(timeout, delay)
+                ready, _ = concurrent.futures.wait(running, timeout, concurrent.futures.FIRST_COMPLETED)
+                if not ready and deadline.expired():
+                    return finished, False
+                for future in ready:
+                    item = running.pop(future)
+                    if future.exception() is None:
+                        finished.append((item, future.result()))
+                        if done(future.result()):
+                            return finished, True
+        finally:
+            for future in running:
+                future.cancel()     # Never started, so it never calls out
+
+    def _report(self, url, seconds, error):
+        if self.on_call is not None:
+            self.on_call(url, seconds, error)
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        self.session.close()
@@ -0,0 +1,136 @@
+import collections
+import threading
+import time
+import traceback
+
+# Last '/info' answer of every peer a service asked about, so a service run can start from it instead of calling every
+# peer again. Answers older than 'ttl' are fetched again when asked for, and a background thread refreshes every
+# tracked peer each 'refresh_interval' seconds so they are rarely that old. Each fetch also goes into the peer's
+# latency and failure history
+# Results are tuple(<error_code>, <url>, <json>), see 'server_request_info'
+
+
+class PeerState:
+    __slots__ = ("url", "result", "checked", "probes", "failures", "streak", "history")
+
+    def __init__(self, url, history):
+        self.url = url
+        self.result = None                  # Last answer, None until the first fetch ends
+        self.checked = float("-inf")        # time.monotonic() of that answer
+        self.probes = 0
+        self.failures = 0
+        self.streak = 0                     # Failures in a row
+        self.history = collections.deque(maxlen=history)    # tuple(<time.time()>, <error code>, <latency ms>)
+
+    def json(self, now):
+        latencies = [latency for when, code, latency in self.history if code == 0]
+        return {
+            "url": self.url,
+            "code": self.result[0] if self.result is not None else None,
+            "info": self.result[2] if self.result is not None else None,
+            "age_s": round(now - self.checked, 3) if self.result is not None else None,
+            "probes": self.probes,
+            "failures": self.failures,
+            "failure_streak": self.streak,
+            "avg_latency_ms": round(sum(latencies) / len(latencies), 1) if latencies else None,
+            "history": [[round(when, 3), code, latency] for when, code, latency in self.history]
+        }
+
+
+class PeerRegistry:
+    def __init__(self, client, probe, ttl=30.0, refresh_interval=15.0, history=20):
+        self.client = client    # PeerClient the fetches run on
+        self.probe = probe      # probe(url, deadline) -> result
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval    # 0 turns the background refresh off
+        self.history = history
+        self._peers = {}        # url -> PeerState
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.refresh_interval > 0:
+            self._thread = threading.Thread(target=self._run, name="peer-refresh", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def results(self, urls, fresh=False, deadline=None):
+        # A result per url, in order. Cached ones younger than 'ttl' are reused unless 'fresh'. The others are fetched
+        # together, and those that don't answer before 'deadline' come back as timed out (3)
+        deadline = deadline or self.client.new_deadline()
+        now = time.monotonic()
+        with self._lock:
+            stale = []
+            for url in urls:
+                state = self._state(url)
+                if fresh or state.result is None or now - state.checked > self.ttl:
+                    stale.append(url)
+        fetched = dict(zip(stale, self.client.fan_out(self._fetch, stale, deadline))) if stale else {}
+        out = []
+        with self._lock:
+            for url in urls:
+                if url in fetched:
+                    out.append(fetched[url] if fetched[url] is not None else (3, url, None))
+                else:
+                    out.append(self._peers[url].result)
+        return out
+
+    def put(self, result, latency_ms=None):     # Answer fetched by someone else, like a service checking its change
+        with self._lock:
+            self._record(result, latency_ms)
+
+    def invalidate(self, urls):     # Their next lookup fetches again, e.g. after an election changed the leader
+        with self._lock:
+            for url in urls:
+                if url in self._peers:
+                    self._peers[url].checked = float("-inf")
+
+    def refresh(self):
+        with self._lock:
+            urls = list(self._peers)
+        if urls:
+            self.client.fan_out(self._fetch, urls, self.client.new_deadline())
+
+    def status(self):
+        now = time.monotonic()
+        with self._lock:
+            return [state.json(now) for state in self._peers.values()]
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception:   # Try again next round
+                traceback.print_exc()
+
+    def _fetch(self, url, deadline):
+        start = time.perf_counter()
+        result = self.probe(url, deadline)
+        latency_ms = round((time.perf_counter() - start) * 1000, 1)
+        with self._lock:
+            self._record(result, latency_ms)
+        return result
+
+    def _record(self, result, latency_ms):
+        state = self._state(result[1])
+        state.result = result
+        state.checked = time.monotonic()
+        state.probes += 1
+        if result[0] == 0:
+            state.streak = 0
+        else:
+            state.failures += 1
+            state.streak += 1
+        state.history.append((time.time(), result[0], latency_ms))
+
+    def _state(self, url):  # Starts tracking 'url' if new. Lock held
+        state = self._peers.get(url)
+        if state is None:
+            state = self._peers[url] = PeerState(url, self.history)
+        return state
@@ -0,0 +1,86 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+# Token buckets kept per key (a client address, a service name...). A bucket holds up to 'burst' tokens and gains
+# 'rate' of them per second; each allowed call takes one. No threads are involved: a bucket is topped up from the time
+# that passed whenever it is looked at. Buckets idle long enough to be full again carry no state, so they are dropped,
+# oldest first, which keeps memory at one small entry per recently seen key
+
+
+class RateLimiter:
+    def __init__(self, rate, burst=1, max_keys=10000):
+        if rate <= 0 or burst < 1:
+            raise ValueError("The rate must be positive and the burst at least 1")
+        self.rate = rate            # Tokens gained per second
+        self.burst = burst          # Most tokens a bucket holds
+        self.max_keys = max_keys    # Past this, the least recently used buckets are dropped even if not full
+        self.limited = 0            # Calls refused so far
+        self._buckets = OrderedDict()   # key -> [<tokens>, <time.monotonic() of the last update>], least recent first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def acquire(self, keys, now=None):
+        # Takes a token from the bucket of every key, or from none of them if any is empty
+        # Returns 0 if allowed, else the seconds until every bucket has a token again
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._expire(now)
+            buckets = [self._bucket(key, now) for key in keys]
+            wait = max([(1 - tokens) / self.rate for tokens, last in buckets if tokens < 1] or [0])
+            if wait > 0:
+                self.limited += 1
+                return wait
+            for bucket in buckets:
+                bucket[0] -= 1
+            return 0
+
+    def release(self, keys, now=None):  # Gives back the tokens an 'acquire' of 'keys' took
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for key in keys:
+                bucket = self._bucket(key, now)
+                bucket[0] = min(self.burst, bucket[0] + 1)
+
+    def retry_after(self, key, now=None):   # Seconds until 'key' has a token, 0 if it has one now
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return 0
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            return max((1 - tokens) / self.rate, 0)
+
+    def status(self, now=None):     # Limits, plus the keys that are out of tokens and how long they have to wait
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._expire(now)
+            keys = list(self._buckets)
+        waiting = {}
+        for key in keys:
+            wait = self.retry_after(key, now)
+            if wait > 0:
+                waiting[str(key)] = math.ceil(wait)     # Whole seconds, so the status only changes once a second
+        return {"rate": self.rate, "burst": self.burst, "tracked": len(keys), "limited": self.limited,
+                "waiting": waiting}
+
+    def _bucket(self, key, now):    # Topped up to 'now'. Lock held
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _expire(self, now):     # Drops buckets that are full again. They are the least recently used ones
+        full_after = self.burst / self.rate
+        while self._buckets:
+            key, (tokens, last) = next(iter(self._buckets.items()))
+            if now - last < full_after and len(self._buckets) < self.max_keys:
+                break
+            del self._buckets[key]
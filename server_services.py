@@ -1,74 +1,132 @@
+import os
 import random
 import string
-import threading
 import requests
+from urllib.parse import urlsplit
 
-# Calls target and returns data in the format tuple(<error_code>, <json>)
-# Error codes: 0- No errors | 1- Connection Error | 2- Empty response
+from log_metrics import Counter, Histogram, PEER_BUCKETS
+from peer_client import PeerClient
+from peer_registry import PeerRegistry
 
+# Every call to another server goes through 'peer_client'. A service run gets one deadline (see 'handle_demanding')
+# and each function below takes it, so the whole run ends within it even if some peers hang
+peer_latency = Histogram("logserver_peer_request_seconds", "Outbound calls to the peers by peer", ("peer",),
+                         PEER_BUCKETS)
+peer_errors = Counter("logserver_peer_errors_total", "Outbound calls to the peers that failed, by peer and error",
+                      ("peer", "error"))
 
-def server_request_info(target, data):
+
+def record_peer_call(url, seconds, error):  # PeerClient 'on_call'
+    parts = urlsplit(url)
+    peer = f"{parts.scheme}://{parts.netloc}"
+    if seconds is not None:
+        peer_latency.observe(seconds, peer)
+    if error is not None:
+        peer_errors.inc(peer, error)
+
+
+peer_client = PeerClient(workers=int(os.environ.get("PEER_WORKERS", 8)),
+                         connect_timeout=float(os.environ.get("PEER_CONNECT_TIMEOUT", 3)),
+                         read_timeout=float(os.environ.get("PEER_READ_TIMEOUT", 5)),
+                         deadline=float(os.environ.get("SERVICE_DEADLINE", 20)),
+                         on_call=record_peer_call,
+                         hedge_delay=float(os.environ.get("PEER_HEDGE_DELAY", 0.25)))
+
+# Calls target and returns data in the format tuple(<error_code>, <target>, <json>)
+# Error codes: 0- No errors | 1- Connection Error | 2- Empty response | 3- Timed out
+
+
+def server_request_info(target, deadline=None):
     endpoint = '/info'
     try:
-        t_data = requests.get(target + endpoint).json()
+        t_data = peer_client.get(target + endpoint, deadline).json()
         if t_data is None or t_data == {}:
-            data.append((2, target, t_data))
-        else:
-            data.append((0, target, t_data))
+            return 2, target, t_data
+        return 0, target, t_data
+    except requests.Timeout:
+        return 3, target, None
     except requests.ConnectionError:
-        data.append((1, target, None))
+        return 1, target, None
+    except ValueError:  # Not JSON
+        return 2, target, None
+
+
+# Cached '/info' of the peers, refreshed in the background. See 'peer_registry.py'
+peer_registry = PeerRegistry(peer_client, server_request_info,
+                             ttl=float(os.environ.get("PEER_INFO_TTL", 30)),
+                             refresh_interval=float(os.environ.get("PEER_REFRESH", 15)))
 
 
-def ask_resource(servers):
-    endpoint = "/recurso"
+def ask_resource(servers, deadline=None):
+    # Servers are asked hedged, see 'PeerClient.hedge'. The entries of each one asked are logged in the order they
+    # answered, those still unanswered when another one concluded are dropped
+    deadline = deadline or peer_client.new_deadline()
     random.shuffle(servers)
-    entries = []
-    for server in servers:
-        entries.append(("Information", f"Making '{server}' ask for resource...", None))
-        try:
-            response = requests.post(server + endpoint)
-            if response.status_code == 200:
-                entries.append(("Success", f"'{server}' was able to ask for resource", None))
-                return entries
-            elif response.status_code == 409:
-                entries.append(("Attention", f"'{server}' is busy. Unable to assert consent from all servers", None))
-                return entries
-            else:
-                entries.append(("Attention", f"'{server}' responded with the untreated code of [{response.status_code}]. Unable to assert consent from all servers", None))
-        except requests.ConnectionError:
-            entries.append(("Attention", f"'{server}' couldn't be reached. Attempting another server...", None))
-        except Exception as exc:
-            entries.append(("Critical", f"'Uncaught exception: '{str(exc)}'", None))
-            return entries
-    entries.append(("Error", f"No server could be reached", None))
+    finished, concluded = peer_client.hedge(server_ask_resource, servers, deadline, lambda result: result[0])
+    entries = [entry for server, (done, server_entries) in finished for entry in server_entries]
+    if concluded:
+        return entries
+    if deadline.expired():
+        entries.append(("Attention", f"Service deadline of {deadline.seconds}s reached. No more servers asked", None))
+    else:
+        entries.append(("Error", f"No server could be reached", None))
     return entries
 
 
-def server_find_leader(target, leader_data, entries):
-    endpoint = '/info'
+def server_ask_resource(server, deadline):  # Returns tuple(<whether it concluded>, <log entries>)
+    entries = [("Information", f"Making '{server}' ask for resource...", None)]
     try:
-        status = requests.get(target + endpoint).json()
+        response = peer_client.post(server + "/recurso", deadline)
+        if response.status_code == 200:
+            entries.append(("Success", f"'{server}' was able to ask for resource", None))
+            return True, entries
+        elif response.status_code == 409:
+            entries.append(("Attention", f"'{server}' is busy. Unable to assert consent from all servers", None))
+            return True, entries
+        else:
+            entries.append(("Attention", f"'{server}' responded with the untreated code of [{response.status_code}]. Unable to assert consent from all servers", None))
+    except requests.Timeout:
+        entries.append(("Attention", f"'{server}' timed out. Attempting another server...", None))
+    except requests.ConnectionError:
+        entries.append(("Attention", f"'{server}' couldn't be reached. Attempting another server...", None))
+    except Exception as exc:
+        entries.append(("Critical", f"'Uncaught exception: '{str(exc)}'", None))
+        return True, entries
+    return False, entries
+
+
+def server_find_leader(result):     # Reads a '/info' result. Returns tuple(<is leader>, <log entries>)
+    code, target, status = result
+    entries = []
+    if code == 0:
         try:
-            if int(status['lider']) == 1:
-                leader_data.append(target)
+            return int(status['lider']) == 1, entries
         except KeyError:
             entries.append(("Error", f"'{target}' didn't returned valid info", status))
         except Exception as exc:
             entries.append(("Critical", f"'Uncaught exception: '{str(exc)}'", None))
-    except requests.ConnectionError:
+    elif code == 1:
         entries.append(("Attention", f"'{target}' couldn't be reached", None))
+    elif code == 3:
+        entries.append(("Attention", f"'{target}' timed out", None))
+    else:
+        entries.append(("Error", f"'{target}' didn't returned valid info", status))
+    return False, entries
 
 
-def server_set_election(target, election, entries):
+def server_set_election(target, election, deadline=None):     # Returns the log entries
     endpoint = '/info'
+    entries = []
     js = {
         "eleicao": election
     }
     try:
-        response = requests.post(target + endpoint, json=js)
+        response = peer_client.post(target + endpoint, deadline, json=js)
         if response.status_code != 200:
             entries.append(("Warning", f"'{target}' didn't responded correctly to the change request", js))
-        status = requests.get(target + endpoint).json()
+        status = peer_client.get(target + endpoint, deadline).json()
+        if isinstance(status, dict) and status:
+            peer_registry.put((0, target, status))  # Keeps the cache in step with the change
         try:
             if status['eleicao'] == election:
                 entries.append(("Success", f"'{target}' successfully changed to '{election}'", status))
@@ -78,18 +136,17 @@ def server_set_election(target, election, entries):
             entries.append(("Error", f"'{target}' didn't returned valid info", status))
         except Exception as exc:
             entries.append(("Critical", f"'Uncaught exception: '{str(exc)}'", js))
+    except requests.Timeout:
+        entries.append(("Attention", f"'{target}' timed out", None))
     except requests.ConnectionError:
         entries.append(("Attention", f"'{target}' couldn't be reached", None))
+    except ValueError:
+        entries.append(("Error", f"'{target}' didn't returned valid info", None))
+    return entries
 
 
-def pull_info(urls):
-    server_data = []
-    thrs = []
-    for url in urls:
-        thrs.append(threading.Thread(target=server_request_info, args=(url, server_data)))
-        thrs[-1].start()
-    for t in thrs:
-        t.join()
+def pull_info(urls, deadline=None, fresh=False):    # Uses the cached info unless 'fresh'
+    server_data = peer_registry.results(urls, fresh, deadline)
     pi_data = []
     valid_list = []         # Holds the URLs of valid servers and it's election type
     invalid_list = []       # Holds all invalid servers
@@ -112,6 +169,9 @@ def pull_info(urls):
             elif svr[0] == 2:
                 pi_info["message"] = f"'{svr[1]}' didn't responded"
                 invalid_list.append(pi_info)
+            elif svr[0] == 3:
+                pi_info["message"] = f"'{svr[1]}' timed out"
+                invalid_list.append(pi_info)
             elif svr[0] == 0:
                 pi_info["invalid"] = 0
                 pi_info["is_down"] = svr[2]["status"]
@@ -159,26 +219,26 @@ def pull_info(urls):
     return pi_data, valid_list, invalid_list
 
 
-def set_all_elections(urls, election_type):     # Returns a log entry for each server
+def set_all_elections(urls, election_type, deadline=None):     # Returns a log entry for each server
+    deadline = deadline or peer_client.new_deadline()
+    targets = [server[0] for server in urls]
+    results = peer_client.fan_out(lambda target, dl: server_set_election(target, election_type, dl), targets, deadline)
     entries = []
-    thrs = []
-    for server in urls:
-        thrs.append(threading.Thread(target=server_set_election, args=(server[0], election_type, entries)))
-        thrs[-1].start()
-    for t in thrs:
-        t.join()
+    for target, result in zip(targets, results):
+        if result is None:
+            result = [("Attention", f"'{target}' didn't finish within the service deadline", None)]
+        entries.extend(result)
     return entries
 
 
-def find_leader(urls):
+def find_leader(urls, deadline=None, fresh=False):  # Uses the cached info unless 'fresh'
     entries = []
     leaders = []
-    thrs = []
-    for server in urls:
-        thrs.append(threading.Thread(target=server_find_leader, args=(server[0], leaders, entries)))
-        thrs[-1].start()
-    for t in thrs:
-        t.join()
+    for result in peer_registry.results([server[0] for server in urls], fresh, deadline):
+        is_leader, found = server_find_leader(result)
+        if is_leader:
+            leaders.append(result[1])
+        entries.extend(found)
     leader_count = len(leaders)
     if leader_count == 0:
         entries.append(("Warning", "Currently there is NO leader / coordinator", None))
@@ -187,34 +247,50 @@ def find_leader(urls):
     return leaders, leader_count, entries
 
 
-def simulate_election(targets, election_type):     # Returns the starter server and a log entry in a tuple
+def simulate_election(targets, election_type, deadline=None):     # Returns the starter server and a log entry in a tuple
+    # Hedged like 'ask_resource'. A straggler may still start its election, which the others then answer 409 to
+    deadline = deadline or peer_client.new_deadline()
     random.shuffle(targets)
-    entries = []
     election = {
         "id": "LogServer_" + ''.join(random.choices(string.ascii_letters + string.digits, k=5)),
         "participantes": []
     }
-    for server in targets:
-        try:
-            entries.append(("Information", f"Making '{server}' start an election...", None))
-            response = requests.post(server + '/eleicao', json=election)
-            if response.status_code == 200:
-                entries.append(("Success",
-                                f"'{election_type}' Election '{election['id']}' request to server '{server}' was successful", election))
-                return entries
-            elif response.status_code == 400:
-                entries.append(("Error",
-                                f"The Log Server sent a request that wasn't accepted by '{server}' [400]", election))
-                return entries
-            elif response.status_code == 409:
-                entries.append(("Warning", f"There is an election already running [409]", None))
-                return entries
-            else:
-                entries.append(("Attention", f"'{server}' responded with the untreated code of [{response.status_code}]", election))
-        except requests.ConnectionError:
-            entries.append(("Attention", f"'{server}' couldn't be reached. Attempting another server...", None))
-        except Exception as exc:
-            entries.append(("Critical", f"'Uncaught exception: '{str(exc)}'", election))
-            return entries
-    entries.append(("Error", f"No server could be reached", election))
+
+    def start(server, dl):
+        return server_start_election(server, election, election_type, dl)
+    finished, concluded = peer_client.hedge(start, targets, deadline, lambda result: result[0])
+    entries = [entry for server, (done, server_entries) in finished for entry in server_entries]
+    if concluded:
+        return entries
+    if deadline.expired():
+        entries.append(("Attention", f"Service deadline of {deadline.seconds}s reached. No more servers asked", election))
+    else:
+        entries.append(("Error", f"No server could be reached", election))
     return entries
+
+
+def server_start_election(server, election, election_type, deadline):   # Returns tuple(<whether it concluded>, <log entries>)
+    entries = [("Information", f"Making '{server}' start an election...", None)]
+    try:
+        response = peer_client.post(server + '/eleicao', deadline, json=election)
+        if response.status_code == 200:
+            entries.append(("Success",
+                            f"'{election_type}' Election '{election['id']}' request to server '{server}' was successful", election))
+            return True, entries
+        elif response.status_code == 400:
+            entries.append(("Error",
+                            f"The Log Server sent a request that wasn't accepted by '{server}' [400]", election))
+            return True, entries
+        elif response.status_code == 409:
+            entries.append(("Warning", f"There is an election already running [409]", None))
+            return True, entries
+        else:
+            entries.append(("Attention", f"'{server}' responded with the untreated code of [{response.status_code}]", election))
+    except requests.Timeout:
+        entries.append(("Attention", f"'{server}' timed out. Attempting another server...", None))
+    except requests.ConnectionError:
+        entries.append(("Attention", f"'{server}' couldn't be reached. Attempting another server...", None))
+    except Exception as exc:
+        entries.append(("Critical", f"'Uncaught exception: '{str(exc)}'", election))
+        return True, entries
+    return False, entries
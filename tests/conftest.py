@@ -0,0 +1,28 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+class Entry:    # What the store, indexes and writer look at of a LogEntry
+    __slots__ = ("msg_id", "log_from", "severity", "severity_key", "user_shade", "comment", "ts", "body", "repeats",
+                 "last_ts")
+
+    def __init__(self, msg_id=None, log_from="a", severity_key="sev_default", comment="", ts=0.0, body=None):
+        self.msg_id = msg_id
+        self.log_from = log_from
+        self.severity = severity_key
+        self.severity_key = severity_key
+        self.user_shade = "usr_default"
+        self.comment = comment
+        self.ts = ts
+        self.body = body
+        self.repeats = 1
+        self.last_ts = ts
+
+    def __repr__(self):
+        return f"Entry({self.msg_id}, {self.log_from!r}, {self.severity_key!r})"
+
+
+def ids(entries):
+    return [entry.msg_id for entry in entries]
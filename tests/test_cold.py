@@ -0,0 +1,88 @@
+import itertools
+import random
+
+import pytest
+
+from conftest import Entry, ids
+from log_cold import ColdStore
+from log_search import SearchIndex
+from log_store import LogStore
+
+severities = ["sev_warning", "sev_error"]
+sources = ["a", "b", "c"]
+words = ["disk", "full", "timeout", "leader", "elected"]
+
+
+def encode(entry):
+    return [entry.msg_id, entry.log_from, entry.severity_key, entry.comment, entry.ts, entry.body]
+
+
+def decode(record):
+    return Entry(*record)
+
+
+@pytest.fixture(scope="module")
+def tiers():    # tuple(<store>, <cold store>, <every entry held by either, oldest first>)
+    rng = random.Random(4)
+    store = LogStore(40)
+    cold = ColdStore(encode, decode, block_size=16, max_entries=200, cache_blocks=2)
+    store.add_listener(cold.on_store_event)
+    for msg_id in range(500):
+        comment = " ".join(rng.sample(words, 2))
+        store.append(Entry(msg_id, rng.choice(sources), rng.choice(severities), comment, ts=float(msg_id)))
+    held = cold.oldest(0, 10 ** 6) + store.oldest(0, 40)
+    return store, cold, held
+
+
+def test_retention_drops_whole_blocks(tiers):
+    store, cold, held = tiers
+    assert cold.size()[0] > 0 and cold.dropped > 0
+    assert 200 - 16 < len(cold) <= 200 + 16
+    assert ids(held) == list(range(held[0].msg_id, 500))
+    assert held[0].msg_id % 16 == 0    # Retention drops whole blocks
+
+
+filters = [{}, {"severities": {"sev_error"}}, {"sources": {"a", "b"}}, {"severities": {"sev_warning"}, "sources": {"c"}}]
+bounds = [{}, {"min_id": 320, "max_id": 401}, {"start_ts": 305.0, "end_ts": 333.0}]
+
+
+@pytest.mark.parametrize("query", [dict(f, **b) for f, b in itertools.product(filters, bounds)])
+def test_cold_query_matches_brute_force(tiers, query):
+    store, cold, held = tiers
+    in_cold = held[:len(cold)]
+    matching = [entry for entry in in_cold
+                if (not query.get("severities") or entry.severity_key in query["severities"]) and
+                (not query.get("sources") or entry.log_from in query["sources"]) and
+                query.get("min_id", -1) <= entry.msg_id <= query.get("max_id", 10 ** 9) and
+                query.get("start_ts", -1) <= entry.ts < query.get("end_ts", 10 ** 9)]
+    for newest_first in (True, False):
+        expected = ids(matching[::-1] if newest_first else matching)
+        for offset in (0, 5, 15, 16, 17, 40, len(expected) - 1, len(expected)):
+            page, total = cold.query(offset=offset, count=20, newest_first=newest_first, **query)
+            assert total == len(expected)
+            assert ids(page) == expected[offset:offset + 20]
+
+
+def test_cold_cursors(tiers):
+    store, cold, held = tiers
+    in_cold = ids(held[:len(cold)])
+    for msg_id in (in_cold[0] - 1, in_cold[0], in_cold[15], in_cold[16], in_cold[-1]):
+        assert ids(cold.since(msg_id, 20)) == [i for i in in_cold if i > msg_id][:20]
+        assert ids(cold.before(msg_id, 20)) == [i for i in in_cold if i < msg_id][::-1][:20]
+
+
+@pytest.mark.parametrize("text", ["disk", "disk full", "lead*", "nothing"])
+def test_cold_search_matches_brute_force(tiers, text):
+    store, cold, held = tiers
+    groups = SearchIndex().parse(text)
+    expected = [entry.msg_id for entry in held[:len(cold)][::-1]
+                if all(any(word.startswith(term) if prefix else word == term for word in entry.comment.split())
+                       for term, prefix in groups)]
+    found = []
+    before = None
+    while True:     # Page by page, as '/log/search' does
+        page, before = cold.search(groups, before, limit=7)
+        found += ids(page)
+        if before is None:
+            break
+    assert found == expected
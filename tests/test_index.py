@@ -0,0 +1,50 @@
+import itertools
+import random
+
+import pytest
+
+from conftest import Entry, ids
+from log_index import LogIndex
+from log_store import LogStore
+
+severities = ["sev_warning", "sev_error", "sev_default"]
+sources = ["a", "b", "c", "d"]
+
+
+@pytest.fixture(scope="module")
+def indexed():  # tuple(<index>, <entries held, oldest first>), after evictions and a clear
+    rng = random.Random(3)
+    store = LogStore(300)
+    index = LogIndex()
+    store.add_listener(index.on_store_event)
+    next_id = 0
+    for round_size in (150, 0, 700):
+        if not round_size:
+            store.clear()
+            continue
+        for _ in range(round_size):
+            store.append(Entry(next_id, rng.choice(sources), rng.choice(severities), ts=next_id * 0.5))
+            next_id += rng.choice([1, 1, 2])     # Gaps, like entries rejected or folded
+    return index, store.oldest(0, 300)
+
+
+filters = [{}, {"severities": {"sev_error"}}, {"sources": {"a", "c"}}, {"severities": {"sev_error", "sev_warning"}},
+           {"severities": {"sev_error", "sev_default"}, "sources": {"b", "d", "zz"}}, {"sources": {"zz"}}]
+bounds = [{}, {"min_id": 400, "max_id": 700}, {"start_ts": 300.0, "end_ts": 420.5}, {"max_id": 10}]
+
+
+@pytest.mark.parametrize("query", [dict(f, **b) for f, b in itertools.product(filters, bounds)])
+def test_query_matches_brute_force(indexed, query):
+    index, held = indexed
+    matching = [entry for entry in held
+                if (not query.get("severities") or entry.severity_key in query["severities"]) and
+                (not query.get("sources") or entry.log_from in query["sources"]) and
+                entry.msg_id >= query.get("min_id", -1) and entry.msg_id <= query.get("max_id", 10 ** 9) and
+                entry.ts >= query.get("start_ts", -1) and entry.ts < query.get("end_ts", 10 ** 9)]
+    for newest_first in (True, False):
+        expected = ids(matching[::-1] if newest_first else matching)
+        for offset in [0, 1, 7, 19, 20, 133, len(expected) - 1, len(expected), len(expected) + 5]:
+            for count in (1, 20, 57):
+                page, total = index.query(offset=offset, count=count, newest_first=newest_first, **query)
+                assert total == len(expected)
+                assert ids(page) == expected[max(offset, 0):max(offset, 0) + count]
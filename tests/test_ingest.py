@@ -0,0 +1,62 @@
+import gzip
+import json
+
+import pytest
+
+from log_ingest import iter_body, iter_gunzip, iter_json_array, iter_ndjson
+
+items = [{"from": "a", "body": {"n": 4500000000.0, "s": "é ü"}}, 4500000000.0, -1.5e3, 12, 0, True, None, "x",
+         [1, 2.5e-7]]
+
+
+def split(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_json_array_chunk_boundaries(size):
+    data = json.dumps(items, ensure_ascii=False).encode("utf-8")
+    assert list(iter_json_array(split(data, size))) == [(True, item) for item in items]
+
+
+@pytest.mark.parametrize("size", [1, 2])
+def test_json_array_number_split_after_dot_or_exponent(size):
+    data = b"[4500000000.0, 1e5, {\"a\": 1}]"
+    assert list(iter_json_array(split(data, size))) == [(True, 4500000000.0), (True, 1e5), (True, {"a": 1})]
+
+
+@pytest.mark.parametrize("data", [b"[1 2]", b"[1,,2]", b"[1,]", b"[1] trailing", b"[1", b"[1,", b"{}"])
+@pytest.mark.parametrize("size", [1, 1000])
+def test_json_array_rejects_bad_grammar(data, size):
+    out = list(iter_json_array(split(data, size)))
+    assert out[-1][0] is False
+    assert all(ok for ok, value in out[:-1])
+
+
+@pytest.mark.parametrize("data", [b"[]", b"  [ ]  ", b"[1]\n"])
+def test_json_array_accepts_blanks(data):
+    assert all(ok for ok, value in iter_json_array(split(data, 1)))
+
+
+@pytest.mark.parametrize("size", [1, 5, 1000])
+def test_ndjson_chunk_boundaries(size):
+    data = "\n".join(json.dumps(item, ensure_ascii=False) for item in items).encode("utf-8") + b"\n\nnot json\n"
+    out = list(iter_ndjson(split(data, size)))
+    assert out[:-1] == [(True, item) for item in items]
+    assert out[-1][0] is False
+
+
+@pytest.mark.parametrize("size", [1, 1000])
+def test_body_sniffing(size):
+    assert list(iter_body(split(b"  \n[1, 2]", size))) == [(True, 1), (True, 2)]
+    assert list(iter_body(split(b"1\n2\n", size))) == [(True, 1), (True, 2)]
+
+
+def test_gunzip():
+    data = b"\n".join(b'{"n": %d}' % n for n in range(5000))
+    compressed = gzip.compress(data)
+    assert b"".join(iter_gunzip(split(compressed, 7), size=100)) == data
+    with pytest.raises(ValueError):
+        list(iter_gunzip([compressed[:len(compressed) // 2]]))
+    with pytest.raises(ValueError):
+        list(iter_gunzip([b"not gzip at all"]))
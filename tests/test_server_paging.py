@@ -0,0 +1,82 @@
+import json
+import os
+import random
+
+import pytest
+
+# Small tiers, so pages and cursors cross from the store into the cold tier. Set before the server module is loaded
+os.environ.update(LOG_CAPACITY="30", LOG_RETENTION_ENTRIES="400", PEER_REFRESH="0", LOG_REGISTRY="", LOG_SHIP_TO="")
+for name in ("LOG_DATA_DIR", "LOG_SHARED_SOCKET", "LOG_COALESCE"):
+    os.environ.pop(name, None)
+
+import log_server   # noqa: E402
+
+severities = ["Warning", "erro", "Information"]
+sources = ["https://x.local", "https://y.local", "https://z.local"]
+
+
+@pytest.fixture(scope="module")
+def client():
+    log_server.cold_store.block_size = 8
+    rng = random.Random(5)
+    items = [{"from": rng.choice(sources), "severity": rng.choice(severities), "comment": f"c{i}", "body": {"i": i}}
+             for i in range(250)]
+    client = log_server.app.test_client()
+    for start in range(0, len(items), 37):
+        response = client.post("/log/batch", data="\n".join(json.dumps(item) for item in items[start:start + 37]))
+        assert response.status_code == 200
+    assert len(log_server.cold_store) > 0 and log_server.cold_store.size()[0] > 0
+    return client
+
+
+def held(query):    # Every entry held matching 'query', oldest first, read tier by tier
+    everything = log_server.cold_store.oldest(0, 10 ** 6) + log_server.log_store.oldest(0, 10 ** 6)
+    keys = {log_server.registry.severity_key(name) for name in query.get("severity", "").split(",") if name}
+    return [entry.msg_id for entry in everything
+            if (not keys or entry.severity_key in keys) and
+            (not query.get("from") or entry.log_from in query["from"].split(","))]
+
+
+queries = [{}, {"severity": "Warning"}, {"from": "https://x.local,https://z.local"},
+           {"severity": "erro,Information", "from": "https://y.local"}]
+
+
+@pytest.mark.parametrize("query", queries)
+@pytest.mark.parametrize("epp", [7, 20, 1000])
+def test_pages_across_tiers(client, query, epp):
+    for path, newest_first in (("/log", True), ("/log/old", False)):
+        expected = held(query)[::-1] if newest_first else held(query)
+        seen = []
+        page = 1
+        while True:
+            out = json.loads(client.get(path, query_string=dict(query, format="json", epp=epp, p=page)).data)
+            assert out["count"] == len(expected)
+            seen += [entry[0] for entry in out["entries"]]
+            if page >= out["page_max"]:
+                break
+            page += 1
+        assert seen == expected
+
+
+@pytest.mark.parametrize("query", queries)
+@pytest.mark.parametrize("limit", [1, 9, 1000])
+def test_api_cursors_across_tiers(client, query, limit):
+    expected = held(query)
+    seen = []
+    args = dict(query, limit=limit)
+    while True:     # Newest first, following 'before_id'
+        out = json.loads(client.get("/api/log", query_string=args).data)
+        seen += [entry["id"] for entry in out["entries"]]
+        if out["next_before_id"] is None:
+            break
+        args["before_id"] = out["next_before_id"]
+    assert seen == expected[::-1]
+    seen = []
+    args = dict(query, limit=limit, since_id=-1)
+    while True:     # Oldest first, following 'since_id'
+        out = json.loads(client.get("/api/log", query_string=args).data)
+        if not out["entries"]:
+            break
+        seen += [entry["id"] for entry in out["entries"]]
+        args["since_id"] = out["next_since_id"]
+    assert seen == expected
@@ -0,0 +1,100 @@
+import random
+import threading
+
+from conftest import Entry, ids
+from log_store import LogStore, EVICT_REJECT, EVENT_APPEND, EVENT_EVICT, EVENT_CLEAR
+
+
+def check_reads(store, held):   # Every read against slicing the list of what is held, oldest first
+    assert len(store) == len(held)
+    assert ids(store.oldest(0, len(held) + 1)) == held
+    for offset in range(len(held) + 1):
+        for count in (1, 3, len(held) + 1):
+            assert ids(store.newest(offset, count)) == held[::-1][offset:offset + count]
+            assert ids(store.oldest(offset, count)) == held[offset:offset + count]
+    for msg_id in range(held[0] - 1 if held else -1, (held[-1] if held else 0) + 2):
+        assert ids(store.since(msg_id, 4)) == [i for i in held if i > msg_id][:4]
+        assert ids(store.before(msg_id, 4)) == [i for i in held if i < msg_id][::-1][:4]
+
+
+def test_reads_across_wraparound_and_clear():
+    rng = random.Random(1)
+    store = LogStore(7)
+    held = []
+    next_id = 0
+    for step in range(200):
+        if step % 37 == 36:
+            store.clear()
+            held = []
+        else:
+            size = rng.choice([1, 2, 5, 7, 9, 16])
+            store.extend([Entry(next_id + i) for i in range(size)])
+            held = (held + list(range(next_id, next_id + size)))[-7:]
+            next_id += size
+        check_reads(store, held)
+
+
+def test_reject_policy_keeps_the_oldest():
+    store = LogStore(5, EVICT_REJECT)
+    assert store.extend([Entry(i) for i in range(3)]) == 3
+    assert store.extend([Entry(i) for i in range(3, 6)]) == 2
+    assert not store.append(Entry(6))
+    check_reads(store, [0, 1, 2, 3, 4])
+    store.clear()
+    assert store.append(Entry(7))
+    check_reads(store, [7])
+
+
+def test_listeners_see_evictions_before_appends():
+    store = LogStore(3)
+    events = []
+    store.add_listener(lambda event, entries: events.append((event, ids(entries))))
+    store.extend([Entry(i) for i in range(3)])
+    store.extend([Entry(3), Entry(4)])
+    store.clear()
+    assert events == [(EVENT_APPEND, [0, 1, 2]), (EVENT_EVICT, [0, 1]), (EVENT_APPEND, [3, 4]), (EVENT_CLEAR, [])]
+
+
+def test_concurrent_reads_are_never_torn():
+    # Ids are consecutive and only ever grow, clears included, so any read done in one go is a run of consecutive
+    # ids. A read mixing slots from before and after a write or a clear would break the run
+    store = LogStore(64)
+    stop = threading.Event()
+    errors = []
+
+    def write():
+        next_id = 0
+        rng = random.Random(2)
+        while not stop.is_set():
+            if rng.random() < 0.02:
+                store.clear()
+            size = rng.randint(1, 40)
+            store.extend([Entry(next_id + i) for i in range(size)])
+            next_id += size
+
+    def read():
+        rng = random.Random(threading.get_ident())
+        while not stop.is_set():
+            count = rng.randint(1, 64)
+            kind = rng.randrange(4)
+            if kind == 0:
+                out = ids(store.newest(rng.randint(0, 10), count))[::-1]
+            elif kind == 1:
+                out = ids(store.oldest(rng.randint(0, 10), count))
+            elif kind == 2:
+                last = store.last()
+                out = ids(store.since(last.msg_id - count if last else -1, count))
+            else:
+                last = store.last()
+                out = ids(store.before(last.msg_id + 1 if last else 0, count))[::-1]
+            if out and out != list(range(out[0], out[0] + len(out))):
+                errors.append(out)
+
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    threading.Event().wait(1.5)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert errors == []
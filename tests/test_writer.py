@@ -0,0 +1,89 @@
+import pytest
+
+from conftest import Entry, ids
+from log_store import LogStore, EVICT_REJECT, EVENT_UPDATE
+from log_writer import LogWriter
+
+
+@pytest.fixture
+def make_writer():
+    writers = []
+
+    def make(capacity=100, coalesce=None, policy=None):
+        store = LogStore(capacity, policy) if policy else LogStore(capacity)
+        writer = LogWriter(store, coalesce=coalesce)
+        writer.start()
+        writers.append(writer)
+        return store, writer
+    yield make
+    for writer in writers:
+        writer.close()
+
+
+def entries(comments, source="a"):
+    return [Entry(log_from=source, comment=comment) for comment in comments]
+
+
+def held(store):
+    return [(entry.msg_id, entry.comment, entry.repeats) for entry in store.oldest(0, store.capacity)]
+
+
+def test_ids_and_times_follow_store_order(make_writer):
+    store, writer = make_writer()
+    assert writer.extend(entries("abc")) == 3
+    assert writer.append(Entry(comment="d"))
+    stored = store.oldest(0, 10)
+    assert ids(stored) == [0, 1, 2, 3]
+    assert all(older.ts <= newer.ts for older, newer in zip(stored, stored[1:]))
+
+
+def test_runs_fold_into_the_newest_entry_only(make_writer):
+    store, writer = make_writer(coalesce=0)
+    updates = []
+    store.add_listener(lambda event, folded: updates.extend(ids(folded)) if event == EVENT_UPDATE else None)
+    writer.extend(entries("aab"))
+    writer.extend(entries("bba"))
+    writer.append(Entry(log_from="other", comment="a"))     # Same comment, another source
+    assert held(store) == [(0, "a", 2), (1, "b", 3), (2, "a", 1), (3, "a", 1)]
+    assert updates == [1, 1]    # Once per repeat folded into an entry already stored
+
+
+def test_window_folds_into_any_recent_entry(make_writer):
+    store, writer = make_writer(coalesce=60)
+    producer = entries("abab")
+    assert writer.extend(producer) == 4
+    assert ids(producer) == [0, 1, 0, 1]    # Producers get the id of the entry theirs was folded into
+    writer.extend(entries("ca"))
+    assert held(store) == [(0, "a", 3), (1, "b", 2), (2, "c", 1)]
+
+
+def test_never_folds_into_an_entry_the_commit_evicts(make_writer):
+    store, writer = make_writer(capacity=3, coalesce=60)
+    writer.extend(entries("abc"))
+    writer.extend(entries("ad"))
+    assert sum(entry.repeats for entry in store.oldest(0, 3)) == 3
+    assert [entry.comment for entry in store.oldest(0, 3)] == ["c", "a", "d"]
+
+
+def test_reject_policy(make_writer):
+    store, writer = make_writer(capacity=3, policy=EVICT_REJECT)
+    batch = entries("abcde")
+    assert writer.extend(batch) == 3
+    assert ids(batch) == [0, 1, 2, None, None]
+    assert not writer.append(Entry(comment="f"))
+    assert held(store) == [(0, "a", 1), (1, "b", 1), (2, "c", 1)]
+
+
+def test_reject_policy_still_folds(make_writer):
+    store, writer = make_writer(capacity=2, coalesce=0, policy=EVICT_REJECT)
+    assert writer.extend(entries("abbb")) == 4
+    assert not writer.append(Entry(comment="c"))
+    assert held(store) == [(0, "a", 1), (1, "b", 3)]
+
+
+def test_clear_starts_over_but_keeps_the_ids_going(make_writer):
+    store, writer = make_writer(coalesce=0)
+    writer.extend(entries("aa"))
+    writer.clear(Entry(comment="a"))
+    writer.append(Entry(comment="a"))
+    assert held(store) == [(1, "a", 2)]